@@ -1,38 +1,30 @@
 import os
 import logging
-from flask import Flask
-from models import db
+import startup
+from database import app, init_schema
+from metrics import instrument_flask
+from query_inspector import inspect_requests
+from tracing import trace_requests
+from replicas import route_requests
+from log_config import configure_logging
 
-# Create Flask app
-app = Flask(__name__)
+# Admin panel configuration on top of the shared database app
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-
-# Configure database
-database_url = os.environ.get("DATABASE_URL")
-if database_url:
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-else:
-    # Fallback to SQLite for development
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///bot.db"
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Initialize database
-db.init_app(app)
+instrument_flask(app)
+inspect_requests(app)
+trace_requests(app)
+route_requests(app)
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
-
-# Create tables
-with app.app_context():
-    db.create_all()
+configure_logging()
 
 # Import routes after app creation to avoid circular imports
 from routes import *
 
+startup.mark('imports')
+logging.getLogger(__name__).info("Admin panel %s", startup.summary())
+
 if __name__ == "__main__":
+    # The development server creates the schema itself; deploys run `python manage.py init-db`
+    init_schema()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,179 @@
+"""
+Rule-based auto-categorization of pending files
+Rules match on filename regex, extension, mime type and size range. Active rules
+are compiled once per change and evaluated against whole batches of files.
+"""
+import fnmatch
+import logging
+import os
+import re
+import threading
+from sqlalchemy import select, func
+from models import db, Category, CategoryRule, PendingFile
+from catalog import bulk_assign_pending
+
+logger = logging.getLogger(__name__)
+
+# Pending files classified per round when applying rules
+APPLY_BATCH_SIZE = 500
+
+def parse_extensions(value) -> frozenset:
+    """Turn 'apk, .xapk ,zip' into {'apk', 'xapk', 'zip'}"""
+    if not value:
+        return frozenset()
+    return frozenset(ext.strip().lstrip('.').lower() for ext in value.split(',') if ext.strip())
+
+class CompiledRule:
+    """A category rule with its patterns compiled for repeated evaluation"""
+    __slots__ = ('id', 'category_id', 'priority', 'name_regex', 'extensions', 'mime_regex',
+                 'min_size', 'max_size')
+
+    def __init__(self, rule):
+        self.id = rule.id
+        self.category_id = rule.category_id
+        self.priority = rule.priority if rule.priority is not None else 100
+        self.name_regex = re.compile(rule.name_pattern, re.IGNORECASE) if rule.name_pattern else None
+        self.extensions = parse_extensions(rule.extensions)
+        # Mime patterns are globs such as "application/vnd.android.*"
+        self.mime_regex = re.compile(fnmatch.translate(rule.mime_pattern.lower())) if rule.mime_pattern else None
+        self.min_size = rule.min_size
+        self.max_size = rule.max_size
+
+    def matches(self, name: str, extension: str, mime_type: str, size) -> bool:
+        if self.extensions and extension not in self.extensions:
+            return False
+        if self.min_size is not None and (size is None or size < self.min_size):
+            return False
+        if self.max_size is not None and (size is None or size > self.max_size):
+            return False
+        if self.mime_regex and not (mime_type and self.mime_regex.match(mime_type.lower())):
+            return False
+        if self.name_regex and not self.name_regex.search(name or ''):
+            return False
+        return True
+
+class RuleSet:
+    """Active rules in evaluation order; the first matching rule wins"""
+
+    def __init__(self, rules):
+        self.rules = sorted((CompiledRule(rule) for rule in rules), key=lambda r: r.priority)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, name: str, mime_type: str = None, size=None):
+        """Return the first matching rule, or None"""
+        extension = os.path.splitext(name or '')[1].lstrip('.').lower()
+        for rule in self.rules:
+            if rule.matches(name, extension, mime_type, size):
+                return rule
+        return None
+
+    def classify(self, rows):
+        """Return (row, rule) pairs for the rows of a batch that match a rule
+
+        Rows are mappings with name, mime_type and size.
+        """
+        matches = []
+        for row in rows:
+            rule = self.match(row['name'], row.get('mime_type'), row.get('size'))
+            if rule:
+                matches.append((row, rule))
+        return matches
+
+def validate_rule(rule):
+    """Raise ValueError when a rule has no conditions or invalid values"""
+    if not rule.category_id:
+        raise ValueError('Target category is required')
+    if not any([rule.name_pattern, rule.extensions, rule.mime_pattern,
+                rule.min_size is not None, rule.max_size is not None]):
+        raise ValueError('A rule needs at least one condition')
+    if rule.name_pattern:
+        try:
+            re.compile(rule.name_pattern)
+        except re.error as e:
+            raise ValueError(f'Invalid filename pattern: {e}')
+    if rule.min_size is not None and rule.max_size is not None and rule.min_size > rule.max_size:
+        raise ValueError('Minimum size is larger than maximum size')
+
+_cache_lock = threading.Lock()
+_cached_signature = None
+_cached_ruleset = RuleSet([])
+
+def get_ruleset() -> RuleSet:
+    """Return the compiled active rules, recompiling only when the rules table changed"""
+    global _cached_signature, _cached_ruleset
+    signature = tuple(db.session.execute(
+        select(func.count(CategoryRule.id), func.max(CategoryRule.updated_at))
+    ).one())
+    with _cache_lock:
+        if signature != _cached_signature:
+            rules = db.session.scalars(
+                select(CategoryRule).where(CategoryRule.is_active.is_(True)).order_by(CategoryRule.created_at)
+            ).all()
+            _cached_ruleset = RuleSet(rules)
+            _cached_signature = signature
+            logger.info(f"Compiled {len(_cached_ruleset.rules)} category rule(s)")
+        return _cached_ruleset
+
+def _pending_batches():
+    """Yield pending files as dicts in keyset-ordered batches"""
+    last_id = ''
+    while True:
+        rows = db.session.execute(
+            select(PendingFile.id, PendingFile.name, PendingFile.mime_type, PendingFile.size)
+            .where(PendingFile.id > last_id)
+            .order_by(PendingFile.id)
+            .limit(APPLY_BATCH_SIZE)
+        ).mappings().all()
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield rows
+
+def preview(limit: int = 200):
+    """Dry run: list pending files that the current rules would categorize"""
+    ruleset = get_ruleset()
+    if not ruleset:
+        return []
+    category_names = dict(db.session.execute(select(Category.id, Category.name)).all())
+    results = []
+    for rows in _pending_batches():
+        for row, rule in ruleset.classify(rows):
+            results.append({
+                'pending_id': row['id'],
+                'name': row['name'],
+                'rule_id': rule.id,
+                'category_id': rule.category_id,
+                'category_name': category_names.get(rule.category_id, 'Unknown'),
+            })
+            if len(results) >= limit:
+                return results
+    return results
+
+def apply_rules(progress=None) -> int:
+    """Assign every matching pending file to its rule's category; commits per batch and then
+    calls progress(assigned, total) when given"""
+    ruleset = get_ruleset()
+    if not ruleset:
+        return 0
+    assigned = 0
+    # Collect first: assigning deletes from pending_files, which would shift the keyset scan
+    by_category = {}
+    for rows in _pending_batches():
+        for row, rule in ruleset.classify(rows):
+            by_category.setdefault(rule.category_id, []).append(row['id'])
+
+    total = sum(len(pending_ids) for pending_ids in by_category.values())
+    for category_id, pending_ids in by_category.items():
+        for start in range(0, len(pending_ids), APPLY_BATCH_SIZE):
+            try:
+                assigned += bulk_assign_pending(pending_ids[start:start + APPLY_BATCH_SIZE], category_id)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            if progress:
+                progress(assigned, total)
+    logger.info(f"Auto-categorized {assigned} pending file(s)")
+    return assigned
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Storage micro-benchmarks
+Times add/get/update/delete of categories, files and subscribers, plus the
+recursive category delete, against the JSON storage.Storage and the SQL models
+at several dataset sizes. Prints a comparison table and can save the results as
+a baseline and compare later runs against it.
+
+Usage: python bench_storage.py [--sizes 100,1000,10000] [--repeat 20]
+                               [--database-url URL] [--save baseline.json] [--compare baseline.json]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = [
+    'add_category', 'get_category', 'update_category',
+    'add_file', 'get_file', 'get_files_by_category', 'update_file', 'delete_file',
+    'add_subscriber', 'update_subscriber', 'get_active_subscribers',
+    'delete_category',
+]
+# Compared runs slower than the baseline by more than this fraction are flagged
+REGRESSION_THRESHOLD = 0.25
+
+def dataset(size: int, rng: random.Random):
+    """size files and subscribers over size/10 categories, a third of them nested"""
+    now = datetime.utcnow().isoformat()
+    categories = []
+    for index in range(max(1, size // 10)):
+        parent = rng.choice(categories)['id'] if categories and index % 3 == 2 else None
+        categories.append({'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)), 'name': f'Category {index}',
+                           'description': None, 'parent_id': parent, 'created_at': now})
+    files = [{'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)), 'name': f'File {index}.apk',
+              'category_id': rng.choice(categories)['id'], 'telegram_file_id': f'bench-{index}',
+              'description': None, 'size': rng.randint(1000, 10**8), 'mime_type': 'application/zip',
+              'created_at': now} for index in range(size)]
+    subscribers = [{'user_id': 10**8 + index, 'first_name': f'User {index}', 'username': f'user{index}',
+                    'joined_at': now, 'is_active': True} for index in range(size)]
+    return categories, files, subscribers
+
+class JsonBackend:
+    """storage.Storage in a temporary data directory"""
+    name = 'json'
+
+    def __init__(self):
+        from storage import Storage
+        self.data_dir = tempfile.mkdtemp(prefix='bench-storage-')
+        self.storage = Storage(data_dir=self.data_dir)
+
+    def load(self, categories, files, subscribers):
+        self.storage._save_json(self.storage.categories_file, categories)
+        self.storage._save_json(self.storage.files_file, files)
+        self.storage._save_json(self.storage.subscribers_file, subscribers)
+
+    def close(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def add_category(self, name, parent_id=None):
+        return self.storage.add_category(name, parent_id=parent_id)
+
+    def get_category(self, category_id):
+        return self.storage.get_category(category_id)
+
+    def update_category(self, category_id, name):
+        return self.storage.update_category(category_id, name=name)
+
+    def add_file(self, name, category_id):
+        return self.storage.add_file(name, category_id, telegram_file_id='bench', size=1000)
+
+    def get_file(self, file_id):
+        return self.storage.get_file(file_id)
+
+    def get_files_by_category(self, category_id):
+        return self.storage.get_files_by_category(category_id)
+
+    def update_file(self, file_id, description):
+        return self.storage.update_file(file_id, description=description)
+
+    def delete_file(self, file_id):
+        return self.storage.delete_file(file_id)
+
+    def add_subscriber(self, user_id):
+        return self.storage.add_subscriber(user_id, first_name='Bench')
+
+    def get_active_subscribers(self):
+        return self.storage.get_active_subscribers()
+
+    def delete_category(self, category_id):
+        return self.storage.delete_category(category_id)
+
+class SqlBackend:
+    """The SQLAlchemy models, queried the way routes.py and the bot do"""
+    name = 'sql'
+
+    def __init__(self):
+        from database import app, init_schema
+        from models import db
+        init_schema()
+        self.app = app
+        self.db = db
+        self.context = app.app_context()
+        self.context.push()
+        self.name = f'sql:{db.engine.dialect.name}'
+
+    def _clear(self):
+        from models import Category, File, Subscriber, CategoryRule, FileDownloadStat
+        for model in (FileDownloadStat, CategoryRule, File, Subscriber):
+            self.db.session.query(model).delete()
+        # Children before parents, so the self-referencing foreign key holds
+        while self.db.session.query(Category).count():
+            self.db.session.query(Category).filter(
+                ~Category.id.in_(self.db.session.query(Category.parent_id).filter(Category.parent_id.isnot(None)))
+            ).delete(synchronize_session=False)
+        self.db.session.commit()
+
+    def load(self, categories, files, subscribers):
+        from sqlalchemy import insert
+        from models import Category, File, Subscriber
+        self._clear()
+        def rows(items):
+            return [{key: datetime.fromisoformat(value) if key in ('created_at', 'joined_at') else value
+                     for key, value in item.items()} for item in items]
+        self.db.session.execute(insert(Category), rows(categories))
+        for start in range(0, len(files), 5000):
+            self.db.session.execute(insert(File), rows(files[start:start + 5000]))
+        for start in range(0, len(subscribers), 5000):
+            self.db.session.execute(insert(Subscriber), rows(subscribers[start:start + 5000]))
+        self.db.session.commit()
+
+    def close(self):
+        self._clear()
+        self.context.pop()
+
+    def add_category(self, name, parent_id=None):
+        from models import Category
+        category = Category(name=name, parent_id=parent_id)
+        self.db.session.add(category)
+        self.db.session.commit()
+        return category.id
+
+    def get_category(self, category_id):
+        from models import Category
+        category = self.db.session.get(Category, category_id)
+        return category.to_dict() if category else None
+
+    def update_category(self, category_id, name):
+        from models import Category
+        category = self.db.session.get(Category, category_id)
+        category.name = name
+        self.db.session.commit()
+        return True
+
+    def add_file(self, name, category_id):
+        from models import File
+        file = File(name=name, category_id=category_id, telegram_file_id='bench', size=1000)
+        self.db.session.add(file)
+        self.db.session.commit()
+        return file.id
+
+    def get_file(self, file_id):
+        from models import File
+        file = self.db.session.get(File, file_id)
+        return file.to_dict() if file else None
+
+    def get_files_by_category(self, category_id):
+        from models import File
+        return [file.to_dict() for file in File.query.filter_by(category_id=category_id).all()]
+
+    def update_file(self, file_id, description):
+        from models import File
+        file = self.db.session.get(File, file_id)
+        file.description = description
+        self.db.session.commit()
+        return True
+
+    def delete_file(self, file_id):
+        from models import File
+        deleted = File.query.filter_by(id=file_id).delete()
+        self.db.session.commit()
+        return bool(deleted)
+
+    def add_subscriber(self, user_id):
+        from models import Subscriber
+        subscriber = Subscriber.query.filter_by(user_id=user_id).first()
+        if subscriber:
+            subscriber.is_active = True
+        else:
+            self.db.session.add(Subscriber(user_id=user_id, first_name='Bench'))
+        self.db.session.commit()
+
+    def get_active_subscribers(self):
+        from models import Subscriber
+        return [sub.to_dict() for sub in Subscriber.query.filter_by(is_active=True).all()]
+
+    def delete_category(self, category_id):
+        from models import Category, File
+        # Same per-node walk as the admin panel's delete_category
+        def delete_subcategories(parent_id):
+            for subcat in Category.query.filter_by(parent_id=parent_id).all():
+                delete_subcategories(subcat.id)
+                File.query.filter_by(category_id=subcat.id).delete()
+                self.db.session.delete(subcat)
+        File.query.filter_by(category_id=category_id).delete()
+        delete_subcategories(category_id)
+        self.db.session.delete(self.db.session.get(Category, category_id))
+        self.db.session.commit()
+        return True
+
+def _time(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def run_operations(backend, categories, files, subscribers, repeat: int, rng: random.Random):
+    """Return {operation: [seconds per call]} for one backend at one dataset size"""
+    timings = {operation: [] for operation in OPERATIONS}
+    category_ids = [category['id'] for category in categories]
+    file_ids = [file['id'] for file in files]
+    for index in range(repeat):
+        category_id = rng.choice(category_ids)
+        file_id = rng.choice(file_ids)
+        timings['add_category'].append(_time(backend.add_category, f'Bench category {index}'))
+        timings['get_category'].append(_time(backend.get_category, category_id))
+        timings['update_category'].append(_time(backend.update_category, category_id, f'Renamed {index}'))
+        timings['add_file'].append(_time(backend.add_file, f'Bench file {index}', category_id))
+        timings['get_file'].append(_time(backend.get_file, file_id))
+        timings['get_files_by_category'].append(_time(backend.get_files_by_category, category_id))
+        timings['update_file'].append(_time(backend.update_file, file_id, f'Updated {index}'))
+        timings['delete_file'].append(_time(backend.delete_file, file_ids.pop(rng.randrange(len(file_ids)))))
+        timings['add_subscriber'].append(_time(backend.add_subscriber, 2 * 10**8 + index))
+        timings['update_subscriber'].append(_time(backend.add_subscriber, subscribers[index % len(subscribers)]['user_id']))
+        timings['get_active_subscribers'].append(_time(backend.get_active_subscribers))
+
+        # A fresh subtree of 1 + 3 + 9 categories with files, built untimed and deleted timed
+        root = backend.add_category(f'Subtree {index}')
+        level = [root]
+        for _ in range(2):
+            level = [backend.add_category(f'Child {index}', parent) for parent in level for _ in range(3)]
+        for parent in level:
+            backend.add_file(f'Subtree file {index}', parent)
+        timings['delete_category'].append(_time(backend.delete_category, root))
+    return timings
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'mean_ms': round(sum(values) / len(values) * 1000, 4),
+        'median_ms': round(values[len(values) // 2] * 1000, 4),
+        'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 4),
+    }
+
+def benchmark(sizes, repeat: int, seed: int):
+    """Run every backend at every size; returns {backend: {size: {operation: summary}}}"""
+    results = {}
+    for backend_class in (JsonBackend, SqlBackend):
+        backend = backend_class()
+        try:
+            for size in sizes:
+                rng = random.Random(seed)
+                categories, files, subscribers = dataset(size, rng)
+                backend.load(categories, files, subscribers)
+                started = time.perf_counter()
+                timings = run_operations(backend, categories, files, subscribers, repeat, rng)
+                logger.info(f"{backend.name} at {size}: {time.perf_counter() - started:.1f}s")
+                results.setdefault(backend.name, {})[str(size)] = {
+                    operation: summarize(values) for operation, values in timings.items()
+                }
+        finally:
+            backend.close()
+    return results
+
+def format_table(results, baseline=None) -> str:
+    """One row per operation, median ms per backend and size; +x% against the baseline when given"""
+    backends = list(results)
+    sizes = list(next(iter(results.values())))
+    columns = [(backend, size) for size in sizes for backend in backends]
+    header = f"{'operation':<24}" + ''.join(f"{f'{backend} n={size}':>22}" for backend, size in columns)
+    lines = [header, '-' * len(header)]
+    for operation in OPERATIONS:
+        cells = []
+        for backend, size in columns:
+            median = results[backend][size][operation]['median_ms']
+            cell = f"{median:.3f}"
+            old = (baseline or {}).get(backend, {}).get(size, {}).get(operation)
+            if old and old['median_ms']:
+                cell += f" ({(median - old['median_ms']) / old['median_ms']:+.0%})"
+            cells.append(f"{cell:>22}")
+        lines.append(f"{operation:<24}" + ''.join(cells))
+    lines.append("\nmedian milliseconds per call")
+    return '\n'.join(lines)
+
+def regressions(results, baseline, threshold: float = REGRESSION_THRESHOLD):
+    """(backend, size, operation, ratio) for operations whose median got slower than threshold allows"""
+    found = []
+    for backend, sizes in results.items():
+        for size, operations in sizes.items():
+            for operation, summary in operations.items():
+                old = baseline.get(backend, {}).get(size, {}).get(operation)
+                if old and old['median_ms'] and summary['median_ms'] > old['median_ms'] * (1 + threshold):
+                    found.append((backend, size, operation, summary['median_ms'] / old['median_ms']))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark storage.Storage against the SQL models")
+    parser.add_argument('--sizes', default='100,1000,10000', help="comma separated dataset sizes")
+    parser.add_argument('--repeat', type=int, default=20, help="calls per operation and size")
+    parser.add_argument('--database-url', help="SQL database to benchmark (default: a temporary SQLite file); "
+                                               "its categories, files and subscribers are deleted")
+    parser.add_argument('--save', help="write the results to this baseline file")
+    parser.add_argument('--compare', help="baseline file to compare against; exits 1 on regressions")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    os.environ.setdefault("DB_PROFILE", "batch")
+
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    logger.setLevel(logging.INFO)
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench-sql-'), 'bench.db')}"
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = benchmark(sizes, args.repeat, args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print(format_table(results, baseline))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': datetime.utcnow().isoformat(), 'sizes': sizes, 'repeat': args.repeat,
+                       'results': results}, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+    if baseline is not None:
+        found = regressions(results, baseline)
+        for backend, size, operation, ratio in found:
+            print(f"REGRESSION {backend} n={size} {operation}: {ratio:.2f}x baseline")
+        if found:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Processed update ids persisted across bot restarts
+The ids of recently processed updates are kept in memory and flushed to the
+bot_state table, so updates Telegram redelivers after a crash are skipped
+instead of handled twice. Only a bounded window of recent ids is remembered,
+not a high-water mark: Telegram may restart its id sequence after a quiet week
+or for a new token, and an offset kept forever would then drop all traffic.
+Updates still queued when a shutdown runs out of time are saved as JSON and
+replayed on the next start.
+"""
+import json
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Optional
+from models import db, BotState
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_KEY = 'processed_updates'
+PENDING_KEY = 'pending_updates'
+# Seconds between flushes; a crash may reprocess at most this much
+FLUSH_INTERVAL = 2
+# Ids remembered; Telegram redelivers at most the unconfirmed getUpdates batches (100 each)
+RECENT_UPDATES = 1000
+
+def get_state(name: str) -> Optional[str]:
+    from database import app
+    with app.app_context():
+        row = db.session.get(BotState, name)
+        return row.value if row else None
+
+def set_state(name: str, value: Optional[str]):
+    from database import app
+    with app.app_context():
+        row = db.session.get(BotState, name)
+        if row is None:
+            db.session.add(BotState(name=name, value=value))
+        else:
+            row.value = value
+        db.session.commit()
+
+class ProcessedUpdates:
+    """Ids of the most recently processed updates, buffered in memory and flushed periodically"""
+
+    def __init__(self, size: int = RECENT_UPDATES):
+        self._ids = deque(maxlen=size)
+        self._seen = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        """Restore the ids saved by the last run; returns how many were loaded"""
+        value = get_state(PROCESSED_KEY)
+        with self._lock:
+            self._ids.clear()
+            self._ids.extend(json.loads(value) if value else ())
+            self._seen = set(self._ids)
+            self._dirty = False
+            return len(self._ids)
+
+    def is_processed(self, update_id: int) -> bool:
+        return update_id in self._seen
+
+    def mark(self, update_id: int):
+        with self._lock:
+            if update_id in self._seen:
+                return
+            if len(self._ids) == self._ids.maxlen:
+                self._seen.discard(self._ids[0])
+            self._ids.append(update_id)
+            self._seen.add(update_id)
+            self._dirty = True
+
+    def flush(self) -> bool:
+        """Write the ids if any were added; returns whether anything was written"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            ids = list(self._ids)
+            self._dirty = False
+        try:
+            set_state(PROCESSED_KEY, json.dumps(ids))
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            raise
+        return True
+
+    def save_pending(self, updates):
+        """Store unprocessed updates (as Bot API dicts) for the next start"""
+        set_state(PENDING_KEY, json.dumps(updates) if updates else None)
+
+    def take_pending(self):
+        """Return and clear the updates saved by the last shutdown"""
+        value = get_state(PENDING_KEY)
+        if not value:
+            return []
+        set_state(PENDING_KEY, None)
+        return json.loads(value)
+
+async def run_flush_loop(processed: ProcessedUpdates, interval: float = FLUSH_INTERVAL):
+    """Flush the processed ids forever; cancel to stop"""
+    while True:
+        try:
+            await asyncio.to_thread(processed.flush)
+        except Exception as e:
+            logger.error(f"Error saving processed update ids: {e}")
+        await asyncio.sleep(interval)
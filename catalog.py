@@ -0,0 +1,219 @@
+"""
+Catalog queries shared by the admin panel routes
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import (
+    select, insert, update, delete, literal, literal_column, or_, and_, func, String, Text, DateTime
+)
+from models import db, Category, File, PendingFile
+from file_cache import invalidate_files
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Sort keys exposed by the files API, mapped to the column expression used for keyset paging
+SORT_KEYS = {
+    'name': File.name,
+    # Literal 0 rather than a bound parameter, so the query matches the ix_files_size_id expression index
+    'size': func.coalesce(File.size, literal_column('0')),
+    'date': File.created_at,
+}
+
+def _like_pattern(text: str) -> str:
+    """Build a LIKE pattern matching text anywhere, with wildcards escaped"""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def encode_cursor(sort: str, value, file_id: str) -> str:
+    """Encode the last row of a page as an opaque cursor"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, value, file_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, sort: str):
+    """Decode a cursor into (value, file_id), validating it belongs to the same sort"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, file_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort:
+        raise ValueError('Cursor does not match sort order')
+    expected = int if sort == 'size' else str
+    if not isinstance(value, expected) or isinstance(value, bool) or not isinstance(file_id, str):
+        raise ValueError('Invalid cursor')
+    if sort in ('date', 'uploaded'):
+        try:
+            value = datetime.fromisoformat(value)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+    return value, file_id
+
+def list_files(sort: str = 'date', order: str = 'desc', cursor: str = None, limit: int = DEFAULT_PAGE_SIZE,
+               category_id: str = None, mime_type: str = None, text: str = None):
+    """Return one page of files with category names, using keyset pagination"""
+    if sort not in SORT_KEYS:
+        raise ValueError(f'Unknown sort key: {sort}')
+    if order not in ('asc', 'desc'):
+        raise ValueError(f'Unknown sort order: {order}')
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    sort_key = SORT_KEYS[sort]
+    query = (
+        select(
+            File.id, File.name, File.category_id, File.telegram_file_id, File.description,
+            File.size, File.mime_type, File.created_at, sort_key.label('sort_value'),
+            Category.name.label('category_name'),
+        )
+        .outerjoin(Category, File.category_id == Category.id)
+    )
+
+    # Filters
+    if category_id:
+        query = query.where(File.category_id == category_id)
+    if mime_type:
+        if mime_type.endswith('/*'):
+            query = query.where(File.mime_type.like(mime_type[:-1] + '%'))
+        else:
+            query = query.where(File.mime_type == mime_type)
+    if text:
+        pattern = _like_pattern(text)
+        query = query.where(or_(
+            File.name.ilike(pattern, escape='\\'),
+            File.description.ilike(pattern, escape='\\'),
+        ))
+
+    # Keyset: continue strictly after the (sort value, id) of the previous page's last row
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        if order == 'asc':
+            query = query.where(or_(sort_key > value, and_(sort_key == value, File.id > last_id)))
+        else:
+            query = query.where(or_(sort_key < value, and_(sort_key == value, File.id < last_id)))
+
+    if order == 'asc':
+        query = query.order_by(sort_key.asc(), File.id.asc())
+    else:
+        query = query.order_by(sort_key.desc(), File.id.desc())
+
+    # Fetch one extra row to know whether another page exists
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [{
+        'id': row.id,
+        'name': row.name,
+        'category_id': row.category_id,
+        'category_name': row.category_name or 'Unknown',
+        'telegram_file_id': row.telegram_file_id,
+        'description': row.description,
+        'size': row.size,
+        'mime_type': row.mime_type,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+    } for row in rows]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, last.sort_value, last.id)
+
+    return {'items': items, 'next_cursor': next_cursor}
+
+def list_pending(cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    """Return one page of pending files, newest first, using keyset pagination"""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = select(PendingFile)
+    if cursor:
+        uploaded_at, last_id = decode_cursor(cursor, 'uploaded')
+        query = query.where(or_(PendingFile.uploaded_at < uploaded_at,
+                                and_(PendingFile.uploaded_at == uploaded_at, PendingFile.id < last_id)))
+    query = query.order_by(PendingFile.uploaded_at.desc(), PendingFile.id.desc())
+
+    # Fetch one extra row to know whether another page exists
+    rows = db.session.execute(query.limit(limit + 1)).scalars().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = encode_cursor('uploaded', rows[-1].uploaded_at, rows[-1].id)
+    return {'items': [row.to_dict() for row in rows], 'next_cursor': next_cursor}
+
+# Keep IN (...) lists well below SQLite's bound parameter limit
+BULK_CHUNK_SIZE = 500
+
+def _chunks(ids):
+    """Split a list of ids into chunks for IN (...) clauses"""
+    ids = list(dict.fromkeys(i for i in ids if i))
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        yield ids[start:start + BULK_CHUNK_SIZE]
+
+def bulk_assign_pending(pending_ids, category_id: str, description: str = None) -> int:
+    """Move pending files into a category with INSERT ... SELECT, then delete them from pending"""
+    assigned = 0
+    now = datetime.utcnow()
+    for chunk in _chunks(pending_ids):
+        # The pending id is reused as the file id, so no per-row id generation is needed
+        source = select(
+            PendingFile.id,
+            PendingFile.name,
+            literal(category_id, String),
+            PendingFile.telegram_file_id,
+            PendingFile.file_unique_id,
+            literal(description or None, Text),
+            PendingFile.size,
+            PendingFile.mime_type,
+            literal(now, DateTime),
+        ).where(PendingFile.id.in_(chunk))
+        db.session.execute(insert(File).from_select(
+            ['id', 'name', 'category_id', 'telegram_file_id', 'file_unique_id', 'description', 'size',
+             'mime_type', 'created_at'],
+            source
+        ))
+        result = db.session.execute(
+            delete(PendingFile).where(PendingFile.id.in_(chunk)).execution_options(synchronize_session=False)
+        )
+        assigned += result.rowcount
+    return assigned
+
+def bulk_move_files(file_ids, category_id: str) -> int:
+    """Move files to another category"""
+    moved = 0
+    file_ids = list(file_ids)
+    invalidate_files(file_ids)
+    for chunk in _chunks(file_ids):
+        result = db.session.execute(
+            update(File).where(File.id.in_(chunk)).values(category_id=category_id)
+            .execution_options(synchronize_session=False)
+        )
+        moved += result.rowcount
+    return moved
+
+def bulk_update_description(file_ids, description: str) -> int:
+    """Set the same description on many files"""
+    updated = 0
+    file_ids = list(file_ids)
+    invalidate_files(file_ids)
+    for chunk in _chunks(file_ids):
+        result = db.session.execute(
+            update(File).where(File.id.in_(chunk)).values(description=description)
+            .execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount
+    return updated
+
+def bulk_delete_files(file_ids) -> int:
+    """Delete many files"""
+    deleted = 0
+    file_ids = list(file_ids)
+    invalidate_files(file_ids)
+    for chunk in _chunks(file_ids):
+        result = db.session.execute(
+            delete(File).where(File.id.in_(chunk)).execution_options(synchronize_session=False)
+        )
+        deleted += result.rowcount
+    return deleted
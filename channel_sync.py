@@ -0,0 +1,225 @@
+"""
+Storage channel mirroring
+Documents posted to STORAGE_CHANNEL_ID are ingested into the catalog, straight
+into a category when the caption names one, otherwise as pending files.
+"""
+import asyncio
+import logging
+import re
+import time
+from models import db, Category
+from ingest import UploadBatcher, document_row, catalog_row, save_rows
+
+logger = logging.getLogger(__name__)
+
+# Messages forwarded and written per resync round
+RESYNC_BATCH_SIZE = 100
+# Pause between forwards during a resync to stay under Telegram's flood limits
+RESYNC_FORWARD_DELAY = 0.05
+# Attempts per message when a forward times out or the connection drops
+RESYNC_FORWARD_ATTEMPTS = 3
+# Seconds the category name lookup is reused before being reloaded
+CATEGORY_CACHE_TTL = 60
+
+HASHTAG_PATTERN = re.compile(r'#(\w+)')
+CAPTION_RULE_PATTERN = re.compile(r'^\s*(?:category|القسم)\s*:\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+
+def normalize_category_name(name: str) -> str:
+    """Normalize a category name or hashtag for matching"""
+    return re.sub(r'[\s_\-]+', ' ', name).strip().casefold()
+
+def parse_channel_id(value: str):
+    """Turn STORAGE_CHANNEL_ID into a chat id, or a username for public channels"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return value if value.startswith('@') else f'@{value}'
+
+def route_caption(caption: str, categories: dict):
+    """Return (category_id, description) for a caption; category_id is None when nothing matches"""
+    if not caption:
+        return None, None
+    category_id = None
+
+    # An explicit "category: Name" line wins over hashtags
+    rule = CAPTION_RULE_PATTERN.search(caption)
+    if rule:
+        category_id = categories.get(normalize_category_name(rule.group(1)))
+    if not category_id:
+        for tag in HASHTAG_PATTERN.findall(caption):
+            category_id = categories.get(normalize_category_name(tag))
+            if category_id:
+                break
+
+    description = HASHTAG_PATTERN.sub('', CAPTION_RULE_PATTERN.sub('', caption)).strip()
+    return category_id, description or None
+
+def load_category_lookup() -> dict:
+    """Map normalized category names to ids"""
+    from database import app
+    with app.app_context():
+        rows = db.session.query(Category.id, Category.name).order_by(Category.created_at).all()
+    lookup = {}
+    for category_id, name in rows:
+        lookup.setdefault(normalize_category_name(name), category_id)
+    return lookup
+
+class ChannelMirror:
+    """Ingests documents from the storage channel and replays its history on demand"""
+
+    def __init__(self, channel_id, admin_id: int, upload_batcher: UploadBatcher):
+        self.channel_id = parse_channel_id(channel_id) if isinstance(channel_id, str) else channel_id
+        self.admin_id = admin_id
+        self.upload_batcher = upload_batcher
+        self._categories = {}
+        self._categories_loaded_at = 0.0
+        self._resync_task = None
+
+    def chat_filter(self):
+        """Filter matching posts from the storage channel"""
+        from telegram.ext import filters
+        if isinstance(self.channel_id, int):
+            chat = filters.Chat(chat_id=self.channel_id)
+        else:
+            chat = filters.Chat(username=self.channel_id.lstrip('@'))
+        return chat & filters.UpdateType.CHANNEL_POSTS
+
+    async def categories(self) -> dict:
+        """Cached category name lookup used for caption routing"""
+        if time.monotonic() - self._categories_loaded_at > CATEGORY_CACHE_TTL:
+            self._categories = await asyncio.to_thread(load_category_lookup)
+            self._categories_loaded_at = time.monotonic()
+        return self._categories
+
+    async def handle_channel_post(self, update, context):
+        """Handle new and edited posts in the storage channel"""
+        message = update.effective_message
+        if not message or not message.document:
+            return
+        category_id, description = route_caption(message.caption, await self.categories())
+        await self.upload_batcher.add_document(
+            message.chat_id, message.media_group_id, message.document, context.bot,
+            category_id=category_id, description=description
+        )
+
+    async def resync_command(self, update, context):
+        """Handle /resync <first_message_id> [last_message_id] from the admin"""
+        if update.effective_user.id != self.admin_id:
+            return
+        if self._resync_task and not self._resync_task.done():
+            await update.message.reply_text("A resync is already running.")
+            return
+        try:
+            first_id = int(context.args[0])
+            last_id = int(context.args[1]) if len(context.args) > 1 else first_id
+        except (IndexError, ValueError):
+            await update.message.reply_text("Usage: /resync <first_message_id> [last_message_id]")
+            return
+        if last_id < first_id:
+            first_id, last_id = last_id, first_id
+
+        # Runs in the background so the bot keeps answering users during a long replay
+        self._resync_task = context.application.create_task(
+            self.resync(context.bot, first_id, last_id, update.effective_chat.id)
+        )
+
+    async def _forward(self, bot, message_id):
+        """Forward one channel message to the admin chat; None when it cannot be read"""
+        from telegram.error import RetryAfter, BadRequest, NetworkError, TelegramError
+        attempts = 0
+        while True:
+            try:
+                return await bot.forward_message(
+                    chat_id=self.admin_id,
+                    from_chat_id=self.channel_id,
+                    message_id=message_id,
+                    disable_notification=True
+                )
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                await asyncio.sleep(delay)
+            except BadRequest:
+                # Deleted messages and service messages cannot be forwarded
+                return None
+            except NetworkError as e:
+                # Timeouts and dropped connections are worth another try
+                attempts += 1
+                if attempts >= RESYNC_FORWARD_ATTEMPTS:
+                    logger.warning(f"Skipping message {message_id} after {attempts} failed forwards: {e}")
+                    return None
+                await asyncio.sleep(attempts)
+            except TelegramError as e:
+                logger.warning(f"Skipping message {message_id}: {e}")
+                return None
+
+    async def _delete_copies(self, bot, message_ids):
+        if not message_ids:
+            return
+        try:
+            await bot.delete_messages(chat_id=self.admin_id, message_ids=message_ids)
+        except Exception as e:
+            logger.warning(f"Could not delete {len(message_ids)} resync copies: {e}")
+
+    async def resync(self, bot, first_id: int, last_id: int, status_chat_id):
+        """Replay channel messages first_id..last_id into the catalog in batches"""
+        # The Bot API cannot read channel history, so each message is forwarded to
+        # the admin chat to read its document and the copies are deleted afterwards.
+        total = last_id - first_id + 1
+        status = await bot.send_message(chat_id=status_chat_id, text=f"🔄 Resyncing {total} message(s)...")
+        imported, categorized, duplicates = 0, 0, 0
+        copies = []
+
+        try:
+            categories = await self.categories()
+            for start in range(first_id, last_id + 1, RESYNC_BATCH_SIZE):
+                pending_rows, file_rows = [], []
+                for message_id in range(start, min(start + RESYNC_BATCH_SIZE, last_id + 1)):
+                    message = await self._forward(bot, message_id)
+                    if message is None:
+                        continue
+                    copies.append(message.message_id)
+                    if message.document:
+                        category_id, description = route_caption(message.caption, categories)
+                        if category_id:
+                            file_rows.append(catalog_row(message.document, category_id, description))
+                        else:
+                            pending_rows.append(document_row(message.document))
+                    await asyncio.sleep(RESYNC_FORWARD_DELAY)
+
+                try:
+                    saved, skipped, saved_to_files = await asyncio.to_thread(save_rows, pending_rows, file_rows)
+                    imported += saved
+                    duplicates += skipped
+                    categorized += saved_to_files
+                except Exception as e:
+                    logger.error(f"Error saving resync batch starting at {start}: {e}")
+                await self._delete_copies(bot, copies)
+                copies = []
+
+                done = min(start + RESYNC_BATCH_SIZE, last_id + 1) - first_id
+                try:
+                    await status.edit_text(f"🔄 Resyncing... {done}/{total} messages, {imported} file(s) imported")
+                except Exception:
+                    pass
+        except Exception as e:
+            logger.exception(f"Resync of messages {first_id}-{last_id} failed")
+            try:
+                await bot.send_message(
+                    chat_id=status_chat_id,
+                    text=f"❌ Resync failed after importing {imported} file(s): {e}"
+                )
+            except Exception:
+                pass
+            return
+        finally:
+            # Never leave forwarded copies behind in the admin chat
+            await self._delete_copies(bot, copies)
+
+        logger.info(f"Resync of messages {first_id}-{last_id} imported {imported} file(s)")
+        await bot.send_message(
+            chat_id=status_chat_id,
+            text=(f"✅ Resync finished: {imported} file(s) imported, {categorized} straight into categories, "
+                  f"{duplicates} duplicate(s) skipped.")
+        )
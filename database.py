@@ -0,0 +1,139 @@
+"""
+Database setup shared by the admin panel and the bot
+Builds a Flask app that carries only the database configuration, so the bot can
+open sessions without importing the admin panel. Nothing here touches the
+schema; run `python manage.py init-db` once per deploy.
+
+Engine settings come from a per-process profile (DB_PROFILE: web, bot or batch)
+sizing the connection pool and the statement timeout. SQLite connections run
+in WAL mode so the bot's reads are not blocked by the admin panel's writes.
+DATABASE_REPLICA_URLS (comma-separated) adds read replicas; see replicas.py.
+"""
+import os
+import time
+import logging
+from flask import Flask
+from sqlalchemy import event, create_engine
+from sqlalchemy.engine import make_url
+from models import db, upgrade_schema
+from metrics import instrument_engine
+from query_inspector import inspect_engine
+from tracing import trace_engine
+from replicas import replica_set, watch_replica_engine
+
+logger = logging.getLogger(__name__)
+
+# Request threads per gunicorn worker; supervisor.py passes the same value to --threads
+WEB_THREADS = int(os.getenv("WEB_THREADS", "4"))
+
+# Pool and timeout settings per process type; DB_POOL_SIZE, DB_MAX_OVERFLOW and
+# DB_STATEMENT_TIMEOUT_MS override single values
+ENGINE_PROFILES = {
+    # Each gthread worker serves up to WEB_THREADS requests at once, one connection each
+    'web': {'pool_size': WEB_THREADS, 'max_overflow': 3, 'statement_timeout_ms': 15000},
+    # Handlers query from the default thread pool while the flush loops write
+    'bot': {'pool_size': 5, 'max_overflow': 10, 'statement_timeout_ms': 5000},
+    # Scripts use one connection at a time, and bulk statements may run for minutes
+    'batch': {'pool_size': 1, 'max_overflow': 2, 'statement_timeout_ms': 0},
+}
+DEFAULT_PROFILE = 'web'
+# Compiled SQL kept per engine; the default of 500 is outgrown by the bot plus admin queries
+QUERY_CACHE_SIZE = 1200
+# Prepared statements kept per SQLite connection (sqlite3 defaults to 128)
+SQLITE_CACHED_STATEMENTS = 256
+SQLITE_PRAGMAS = (
+    # Readers no longer wait for a writer, and a writer no longer waits for readers
+    'PRAGMA journal_mode=WAL',
+    # Durable at checkpoints; safe with WAL and avoids an fsync per commit
+    'PRAGMA synchronous=NORMAL',
+    # Wait for a competing writer instead of failing with "database is locked"
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA mmap_size=268435456',
+    # Negative means KiB: a 64 MB page cache per connection
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+)
+
+def engine_profile(name: str = None) -> dict:
+    """Settings of the named profile (default DB_PROFILE) with environment overrides applied"""
+    name = name or os.getenv("DB_PROFILE", DEFAULT_PROFILE)
+    if name not in ENGINE_PROFILES:
+        logger.warning(f"Unknown DB_PROFILE {name!r}, using {DEFAULT_PROFILE!r}")
+        name = DEFAULT_PROFILE
+    settings = dict(ENGINE_PROFILES[name], name=name)
+    for key, variable in (('pool_size', 'DB_POOL_SIZE'), ('max_overflow', 'DB_MAX_OVERFLOW'),
+                          ('statement_timeout_ms', 'DB_STATEMENT_TIMEOUT_MS')):
+        if os.getenv(variable):
+            settings[key] = int(os.environ[variable])
+    return settings
+
+def engine_options(database_url: str, profile: dict) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS for database_url under profile"""
+    url = make_url(database_url)
+    options = {'query_cache_size': QUERY_CACHE_SIZE}
+    backend = url.get_backend_name()
+    if backend == 'sqlite':
+        options['connect_args'] = {'cached_statements': SQLITE_CACHED_STATEMENTS}
+        if url.database in (None, '', ':memory:'):
+            # In-memory databases live on a single shared connection
+            return options
+    options.update(pool_size=profile['pool_size'], max_overflow=profile['max_overflow'], pool_timeout=10)
+    if backend == 'postgresql':
+        options.update(pool_recycle=300, pool_pre_ping=True)
+        connect_args = {'application_name': f"telegstore-{profile['name']}"}
+        if profile['statement_timeout_ms']:
+            connect_args['options'] = f"-c statement_timeout={profile['statement_timeout_ms']}"
+        options['connect_args'] = connect_args
+    return options
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+def _instrument(engine):
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _apply_sqlite_pragmas)
+    instrument_engine(engine)
+    inspect_engine(engine)
+    trace_engine(engine)
+
+def replica_urls():
+    return [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(',') if url.strip()]
+
+def create_app() -> Flask:
+    """Flask app with the database configured and the engine instrumented"""
+    app = Flask(__name__)
+    # Fallback to SQLite for development
+    database_url = os.environ.get("DATABASE_URL") or "sqlite:///bot.db"
+    profile = engine_profile()
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_url, profile)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+
+    # Creating the engines does not connect; the first query does
+    with app.app_context():
+        logger.debug(f"Database engine uses the {profile['name']!r} profile")
+        _instrument(db.engine)
+    replicas = []
+    for url in replica_urls():
+        engine = create_engine(url, **engine_options(url, profile))
+        _instrument(engine)
+        watch_replica_engine(engine)
+        replicas.append(engine)
+    replica_set.configure(replicas)
+    return app
+
+app = create_app()
+
+def init_schema():
+    """Create missing tables, columns and indexes; run at deploy time, not on every import"""
+    started = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+    logger.info(f"Schema is up to date ({(time.perf_counter() - started) * 1000:.0f} ms)")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Synthetic large-catalog generator
+Fills the database with a deep category tree, files skewed towards a few hot
+categories, mixed Arabic/Latin names and subscribers. PostgreSQL is loaded with
+COPY; other databases with chunked executemany inserts.
+
+Usage: python datagen.py [--database-url URL] [--files 1000000] [--subscribers 5000000]
+                         [--depth 4] [--fanout 6] [--roots 12]
+"""
+import io
+import os
+import sys
+import csv
+import time
+import uuid
+import random
+import logging
+import argparse
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT round or COPY buffer
+CHUNK_SIZE = 20000
+LATIN_WORDS = ['Pro', 'Lite', 'Mod', 'Premium', 'Player', 'Editor', 'Scanner', 'VPN', 'Keyboard', 'Camera',
+               'Launcher', 'Browser', 'Music', 'Video', 'Photo', 'Chat', 'Maps', 'Weather', 'Notes', 'Games']
+ARABIC_WORDS = ['تطبيق', 'لعبة', 'برنامج', 'مشغل', 'محرر', 'متصفح', 'كاميرا', 'خرائط', 'طقس', 'ملاحظات',
+                'موسيقى', 'فيديو', 'صور', 'دردشة', 'قرآن', 'أذكار', 'تعليم', 'رياضة', 'أخبار', 'بنك']
+EXTENSIONS = [('apk', 'application/vnd.android.package-archive'), ('xapk', 'application/octet-stream'),
+              ('zip', 'application/zip'), ('pdf', 'application/pdf'), ('mp4', 'video/mp4')]
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _name(rng: random.Random, index: int) -> str:
+    words = ARABIC_WORDS if rng.random() < 0.4 else LATIN_WORDS
+    return f"{rng.choice(words)} {rng.choice(words)} {index}"
+
+def category_rows(rng: random.Random, roots: int, depth: int, fanout: int):
+    """Rows of a category tree: roots at the top, then up to fanout children per node for depth levels"""
+    now = datetime.utcnow()
+    rows = []
+    level = []
+    for index in range(roots):
+        row = {'id': _uuid(rng), 'name': _name(rng, index), 'description': None, 'parent_id': None, 'created_at': now}
+        rows.append(row)
+        level.append(row['id'])
+    for _ in range(depth - 1):
+        next_level = []
+        for parent_id in level:
+            for _ in range(rng.randint(0, fanout)):
+                row = {'id': _uuid(rng), 'name': _name(rng, len(rows)), 'description': None,
+                       'parent_id': parent_id, 'created_at': now}
+                rows.append(row)
+                next_level.append(row['id'])
+        level = next_level
+    return rows
+
+def file_rows(rng: random.Random, count: int, category_ids, skew: float):
+    """Yield file rows; category popularity follows a Zipf-like curve with exponent skew"""
+    cum_weights = list(accumulate(1 / (rank + 1) ** skew for rank in range(len(category_ids))))
+    ranked = list(category_ids)
+    rng.shuffle(ranked)
+    start = datetime.utcnow() - timedelta(days=730)
+    for index in range(count):
+        extension, mime_type = rng.choice(EXTENSIONS)
+        yield {
+            'id': _uuid(rng),
+            'name': f"{_name(rng, index)}.{extension}",
+            'category_id': rng.choices(ranked, cum_weights=cum_weights)[0],
+            'telegram_file_id': f"synthetic-{index}",
+            'file_unique_id': f"synthetic-unique-{index}",
+            'description': None if rng.random() < 0.5 else f"Synthetic file {index}",
+            'size': int(rng.lognormvariate(16, 1.5)) % 2_000_000_000,
+            'mime_type': mime_type,
+            'created_at': start + timedelta(seconds=rng.randint(0, 730 * 86400)),
+        }
+
+def subscriber_rows(rng: random.Random, count: int, first_user_id: int = 100_000_000):
+    """Yield subscriber rows; about one in ten has blocked the bot"""
+    start = datetime.utcnow() - timedelta(days=730)
+    for index in range(count):
+        yield {
+            'user_id': first_user_id + index,
+            'first_name': _name(rng, index).split(' ', 1)[0],
+            'username': f"user{index}" if rng.random() < 0.7 else None,
+            'joined_at': start + timedelta(seconds=rng.randint(0, 730 * 86400)),
+            'is_active': rng.random() >= 0.1,
+        }
+
+def _chunks(rows, size: int = CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _copy_chunk(connection, table, columns, chunk):
+    """Load rows with PostgreSQL COPY through the raw DBAPI connection"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chunk:
+        writer.writerow(['\\N' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+        )
+    finally:
+        cursor.close()
+
+def bulk_load(table, rows) -> int:
+    """Insert rows into table in chunks, one transaction per chunk; returns rows written"""
+    from sqlalchemy import insert
+    from models import db
+    written = 0
+    started = time.perf_counter()
+    use_copy = db.engine.dialect.name == 'postgresql'
+    for chunk in _chunks(rows):
+        with db.engine.begin() as connection:
+            if use_copy:
+                _copy_chunk(connection, table, list(chunk[0]), chunk)
+            else:
+                connection.execute(insert(table), chunk)
+        written += len(chunk)
+        logger.info(f"{table.name}: {written} rows ({written / (time.perf_counter() - started):.0f} rows/s)")
+    return written
+
+def generate(files: int, subscribers: int, roots: int = 12, depth: int = 4, fanout: int = 6,
+             skew: float = 1.1, seed: int = 1):
+    """Generate the whole dataset; returns the number of rows written per table"""
+    from database import app, init_schema
+    from models import Category, File, Subscriber
+    rng = random.Random(seed)
+    init_schema()
+    with app.app_context():
+        categories = category_rows(rng, roots, depth, fanout)
+        counts = {'categories': bulk_load(Category.__table__, categories)}
+        category_ids = [row['id'] for row in categories]
+        counts['files'] = bulk_load(File.__table__, file_rows(rng, files, category_ids, skew))
+        counts['subscribers'] = bulk_load(Subscriber.__table__, subscriber_rows(rng, subscribers))
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a scratch database with a synthetic large catalog")
+    parser.add_argument('--database-url', help="database to fill (default: DATABASE_URL)")
+    parser.add_argument('--files', type=int, default=1_000_000)
+    parser.add_argument('--subscribers', type=int, default=5_000_000)
+    parser.add_argument('--roots', type=int, default=12, help="top-level categories")
+    parser.add_argument('--depth', type=int, default=4, help="levels in the category tree")
+    parser.add_argument('--fanout', type=int, default=6, help="maximum children per category")
+    parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent of files per category")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    os.environ.setdefault("DB_PROFILE", "batch")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    started = time.perf_counter()
+    counts = generate(args.files, args.subscribers, args.roots, args.depth, args.fanout, args.skew, args.seed)
+    logger.info(f"Generated {counts} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Duplicate file cleanup
+Backfills file_unique_id for rows stored before it was recorded, committing
+each batch, then merges files and pending files that point at the same Telegram
+content in one short transaction.
+
+Usage: python dedupe.py [--dry-run]
+"""
+import os
+import sys
+import asyncio
+import logging
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import select, update, delete, bindparam, or_, and_
+from sqlalchemy.exc import IntegrityError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, File, PendingFile
+from file_cache import invalidate_files
+
+logger = logging.getLogger(__name__)
+
+# Rows looked up per round while backfilling
+BACKFILL_BATCH_SIZE = 100
+# Pause between getFile calls to stay under Telegram's flood limits
+BACKFILL_DELAY = 0.05
+
+async def resolve_unique_ids(bot, telegram_file_ids):
+    """Ask Telegram for the file_unique_id of each file id; unknown ids are left out"""
+    from telegram.error import RetryAfter, TelegramError
+    resolved = {}
+    for telegram_file_id in telegram_file_ids:
+        while True:
+            try:
+                tg_file = await bot.get_file(telegram_file_id)
+                resolved[telegram_file_id] = tg_file.file_unique_id
+                break
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                await asyncio.sleep(delay)
+            except TelegramError as e:
+                logger.warning(f"Could not resolve {telegram_file_id}: {e}")
+                break
+        await asyncio.sleep(BACKFILL_DELAY)
+    return resolved
+
+def _age_column(model):
+    return File.created_at if model is File else PendingFile.uploaded_at
+
+def _unclaimed(resolved: dict, claimed_by) -> dict:
+    """The part of {row id: file_unique_id} that no row of claimed_by holds and no earlier row repeats"""
+    held = set()
+    for other in claimed_by:
+        held.update(row.file_unique_id for row in
+                    _rows_with_unique_ids(other, set(resolved.values()), (other.file_unique_id,)))
+    free = {}
+    for row_id, uid in resolved.items():
+        if uid not in held:
+            free[row_id] = uid
+            held.add(uid)
+    return free
+
+async def backfill_unique_ids(bot, model, claimed_by=(), dry_run: bool = False):
+    """Resolve file_unique_id for rows of model that have none yet, oldest first
+
+    Each batch is written and committed on its own, so no transaction stays open
+    across the Telegram lookups. A resolved id that another row of model or of
+    claimed_by already holds is left for the merge; those are returned as
+    {row id: file_unique_id}. A dry run writes nothing and returns every id.
+    """
+    age = _age_column(model)
+    conflicts = {}
+    resolved_count = 0
+    last = None
+    while True:
+        query = (select(model.id, model.telegram_file_id, age.label('age'))
+                 .where(model.file_unique_id.is_(None), model.telegram_file_id.isnot(None),
+                        model.telegram_file_id != '')
+                 .order_by(age, model.id)
+                 .limit(BACKFILL_BATCH_SIZE))
+        if last is not None:
+            # Unresolved rows keep a NULL id, so the scan moves on by position
+            query = query.where(or_(age > last[0], and_(age == last[0], model.id > last[1])))
+        rows = db.session.execute(query).all()
+        # End the read before the network calls
+        db.session.rollback()
+        if not rows:
+            break
+        last = (rows[-1].age, rows[-1].id)
+        resolved = await resolve_unique_ids(bot, {row.telegram_file_id for row in rows})
+        found = {row.id: resolved[row.telegram_file_id] for row in rows if row.telegram_file_id in resolved}
+        resolved_count += len(found)
+        free = {} if dry_run else _unclaimed(found, (model, *claimed_by))
+        try:
+            _set_unique_ids(model, free)
+            db.session.commit()
+        except IntegrityError:
+            # A new upload took one of the ids meanwhile; leave the batch to the merge
+            db.session.rollback()
+            free = {}
+        conflicts.update((row_id, uid) for row_id, uid in found.items() if row_id not in free)
+        logger.info(f"Resolved {resolved_count} {model.__tablename__} unique id(s) so far, "
+                    f"{len(conflicts)} left to merge")
+    return conflicts
+
+def _rows_with_unique_ids(model, unique_ids, columns):
+    """Load rows of model already holding one of unique_ids"""
+    unique_ids = list(unique_ids)
+    rows = []
+    for start in range(0, len(unique_ids), 500):
+        chunk = unique_ids[start:start + 500]
+        rows.extend(db.session.execute(select(*columns).where(model.file_unique_id.in_(chunk))).all())
+    return rows
+
+def _delete_ids(model, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), 500):
+        db.session.execute(
+            delete(model).where(model.id.in_(ids[start:start + 500])).execution_options(synchronize_session=False)
+        )
+
+def _set_unique_ids(model, assignments):
+    if assignments:
+        db.session.execute(
+            update(model.__table__)
+            .where(model.__table__.c.id == bindparam('row_id'))
+            .values(file_unique_id=bindparam('unique_id')),
+            [{'row_id': row_id, 'unique_id': uid} for row_id, uid in assignments.items()]
+        )
+
+def merge_files(backfilled: dict, dry_run: bool = False):
+    """Merge files sharing a file_unique_id, keeping the oldest row of each group
+
+    Rows that already hold the unique id win over backfilled ones, and a keeper
+    without a description inherits one from a merged duplicate.
+    """
+    groups = defaultdict(list)
+    for row in _rows_with_unique_ids(File, set(backfilled.values()),
+                                     (File.id, File.file_unique_id, File.created_at, File.description)):
+        groups[row.file_unique_id].append((0, row.created_at, row.id, row.description))
+    if backfilled:
+        ids = list(backfilled)
+        for start in range(0, len(ids), 500):
+            rows = db.session.execute(
+                select(File.id, File.created_at, File.description).where(File.id.in_(ids[start:start + 500]))
+            ).all()
+            for row in rows:
+                groups[backfilled[row.id]].append((1, row.created_at, row.id, row.description))
+
+    to_delete, assignments, descriptions = [], {}, []
+    for unique_id, members in groups.items():
+        members.sort(key=lambda m: (m[0], m[1] or datetime.max, m[2]))
+        keeper = members[0]
+        duplicates = members[1:]
+        to_delete.extend(m[2] for m in duplicates)
+        if keeper[0] == 1:
+            assignments[keeper[2]] = unique_id
+        if not keeper[3]:
+            inherited = next((m[3] for m in duplicates if m[3]), None)
+            if inherited:
+                descriptions.append({'row_id': keeper[2], 'description': inherited})
+
+    if not dry_run:
+        # Duplicates go first so the unique index accepts the keepers' ids
+        _delete_ids(File, to_delete)
+        invalidate_files(to_delete)
+        _set_unique_ids(File, assignments)
+        if descriptions:
+            db.session.execute(
+                update(File.__table__)
+                .where(File.__table__.c.id == bindparam('row_id'))
+                .values(description=bindparam('description')),
+                descriptions
+            )
+    return len(to_delete)
+
+def merge_pending(backfilled: dict, catalog_unique_ids=(), dry_run: bool = False):
+    """Drop pending files already in the catalog and pending duplicates of each other
+
+    catalog_unique_ids holds ids just backfilled on files, which a dry run has not written.
+    """
+    uids = set(backfilled.values())
+    pending_rows = _rows_with_unique_ids(PendingFile, uids, (PendingFile.id, PendingFile.file_unique_id,
+                                                              PendingFile.uploaded_at))
+    candidates = [(row.file_unique_id, 0, row.uploaded_at, row.id) for row in pending_rows]
+    ids = list(backfilled)
+    for start in range(0, len(ids), 500):
+        rows = db.session.execute(
+            select(PendingFile.id, PendingFile.uploaded_at).where(PendingFile.id.in_(ids[start:start + 500]))
+        ).all()
+        candidates.extend((backfilled[row.id], 1, row.uploaded_at, row.id) for row in rows)
+
+    in_catalog = {row.file_unique_id for row in _rows_with_unique_ids(File, uids, (File.file_unique_id,))}
+    in_catalog.update(uid for uid in catalog_unique_ids if uid in uids)
+    kept, to_delete, assignments = set(), [], {}
+    candidates.sort(key=lambda c: (c[0], c[1], c[2] or datetime.max, c[3]))
+    for uid, is_backfilled, uploaded_at, row_id in candidates:
+        if uid in in_catalog or uid in kept:
+            to_delete.append(row_id)
+            continue
+        kept.add(uid)
+        if is_backfilled:
+            assignments[row_id] = uid
+
+    if not dry_run:
+        _delete_ids(PendingFile, to_delete)
+        _set_unique_ids(PendingFile, assignments)
+    return len(to_delete)
+
+async def run(bot, dry_run: bool = False):
+    """Backfill unique ids batch by batch, then merge duplicates in one transaction"""
+    from database import app
+    with app.app_context():
+        try:
+            file_ids = await backfill_unique_ids(bot, File, dry_run=dry_run)
+            # A pending file whose id is in the catalog is a duplicate, so it waits for the merge
+            pending_ids = await backfill_unique_ids(bot, PendingFile, claimed_by=(File,), dry_run=dry_run)
+            merged_files = merge_files(file_ids, dry_run)
+            merged_pending = merge_pending(pending_ids, set(file_ids.values()), dry_run)
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    logger.info(f"Merged {merged_files} duplicate file(s) and {merged_pending} duplicate pending file(s)"
+                + (" (dry run)" if dry_run else ""))
+    return merged_files, merged_pending
+
+async def _main(args):
+    from telegram import Bot
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "")
+    if not bot_token:
+        logger.error("TELEGRAM_BOT_TOKEN not provided!")
+        return 1
+    async with Bot(token=bot_token) as bot:
+        await run(bot, args.dry_run)
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge duplicate catalog entries by Telegram file_unique_id")
+    parser.add_argument('--dry-run', action='store_true', help="report what would be merged without changing anything")
+    args = parser.parse_args()
+    os.environ.setdefault("DB_PROFILE", "batch")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    sys.exit(asyncio.run(_main(args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Write-behind download counters and the precomputed popular files list
+Downloads are counted in memory per file and day and flushed periodically in
+one batched upsert, so the download handler never waits on a commit.
+"""
+import asyncio
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, update
+from models import db, File, FileDownloadStat, upsert_insert
+from replicas import read_replica
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes of buffered counts
+FLUSH_INTERVAL = 30
+# Seconds between recomputations of the popular files list
+POPULAR_REFRESH_INTERVAL = 300
+# Days of downloads the popular list looks back over
+POPULAR_WINDOW_DAYS = 7
+POPULAR_LIMIT = 10
+# Rows per upsert statement
+UPSERT_CHUNK_SIZE = 500
+
+class DownloadCounter:
+    """Aggregates downloads per (file_id, day) in memory until flushed"""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, file_id: str):
+        """Count one download; O(1) and never touches the database"""
+        key = (file_id, datetime.utcnow().date())
+        with self._lock:
+            self._counts[key] += 1
+
+    def pending(self) -> int:
+        """Number of buffered downloads not yet flushed"""
+        with self._lock:
+            return sum(self._counts.values())
+
+    def _drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        return counts
+
+    def _restore(self, counts):
+        with self._lock:
+            self._counts.update(counts)
+
+    def flush(self) -> int:
+        """Write buffered counts with one upsert per chunk; returns downloads written"""
+        counts = self._drain()
+        if not counts:
+            return 0
+        rows = [{'file_id': file_id, 'day': day, 'count': count} for (file_id, day), count in counts.items()]
+        from database import app
+        with app.app_context():
+            try:
+                # Files deleted since the download was counted are dropped
+                existing = set()
+                file_ids = list({row['file_id'] for row in rows})
+                for start in range(0, len(file_ids), UPSERT_CHUNK_SIZE):
+                    existing.update(db.session.scalars(
+                        select(File.id).where(File.id.in_(file_ids[start:start + UPSERT_CHUNK_SIZE]))
+                    ))
+                rows = [row for row in rows if row['file_id'] in existing]
+                for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                    _upsert_counts(rows[start:start + UPSERT_CHUNK_SIZE])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Keep the counts for the next flush instead of losing them
+                self._restore(counts)
+                raise
+        return sum(row['count'] for row in rows)
+
+def _upsert_counts(rows):
+    stmt = upsert_insert(FileDownloadStat)
+    if stmt is not None:
+        stmt = stmt.values(rows)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['file_id', 'day'],
+            set_={'count': FileDownloadStat.count + stmt.excluded['count']}
+        ))
+        return
+    for row in rows:
+        result = db.session.execute(
+            update(FileDownloadStat)
+            .where(FileDownloadStat.file_id == row['file_id'], FileDownloadStat.day == row['day'])
+            .values(count=FileDownloadStat.count + row['count'])
+        )
+        if result.rowcount == 0:
+            db.session.add(FileDownloadStat(**row))
+
+class PopularFiles:
+    """Top-N downloaded files, recomputed on a schedule and read without queries"""
+
+    def __init__(self, limit: int = POPULAR_LIMIT, window_days: int = POPULAR_WINDOW_DAYS):
+        self.limit = limit
+        self.window_days = window_days
+        # Tuple of (file_id, name, downloads), replaced atomically on refresh
+        self.items = ()
+        self.refreshed_at = None
+
+    def refresh(self):
+        """Recompute the list from the last window_days of stats"""
+        since = datetime.utcnow().date() - timedelta(days=self.window_days - 1)
+        from database import app
+        # A background aggregate that tolerates replica lag
+        with app.app_context(), read_replica():
+            total = func.sum(FileDownloadStat.count).label('downloads')
+            rows = db.session.execute(
+                select(File.id, File.name, total)
+                .join(FileDownloadStat, FileDownloadStat.file_id == File.id)
+                .where(FileDownloadStat.day >= since)
+                .group_by(File.id, File.name)
+                .order_by(total.desc(), File.name)
+                .limit(self.limit)
+            ).all()
+        self.items = tuple((row.id, row.name, int(row.downloads)) for row in rows)
+        self.refreshed_at = datetime.utcnow()
+        return self.items
+
+download_counter = DownloadCounter()
+popular_files = PopularFiles()
+
+async def run_stats_loop(counter: DownloadCounter = download_counter, popular: PopularFiles = popular_files,
+                         flush_interval: float = FLUSH_INTERVAL,
+                         refresh_interval: float = POPULAR_REFRESH_INTERVAL):
+    """Flush counters and refresh the popular list forever; cancel to stop"""
+    loop = asyncio.get_running_loop()
+    next_refresh = loop.time()
+    while True:
+        try:
+            flushed = await asyncio.to_thread(counter.flush)
+            if flushed:
+                logger.info(f"Flushed {flushed} download(s)")
+        except Exception as e:
+            logger.error(f"Error flushing download counters: {e}")
+        if loop.time() >= next_refresh:
+            try:
+                await asyncio.to_thread(popular.refresh)
+            except Exception as e:
+                logger.error(f"Error refreshing popular files: {e}")
+            next_refresh = loop.time() + refresh_interval
+        await asyncio.sleep(flush_interval)
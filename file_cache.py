@@ -0,0 +1,178 @@
+"""
+Hot-file cache for the bot's download and file detail paths
+A bounded LRU of immutable file records with a TTL. Admin edits invalidate
+entries locally and bump a version row that other processes poll from a
+background task (run_version_loop), so a cache hit never touches the database.
+"""
+import os
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select, update
+from models import db, CacheVersion, upsert_insert
+from read_models import FileRecord, get_file_record
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION_NAME = 'files'
+# Seconds between checks of the shared version row
+VERSION_CHECK_INTERVAL = 2.0
+
+def load_file_record(file_id: str) -> Optional[FileRecord]:
+    """Load one file record from the database"""
+    from database import app
+    with app.app_context():
+        return get_file_record(file_id)
+
+def load_cache_version() -> int:
+    """Read the shared version of the files cache"""
+    from database import app
+    with app.app_context():
+        version = db.session.execute(
+            select(CacheVersion.version).where(CacheVersion.name == CACHE_VERSION_NAME)
+        ).scalar()
+    return version or 0
+
+def bump_cache_version():
+    """Bump the shared files cache version in the current transaction"""
+    now = datetime.utcnow()
+    stmt = upsert_insert(CacheVersion)
+    if stmt is not None:
+        # One statement, so two processes creating the row at once cannot collide on the key
+        stmt = stmt.values(name=CACHE_VERSION_NAME, version=1, updated_at=now)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': CacheVersion.version + 1, 'updated_at': now}
+        ))
+        return
+    result = db.session.execute(
+        update(CacheVersion)
+        .where(CacheVersion.name == CACHE_VERSION_NAME)
+        .values(version=CacheVersion.version + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        db.session.add(CacheVersion(name=CACHE_VERSION_NAME, version=1))
+
+class FileCache:
+    """Thread-safe LRU/TTL cache of FileRecord by file id"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, loader=load_file_record,
+                 version_loader=load_cache_version):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.loader = loader
+        self.version_loader = version_loader
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def sync_version(self):
+        """Drop everything when another process has bumped the shared version; blocks on the database"""
+        version = self.version_loader()
+        if self._version is not None and version != self._version:
+            with self._lock:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+        self._version = version
+
+    def lookup(self, file_id: str, now: float = None) -> Optional[FileRecord]:
+        """Return the cached record for file_id, or None on a miss; never touches the database"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None:
+                record, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(file_id)
+                    self.hits += 1
+                    return record
+                del self._entries[file_id]
+                self.expirations += 1
+            self.misses += 1
+        return None
+
+    def get(self, file_id: str) -> Optional[FileRecord]:
+        """Return the record for file_id, loading it on a miss; blocks, so not for the event loop"""
+        now = time.monotonic()
+        record = self.lookup(file_id, now)
+        if record is None:
+            record = self.loader(file_id)
+            if record is not None:
+                self.put(record, now)
+        return record
+
+    async def aget(self, file_id: str) -> Optional[FileRecord]:
+        """Return the record for file_id; a miss is loaded in a worker thread"""
+        now = time.monotonic()
+        record = self.lookup(file_id, now)
+        if record is None:
+            record = await asyncio.to_thread(self.loader, file_id)
+            if record is not None:
+                self.put(record, now)
+        return record
+
+    def put(self, record: FileRecord, now: float = None):
+        """Store a record, evicting the least recently used entries past maxsize"""
+        expires_at = (now if now is not None else time.monotonic()) + self.ttl
+        with self._lock:
+            self._entries[record.id] = (record, expires_at)
+            self._entries.move_to_end(record.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, file_ids=None):
+        """Drop the given ids, or everything when no ids are given"""
+        with self._lock:
+            if file_ids is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                return
+            for file_id in file_ids:
+                if self._entries.pop(file_id, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+file_cache = FileCache(
+    maxsize=int(os.getenv("FILE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("FILE_CACHE_TTL", "300"))
+)
+
+async def run_version_loop(cache: FileCache = file_cache, interval: float = VERSION_CHECK_INTERVAL):
+    """Poll the shared version forever so lookups stay in memory; cancel to stop"""
+    while True:
+        try:
+            await asyncio.to_thread(cache.sync_version)
+        except Exception as e:
+            # Keep serving from cache; the TTL still bounds staleness
+            logger.error(f"Error checking the file cache version: {e}")
+        await asyncio.sleep(interval)
+
+def invalidate_files(file_ids=None):
+    """Invalidate cached files after an admin edit; call before the edit's commit"""
+    file_cache.invalidate(list(file_ids) if file_ids is not None else None)
+    bump_cache_version()
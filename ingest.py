@@ -0,0 +1,274 @@
+"""
+Batched ingestion of admin uploads and storage channel posts
+Documents are grouped by media group or a short time window, written in one
+transaction and acknowledged with a single summary reply.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from sqlalchemy import insert, select
+from models import db, File, PendingFile, upsert_insert
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after the last document of a group before writing it
+BATCH_WINDOW = 1.5
+# Write a batch straight away once it reaches this size
+MAX_BATCH_SIZE = 100
+# Seconds of quiet before the summary reply for a chat is sent
+SUMMARY_DELAY = 3.0
+# Run category rules on new uploads so matching files skip the pending list
+AUTO_CATEGORIZE_ON_INGEST = os.getenv("AUTO_CATEGORIZE_ON_INGEST", "1") != "0"
+
+def document_row(document) -> dict:
+    """Build a pending_files row from a Telegram document"""
+    return {
+        'id': str(uuid.uuid4()),
+        'telegram_file_id': document.file_id,
+        'file_unique_id': document.file_unique_id,
+        'name': document.file_name or document.file_unique_id,
+        'size': document.file_size,
+        'mime_type': document.mime_type,
+        'uploaded_at': datetime.utcnow(),
+    }
+
+def catalog_row(document, category_id: str, description: str = None) -> dict:
+    """Build a files row for a document whose category is already known"""
+    return {
+        'id': str(uuid.uuid4()),
+        'name': document.file_name or document.file_unique_id,
+        'category_id': category_id,
+        'telegram_file_id': document.file_id,
+        'file_unique_id': document.file_unique_id,
+        'description': description or None,
+        'size': document.file_size,
+        'mime_type': document.mime_type,
+        'created_at': datetime.utcnow(),
+    }
+
+def _insert_ignoring_duplicates(model):
+    """INSERT that skips rows conflicting with a unique index, on dialects that support it"""
+    stmt = upsert_insert(model)
+    return stmt.on_conflict_do_nothing() if stmt is not None else insert(model)
+
+def known_unique_ids(unique_ids) -> set:
+    """Return the file_unique_ids already present in files or pending_files"""
+    unique_ids = [uid for uid in set(unique_ids) if uid]
+    known = set()
+    for start in range(0, len(unique_ids), 500):
+        chunk = unique_ids[start:start + 500]
+        known.update(db.session.scalars(select(File.file_unique_id).where(File.file_unique_id.in_(chunk))))
+        known.update(db.session.scalars(select(PendingFile.file_unique_id).where(PendingFile.file_unique_id.in_(chunk))))
+    return known
+
+def drop_duplicates(rows, seen: set):
+    """Filter out rows whose file_unique_id is in seen, adding new ids to it"""
+    unique_rows = []
+    for row in rows:
+        uid = row.get('file_unique_id')
+        if uid and uid in seen:
+            continue
+        if uid:
+            seen.add(uid)
+        unique_rows.append(row)
+    return unique_rows
+
+def categorize_pending_rows(pending_rows, file_rows):
+    """Move pending rows matched by a category rule into file rows"""
+    from autocategorize import get_ruleset
+    ruleset = get_ruleset()
+    if not ruleset or not pending_rows:
+        return pending_rows, file_rows
+    matched = {row['id']: rule.category_id for row, rule in ruleset.classify(pending_rows)}
+    if not matched:
+        return pending_rows, file_rows
+    file_rows = list(file_rows)
+    remaining = []
+    for row in pending_rows:
+        category_id = matched.get(row['id'])
+        if not category_id:
+            remaining.append(row)
+            continue
+        file_rows.append({
+            'id': row['id'],
+            'name': row['name'],
+            'category_id': category_id,
+            'telegram_file_id': row['telegram_file_id'],
+            'file_unique_id': row.get('file_unique_id'),
+            'description': None,
+            'size': row['size'],
+            'mime_type': row['mime_type'],
+            'created_at': row['uploaded_at'],
+        })
+    return remaining, file_rows
+
+def save_rows(pending_rows, file_rows=()):
+    """Insert pending and catalog file rows in a single transaction, skipping re-uploads
+
+    Returns (saved, duplicates, categorized), where categorized counts rows saved to files.
+    """
+    if not pending_rows and not file_rows:
+        return 0, 0, 0
+    from database import app
+    with app.app_context():
+        try:
+            if AUTO_CATEGORIZE_ON_INGEST:
+                pending_rows, file_rows = categorize_pending_rows(pending_rows, file_rows)
+            seen = known_unique_ids(row.get('file_unique_id') for row in [*file_rows, *pending_rows])
+            new_file_rows = drop_duplicates(file_rows, seen)
+            new_pending_rows = drop_duplicates(pending_rows, seen)
+            if new_pending_rows:
+                db.session.execute(_insert_ignoring_duplicates(PendingFile), new_pending_rows)
+            if new_file_rows:
+                db.session.execute(_insert_ignoring_duplicates(File), new_file_rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    saved = len(new_pending_rows) + len(new_file_rows)
+    return saved, len(pending_rows) + len(file_rows) - saved, len(new_file_rows)
+
+async def send_with_retry(bot, chat_id, text, attempts: int = 3):
+    """Send a message, waiting out Telegram flood limits; other errors are logged, not raised"""
+    from telegram.error import RetryAfter
+    for attempt in range(attempts):
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            logger.warning(f"Flood limit hit, retrying summary in {delay}s")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            # Runs in a timer task nobody awaits, so the error would otherwise go unseen
+            logger.error(f"Error sending summary message to {chat_id}: {e}")
+            return
+    logger.error(f"Giving up on summary message to {chat_id}")
+
+class _Batch:
+    __slots__ = ('notify_chat_id', 'pending_rows', 'file_rows', 'timer')
+
+    def __init__(self, notify_chat_id):
+        self.notify_chat_id = notify_chat_id
+        self.pending_rows = []
+        self.file_rows = []
+        self.timer = None
+
+    def __len__(self):
+        return len(self.pending_rows) + len(self.file_rows)
+
+    def last_name(self):
+        rows = self.file_rows or self.pending_rows
+        return rows[-1]['name'] if rows else None
+
+class UploadBatcher:
+    """Collects uploaded documents and writes them to pending_files or files in batches"""
+
+    def __init__(self, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH_SIZE,
+                 summary_delay: float = SUMMARY_DELAY):
+        self.window = window
+        self.max_batch = max_batch
+        self.summary_delay = summary_delay
+        self._batches = {}
+        # Per chat: [saved, last file name, failed, summary timer, categorized, duplicates]
+        self._summaries = {}
+
+    async def add(self, message, bot):
+        """Queue an uploaded document; it is written with the rest of its group"""
+        if message.document:
+            await self.add_document(message.chat_id, message.media_group_id, message.document, bot,
+                                    notify_chat_id=message.chat_id)
+
+    async def add_document(self, chat_id, media_group_id, document, bot, notify_chat_id=None,
+                           category_id: str = None, description: str = None):
+        """Queue a document, straight into a category when one is given, otherwise as pending"""
+        key = (chat_id, media_group_id or 'window')
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(notify_chat_id)
+        if category_id:
+            batch.file_rows.append(catalog_row(document, category_id, description))
+        else:
+            batch.pending_rows.append(document_row(document))
+
+        if batch.timer:
+            batch.timer.cancel()
+        if len(batch) >= self.max_batch:
+            await self._flush(key, bot)
+        else:
+            batch.timer = asyncio.create_task(self._flush_later(key, bot))
+
+    async def _flush_later(self, key, bot):
+        await asyncio.sleep(self.window)
+        await self._flush(key, bot)
+
+    async def _flush(self, key, bot):
+        batch = self._batches.pop(key, None)
+        if not batch or not len(batch):
+            return
+        saved, duplicates, categorized, failed = 0, 0, 0, 0
+        try:
+            saved, duplicates, categorized = await asyncio.to_thread(save_rows, batch.pending_rows, batch.file_rows)
+            logger.info(f"Saved {saved} file(s) from chat {key[0]}, skipped {duplicates} duplicate(s)")
+        except Exception as e:
+            failed = len(batch)
+            logger.error(f"Error saving {failed} file(s): {e}")
+        if batch.notify_chat_id is not None:
+            self._schedule_summary(batch.notify_chat_id, saved, failed, categorized, duplicates,
+                                   batch.last_name(), bot)
+
+    def _schedule_summary(self, chat_id, saved, failed, categorized, duplicates, last_name, bot):
+        # Large forwards are written in several batches but acknowledged once
+        summary = self._summaries.setdefault(chat_id, [0, None, 0, None, 0, 0])
+        summary[0] += saved
+        summary[1] = last_name
+        summary[2] += failed
+        summary[4] += categorized
+        summary[5] += duplicates
+        if summary[3]:
+            summary[3].cancel()
+        summary[3] = asyncio.create_task(self._send_summary_later(chat_id, bot))
+
+    async def _send_summary_later(self, chat_id, bot):
+        await asyncio.sleep(self.summary_delay)
+        await self._send_summary(chat_id, bot)
+
+    async def _send_summary(self, chat_id, bot):
+        summary = self._summaries.pop(chat_id, None)
+        if not summary:
+            return
+        saved, last_name, failed, _, categorized, duplicates = summary
+        pending = saved - categorized
+        if not saved:
+            text = ""
+        elif saved == 1:
+            text = f"✅ File '{last_name}' received!"
+        else:
+            text = f"✅ {saved} files received!"
+        if categorized:
+            text += f"\n📂 {categorized} added straight to their categories."
+        if pending == 1:
+            text += "\nUse the admin panel to assign it to a category."
+        elif pending:
+            text += "\nUse the admin panel to assign them to a category."
+        if duplicates == 1 and not saved:
+            text += f"♻️ File '{last_name}' is already in the catalog."
+        elif duplicates:
+            text += f"\n♻️ {duplicates} file(s) already in the catalog were skipped."
+        if failed:
+            text += f"\n⚠️ {failed} file(s) could not be saved, please send them again."
+        await send_with_retry(bot, chat_id, text.strip())
+
+    async def flush_all(self, bot):
+        """Write every queued batch and send outstanding summaries, e.g. on shutdown"""
+        for key in list(self._batches):
+            batch = self._batches.get(key)
+            if batch and batch.timer:
+                batch.timer.cancel()
+            await self._flush(key, bot)
+        for chat_id in list(self._summaries):
+            summary = self._summaries.get(chat_id)
+            if summary and summary[3]:
+                summary[3].cancel()
+            await self._send_summary(chat_id, bot)
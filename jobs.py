@@ -0,0 +1,253 @@
+"""
+Persistent job queue for long-running admin tasks
+Admin routes enqueue() a row in the jobs table and return at once; worker.py
+claims queued jobs, lowest priority number first, and runs the handler
+registered for their kind with @job_handler (see tasks.py).
+
+A failed attempt is retried after JOB_RETRY_BACKOFF seconds, doubling per
+attempt, until max_attempts is used up. Handlers report progress through their
+JobContext, which is also where cancellation and worker shutdown surface: the
+next progress() call raises JobCancelled or JobInterrupted. A running job whose
+worker stops sending heartbeats for JOB_STALE_AFTER seconds is requeued.
+Call inside an app context.
+"""
+import os
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import NamedTuple, Callable, Optional
+from sqlalchemy import select, update, func
+from models import db, Job
+from metrics import JOB_DURATION, JOB_RUNS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+STATUSES = (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)
+
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "30"))
+MAX_RETRY_BACKOFF = 3600.0
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "300"))
+# Seconds between progress writes; a cancel request is noticed at the next write
+PROGRESS_INTERVAL = 2.0
+# Queued jobs tried per claim when other workers win the race for the first ones
+CLAIM_CANDIDATES = 5
+
+class JobCancelled(Exception):
+    """Raised from JobContext.progress() when an admin cancelled the job"""
+
+class JobInterrupted(Exception):
+    """Raised from JobContext.progress() when the worker is shutting down; the job is requeued"""
+
+class Handler(NamedTuple):
+    func: Callable
+    priority: int
+    max_attempts: int
+
+_handlers = {}
+
+def job_handler(kind: str, priority: int = 100, max_attempts: int = 3):
+    """Register func(ctx) as the handler of kind; its return value is stored as the job result"""
+    def decorator(func):
+        _handlers[kind] = Handler(func, priority, max_attempts)
+        return func
+    return decorator
+
+def get_handler(kind: str) -> Optional[Handler]:
+    # The handlers register themselves on import
+    import tasks  # noqa: F401
+    return _handlers.get(kind)
+
+def enqueue(kind: str, payload: dict = None, priority: int = None, max_attempts: int = None) -> Job:
+    """Add a job to the session; it becomes visible to workers when the caller commits"""
+    handler = get_handler(kind)
+    if handler is None:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        priority=handler.priority if priority is None else priority,
+        max_attempts=handler.max_attempts if max_attempts is None else max_attempts,
+        run_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+def cancel_job(job_id: str) -> Optional[Job]:
+    """Cancel a queued job right away, or ask the worker running it to stop"""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status == QUEUED)
+        .values(status=CANCELLED, cancel_requested=True, finished_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == RUNNING)
+            .values(cancel_requested=True)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return db.session.get(Job, job_id)
+
+def list_jobs(status: str = None, limit: int = 50):
+    query = select(Job).order_by(Job.created_at.desc()).limit(limit)
+    if status:
+        query = query.where(Job.status == status)
+    return db.session.execute(query).scalars().all()
+
+def claim_next(worker_id: str) -> Optional[Job]:
+    """Mark the most urgent due job as running for this worker and return it"""
+    now = datetime.utcnow()
+    candidates = db.session.execute(
+        select(Job.id).where(Job.status == QUEUED, Job.run_at <= now)
+        .order_by(Job.priority, Job.run_at).limit(CLAIM_CANDIDATES)
+    ).scalars().all()
+    for job_id in candidates:
+        # The status condition makes the claim atomic: of several workers racing
+        # for the same row, only one update matches
+        result = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == QUEUED)
+            .values(status=RUNNING, locked_by=worker_id, attempts=Job.attempts + 1,
+                    started_at=now, heartbeat_at=now, error=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(Job, job_id)
+    db.session.rollback()
+    return None
+
+def heartbeat(job_id: str):
+    db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status == RUNNING)
+        .values(heartbeat_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def requeue_stale(stale_after: float = JOB_STALE_AFTER) -> int:
+    """Requeue running jobs whose worker stopped sending heartbeats, or fail those out of attempts"""
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    stale = (Job.status == RUNNING, Job.heartbeat_at < cutoff)
+    failed = db.session.execute(
+        update(Job).where(*stale, Job.attempts >= Job.max_attempts)
+        .values(status=FAILED, locked_by=None, error='Worker stopped responding', finished_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    requeued = db.session.execute(
+        update(Job).where(*stale)
+        .values(status=QUEUED, locked_by=None, run_at=datetime.utcnow(), error='Worker stopped responding')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    if failed or requeued:
+        logger.warning(f"Recovered jobs of unresponsive workers: {requeued} requeued, {failed} failed")
+    return requeued + failed
+
+def retry_delay(attempts: int) -> float:
+    return min(MAX_RETRY_BACKOFF, JOB_RETRY_BACKOFF * 2 ** max(0, attempts - 1))
+
+class JobContext:
+    """Handed to a job handler: payload, resume checkpoint, progress and cancellation"""
+
+    def __init__(self, job: Job, stopping: Callable[[], bool] = None):
+        self.job_id = job.id
+        self.kind = job.kind
+        self.attempt = job.attempts
+        self.payload = json.loads(job.payload) if job.payload else {}
+        self.checkpoint = json.loads(job.checkpoint) if job.checkpoint else None
+        self._stopping = stopping or (lambda: False)
+        self._last_write = 0.0
+
+    def progress(self, done: int, total: int = None, checkpoint=None, force: bool = False):
+        """Record progress and the state a retry should resume from. Commits the session, so call
+        it between batches; writes at most every PROGRESS_INTERVAL seconds unless force"""
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        values = {'progress': done}
+        if total is not None:
+            values['total'] = total
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+            values['checkpoint'] = json.dumps(checkpoint)
+        db.session.execute(
+            update(Job).where(Job.id == self.job_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        cancel_requested = db.session.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar()
+        db.session.commit()
+        if cancel_requested:
+            raise JobCancelled()
+        if self._stopping():
+            raise JobInterrupted()
+
+def _finish(job_id: str, **values):
+    db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status == RUNNING)
+        .values(locked_by=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def run_job(job: Job, stopping: Callable[[], bool] = None) -> str:
+    """Run a claimed job's handler and record the outcome; returns the job's new status"""
+    job_id, kind = job.id, job.kind
+    handler = get_handler(kind)
+    if handler is None:
+        _finish(job_id, status=FAILED, error=f"No handler for job kind {kind!r}", finished_at=datetime.utcnow())
+        JOB_RUNS.labels(kind, FAILED).inc()
+        return FAILED
+
+    ctx = JobContext(job, stopping)
+    outcome = None
+    logger.info(f"Running job {job_id} ({kind}, attempt {ctx.attempt}/{job.max_attempts})")
+    start = time.perf_counter()
+    try:
+        result = handler.func(ctx)
+    except JobCancelled:
+        db.session.rollback()
+        _finish(job_id, status=CANCELLED, finished_at=datetime.utcnow())
+        status = CANCELLED
+    except JobInterrupted:
+        db.session.rollback()
+        # Shutting down is not the job's fault, so the attempt is given back
+        _finish(job_id, status=QUEUED, attempts=Job.attempts - 1, run_at=datetime.utcnow())
+        status, outcome = QUEUED, 'interrupted'
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Job {job_id} ({kind}) failed")
+        job = db.session.get(Job, job_id)
+        error = f"{type(e).__name__}: {e}"
+        if job.cancel_requested:
+            _finish(job_id, status=CANCELLED, error=error, finished_at=datetime.utcnow())
+            status = CANCELLED
+        elif job.attempts < job.max_attempts:
+            delay = retry_delay(job.attempts)
+            _finish(job_id, status=QUEUED, error=error, run_at=datetime.utcnow() + timedelta(seconds=delay))
+            logger.info(f"Retrying job {job_id} in {delay:g}s")
+            status, outcome = QUEUED, 'retry'
+        else:
+            _finish(job_id, status=FAILED, error=error, finished_at=datetime.utcnow())
+            status = FAILED
+    else:
+        db.session.commit()
+        # The last progress report may have been throttled away
+        _finish(job_id, status=SUCCEEDED, finished_at=datetime.utcnow(),
+                progress=func.coalesce(Job.total, Job.progress),
+                result=json.dumps(result) if result is not None else None)
+        status = SUCCEEDED
+
+    JOB_DURATION.labels(kind).observe(time.perf_counter() - start)
+    outcome = outcome or status
+    JOB_RUNS.labels(kind, outcome).inc()
+    logger.info(f"Job {job_id} ({kind}) {outcome}")
+    return status
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the bot handlers
+Seeds a synthetic catalog, then feeds synthetic updates (/start, category and
+file buttons, downloads and searches) from many simulated users into
+TelegramBotService. Bot API calls are answered by a stub that records them
+instead of touching the network. Reports throughput and p50/p95/p99 per handler.
+
+Usage: python loadtest.py [--database-url URL] [--users 50] [--actions 20]
+                          [--categories 30] [--files 2000] [--subscribers 1000]
+"""
+import os
+import sys
+import json
+import time
+import math
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import contextvars
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1000000001, 'is_bot': True, 'first_name': 'Load Test', 'username': 'loadtest_bot'}
+# Relative frequency of each simulated action
+ACTION_WEIGHTS = {'start': 10, 'category': 35, 'file': 30, 'download': 10, 'search': 15}
+SEARCH_TERMS = ['app', 'game', 'mod', 'pro', 'tool', 'تطبيق', 'لعبة', 'v2', 'zzz-no-match']
+SEED_CHUNK_SIZE = 1000
+
+def _stub_request_class():
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        """Answers Bot API calls locally and counts them by method"""
+
+        def __init__(self, latency: float = 0.0):
+            self.latency = latency
+            self.calls = Counter()
+            self._message_id = 0
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        def _message(self, chat_id):
+            self._message_id += 1
+            return {'message_id': self._message_id, 'date': int(time.time()),
+                    'chat': {'id': chat_id or 1, 'type': 'private'}, 'text': ''}
+
+        async def do_request(self, url, method, request_data=None, *args, **kwargs):
+            api_method = url.rsplit('/', 1)[-1]
+            self.calls[api_method] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            params = request_data.parameters if request_data is not None else {}
+            if api_method == 'getMe':
+                result = BOT_USER
+            elif api_method in ('sendMessage', 'editMessageText', 'sendDocument'):
+                result = self._message(params.get('chat_id'))
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+    return StubRequest
+
+def seed(categories: int, files: int, subscribers: int, rng: random.Random):
+    """Insert a synthetic catalog; returns (root category ids, all category ids, file ids)"""
+    import uuid
+    from datetime import datetime
+    from sqlalchemy import insert
+    from database import app, init_schema
+    from models import db, Category, File, Subscriber
+    init_schema()
+
+    with app.app_context():
+        category_rows = []
+        for index in range(categories):
+            # A third of the categories nest under an earlier one
+            parent = rng.choice(category_rows)['id'] if category_rows and index % 3 == 2 else None
+            category_rows.append({'id': str(uuid.uuid4()), 'name': f'Category {index}',
+                                  'parent_id': parent, 'created_at': datetime.utcnow()})
+        db.session.execute(insert(Category), category_rows)
+
+        category_ids = [row['id'] for row in category_rows]
+        file_ids = []
+        for start in range(0, files, SEED_CHUNK_SIZE):
+            rows = []
+            for index in range(start, min(start + SEED_CHUNK_SIZE, files)):
+                term = SEARCH_TERMS[index % (len(SEARCH_TERMS) - 1)]
+                file_id = str(uuid.uuid4())
+                rows.append({'id': file_id, 'name': f'{term} {index}.apk', 'description': f'Synthetic file {index}',
+                             'telegram_file_id': f'stub-file-{index}', 'size': rng.randint(10_000, 200_000_000),
+                             'mime_type': 'application/vnd.android.package-archive',
+                             # Skewed: low-numbered categories hold most files
+                             'category_id': category_ids[min(int(rng.expovariate(4 / len(category_ids))),
+                                                             len(category_ids) - 1)],
+                             'created_at': datetime.utcnow()})
+                file_ids.append(file_id)
+            db.session.execute(insert(File), rows)
+
+        for start in range(0, subscribers, SEED_CHUNK_SIZE):
+            db.session.execute(insert(Subscriber), [
+                {'user_id': 10_000_000 + index, 'first_name': f'User {index}', 'username': f'user{index}',
+                 'is_active': True, 'joined_at': datetime.utcnow()}
+                for index in range(start, min(start + SEED_CHUNK_SIZE, subscribers))
+            ])
+        db.session.commit()
+    roots = [row['id'] for row in category_rows if row['parent_id'] is None]
+    return roots, category_ids, file_ids
+
+class UpdateFactory:
+    """Builds Update objects the way Telegram would deliver them"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+        self._message_id = 0
+
+    def _ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': f'user{user_id}'}
+
+    def message(self, user_id: int, text: str):
+        from telegram import Update
+        update_id, message_id = self._ids()
+        message = {'message_id': message_id, 'date': int(time.time()), 'text': text,
+                   'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id)}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': update_id, 'message': message}, self.bot)
+
+    def callback(self, user_id: int, data: str):
+        from telegram import Update
+        update_id, message_id = self._ids()
+        return Update.de_json({'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self._user(user_id), 'chat_instance': str(user_id), 'data': data,
+            'message': {'message_id': message_id, 'date': int(time.time()), 'text': 'menu',
+                        'chat': {'id': user_id, 'type': 'private'}},
+        }}, self.bot)
+
+# Action being simulated; PTB hands handler exceptions to the error handler instead of raising
+_current_kind = contextvars.ContextVar('loadtest_action', default=None)
+
+async def simulate_user(application, factory, user_id, actions, catalog, rng, timings, errors):
+    """Run one user's session of weighted random actions"""
+    _, category_ids, file_ids = catalog
+    kinds = list(ACTION_WEIGHTS)
+    weights = list(ACTION_WEIGHTS.values())
+    for _ in range(actions):
+        kind = rng.choices(kinds, weights)[0]
+        _current_kind.set(kind)
+        if kind == 'start':
+            update = factory.message(user_id, '/start')
+        elif kind == 'category':
+            update = factory.callback(user_id, f'category_{rng.choice(category_ids)}')
+        elif kind == 'file':
+            update = factory.callback(user_id, f'file_{rng.choice(file_ids)}')
+        elif kind == 'download':
+            update = factory.callback(user_id, f'download_{rng.choice(file_ids)}')
+        else:
+            # The prompt puts the user in search mode; only the query itself is timed
+            await application.process_update(factory.callback(user_id, 'search_files'))
+            update = factory.message(user_id, rng.choice(SEARCH_TERMS))
+        start = time.perf_counter()
+        try:
+            await application.process_update(update)
+        except Exception as e:
+            # Only transport failures get here; handler errors are counted by count_errors
+            errors[kind] += 1
+            logger.debug(f"{kind} failed for {user_id}: {e}")
+        timings[kind].append(time.perf_counter() - start)
+
+def percentile(values, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+def format_report(timings, errors, elapsed: float, api_calls) -> str:
+    lines = [f"{'handler':<10} {'count':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+             f"{'max ms':>9} {'errors':>7}"]
+    total = 0
+    for kind in ACTION_WEIGHTS:
+        values = sorted(timings.get(kind, []))
+        if not values:
+            continue
+        total += len(values)
+        lines.append(
+            f"{kind:<10} {len(values):>7} {len(values) / elapsed:>9.1f} {percentile(values, 0.50) * 1000:>9.2f} "
+            f"{percentile(values, 0.95) * 1000:>9.2f} {percentile(values, 0.99) * 1000:>9.2f} "
+            f"{values[-1] * 1000:>9.2f} {errors.get(kind, 0):>7}"
+        )
+    lines.append(f"\n{total} updates in {elapsed:.2f}s: {total / elapsed:.1f} updates/s")
+    lines.append("Bot API calls: " + ', '.join(f"{method}={count}" for method, count in api_calls.most_common()))
+    return '\n'.join(lines)
+
+async def run(args):
+    from standalone_bot import TelegramBotService
+    from rate_limit import TokenBucketLimiter
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    catalog = seed(args.categories, args.files, args.subscribers, rng)
+    logger.info(f"Seeded {args.categories} categories, {args.files} files and {args.subscribers} subscribers "
+                f"in {time.perf_counter() - started:.1f}s")
+
+    service = TelegramBotService()
+    if not args.rate_limit:
+        service.rate_limiter = TokenBucketLimiter(rate=1e9, burst=10**9)
+    request = _stub_request_class()(latency=args.api_latency / 1000)
+    application = service.build_application(request=request)
+    factory = UpdateFactory(application.bot)
+    timings, errors = defaultdict(list), Counter()
+
+    async def count_errors(update, context):
+        kind = _current_kind.get()
+        if kind:
+            errors[kind] += 1
+        logger.debug(f"{kind} handler failed: {context.error}")
+
+    application.add_error_handler(count_errors)
+
+    async with application:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            simulate_user(application, factory, 20_000_000 + index, args.actions, catalog,
+                          random.Random(args.seed + index), timings, errors)
+            for index in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+    return format_report(timings, errors, elapsed, request.calls)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the bot handlers with a stubbed Bot API")
+    parser.add_argument('--database-url', help="database to seed and query (default: a fresh temporary SQLite file); "
+                                               "use a scratch database, the catalog is added to it")
+    parser.add_argument('--users', type=int, default=50, help="concurrent simulated users")
+    parser.add_argument('--actions', type=int, default=20, help="actions per user")
+    parser.add_argument('--categories', type=int, default=30)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--api-latency', type=float, default=0.0, help="simulated Bot API latency in ms")
+    parser.add_argument('--rate-limit', action='store_true', help="keep the per-user flood protection on")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for a repeatable run")
+    args = parser.parse_args()
+    os.environ.setdefault("DB_PROFILE", "bot")
+
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    logger.setLevel(logging.INFO)
+
+    # The app reads its configuration at import time, so the environment is set first
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'loadtest.db')
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:LOADTEST")
+    os.environ.setdefault("ADMIN_ID", "1")
+
+    print(asyncio.run(run(args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Process-wide logging setup
+Handlers only put records on an in-memory queue; a listener thread formats
+them (JSON lines by default) and writes them to stderr, so a log call on the
+event loop or a request thread never waits on I/O or string formatting.
+
+Environment:
+    LOG_LEVEL        root level (default INFO)
+    LOG_FORMAT       json or text (default json)
+    LOG_LEVELS       per-logger levels, e.g. "sqlalchemy.engine=INFO,standalone_bot=DEBUG"
+    LOG_SAMPLE_RATE  fraction of DEBUG/INFO records kept per logger, e.g. "standalone_bot=0.1";
+                     warnings and errors are always kept
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+# Libraries that log every HTTP request or scheduler tick at INFO
+DEFAULT_LEVELS = {
+    'httpx': 'WARNING',
+    'httpcore': 'WARNING',
+    'apscheduler': 'WARNING',
+}
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+def parse_mapping(value: str):
+    """'a=1,b.c=2' -> {'a': '1', 'b.c': '2'}; malformed entries are ignored"""
+    mapping = {}
+    for item in (value or '').split(','):
+        name, sep, setting = item.partition('=')
+        if sep and name.strip() and setting.strip():
+            mapping[name.strip()] = setting.strip()
+    return mapping
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including fields passed with extra="""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of DEBUG/INFO records from the configured loggers and their children"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def _rate(self, name: str):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate is None or random.random() < rate
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread"""
+
+    def prepare(self, record):
+        # The queue never leaves the process, so msg, args and exc_info can travel as they are
+        return record
+
+def configure_logging(level: str = None, force: bool = False):
+    """Route all logging through a queue to a background writer. Like basicConfig, does nothing
+    when the root logger already has handlers (a CLI script configured it first) unless force"""
+    global _listener
+    if _listener is not None or (logging.getLogger().handlers and not force):
+        return _listener
+
+    stream = logging.StreamHandler(sys.stderr)
+    if os.getenv("LOG_FORMAT", "json").lower() == 'text':
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        stream.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    rates = {}
+    for name, rate in parse_mapping(os.getenv("LOG_SAMPLE_RATE", "")).items():
+        try:
+            rates[name] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            pass
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    for name, logger_level in {**DEFAULT_LEVELS, **parse_mapping(os.getenv("LOG_LEVELS", ""))}.items():
+        logging.getLogger(name).setLevel(logger_level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    # Write out whatever is still queued when the process exits
+    atexit.register(_listener.stop)
+    return _listener
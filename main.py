@@ -2,26 +2,57 @@ import logging
 import threading
 import time
 import os
+import urllib.request
 from app import app
-from bot import start_bot
+from log_config import configure_logging
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 
 logger = logging.getLogger(__name__)
 
+# Restart delay after a crash; doubles while the health probe keeps failing
+RESTART_BACKOFF = 0.5
+MAX_RESTART_BACKOFF = 30.0
+# A bot that ran this long before failing restarts from the shortest delay again
+STABLE_AFTER = 60.0
+
+def dependencies_healthy() -> bool:
+    """True when the database answers and the Bot API accepts the token"""
+    from sqlalchemy import text
+    from models import db
+    try:
+        with app.app_context():
+            db.session.execute(text('SELECT 1'))
+        token = os.getenv("TELEGRAM_BOT_TOKEN", "")
+        with urllib.request.urlopen(f"https://api.telegram.org/bot{token}/getMe", timeout=5) as response:
+            return response.status == 200
+    except Exception as e:
+        logger.warning(f"Health probe failed: {e}")
+        return False
+
 def run_bot():
-    """Run Telegram bot"""
+    """Run the Telegram bot service, restarting it after a crash; call from the main thread"""
+    from standalone_bot import TelegramBotService
+    delay = RESTART_BACKOFF
     while True:
+        started = time.monotonic()
         try:
             logger.info("Starting Telegram bot service...")
-            start_bot()
+            # Drains in-flight updates and replays saved ones like the supervised bot
+            TelegramBotService().run()
+            # A clean return means SIGTERM/SIGINT stopped the bot
+            return
         except Exception as e:
             logger.error(f"Bot error: {e}")
-            logger.info("Restarting bot in 5 seconds...")
-            time.sleep(5)
+        if time.monotonic() - started >= STABLE_AFTER:
+            delay = RESTART_BACKOFF
+        # Restart as soon as the database and Bot API answer instead of after a fixed pause
+        while True:
+            time.sleep(delay)
+            delay = min(MAX_RESTART_BACKOFF, delay * 2)
+            if dependencies_healthy():
+                break
+        logger.info("Restarting bot")
 
 # Note: Bot service is started separately to avoid event loop conflicts
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Deploy-time management commands
+
+Usage:
+    python manage.py init-db          create missing tables, columns and indexes
+    python manage.py startup-report   time fresh imports of the bot and admin panel entry points
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import subprocess
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+# Module imported by each process type; the bot must not pull in the admin panel
+ENTRY_POINTS = {
+    'bot': 'standalone_bot',
+    'web': 'app',
+}
+# Modules the bot process should never load
+WEB_ONLY_MODULES = ('app', 'routes')
+
+def init_db():
+    os.environ.setdefault("DB_PROFILE", "batch")
+    from database import init_schema
+    init_schema()
+    return 0
+
+def _time_import(module: str):
+    """Import module in a fresh interpreter; returns (seconds, loaded web-only modules)"""
+    code = (
+        "import sys, time\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - started\n"
+        f"print(elapsed, ','.join(m for m in {WEB_ONLY_MODULES!r} if m in sys.modules), sep='|')\n"
+    )
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:STARTUP")
+    env.setdefault("ADMIN_ID", "1")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    seconds, loaded = result.stdout.strip().splitlines()[-1].split('|')
+    return float(seconds), [name for name in loaded.split(',') if name]
+
+def startup_report(runs: int = 3):
+    """Print the median import time of each entry point over fresh interpreters"""
+    failures = 0
+    for name, module in ENTRY_POINTS.items():
+        timings, loaded = [], []
+        for _ in range(runs):
+            seconds, loaded = _time_import(module)
+            timings.append(seconds)
+        line = f"{name:<4} import {module}: median {statistics.median(timings) * 1000:.0f} ms, " \
+               f"min {min(timings) * 1000:.0f} ms over {runs} runs"
+        if name == 'bot' and loaded:
+            line += f"  [loads web-only modules: {', '.join(loaded)}]"
+            failures += 1
+        print(line)
+    return 1 if failures else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Deploy-time management commands")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('init-db', help="create missing tables, columns and indexes")
+    report = subparsers.add_parser('startup-report', help="time fresh imports of each entry point")
+    report.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    started = time.perf_counter()
+    if args.command == 'init-db':
+        status = init_db()
+    else:
+        status = startup_report(args.runs)
+    logger.info(f"{args.command} finished in {time.perf_counter() - started:.2f}s")
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+Prometheus metrics for the admin panel and the bot
+Counters and histograms keep one small lock per label set, so recording a sample
+never contends on a global lock. Each process exposes its own registry in the
+Prometheus text format.
+"""
+import os
+import hmac
+import time
+import bisect
+import logging
+import threading
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from query_inspector import unit_of_work
+from tracing import trace, child_span
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds; covers fast cache hits up to slow Telegram uploads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Return the child for one set of label values, creating it on first use"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in self._samples())
+        return '\n'.join(lines)
+
+class _Value:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = float(value)
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, key), child.value
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1.0):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ('target', 'start')
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.start)
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self):
+        return _Timer(self._children[()])
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _format_labels(self.labelnames, key, [('le', _format_value(bound))]), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labelnames, key), total
+            yield f'{self.name}_count', _format_labels(self.labelnames, key), cumulative
+
+class CallbackGauge(_Metric):
+    """Gauge read from a function at scrape time
+
+    The function returns a number, or a dict of label value tuples to numbers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, func, labelnames=(), kind: str = 'gauge', registry=None):
+        self.func = func
+        self.kind = kind
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return None
+
+    def _samples(self):
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.error(f"Error reading metric {self.name}: {e}")
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield self.name, _format_labels(self.labelnames, key), value
+
+class Registry:
+    """Metrics exposed by this process"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+REGISTRY = Registry()
+
+# Bot handlers
+HANDLER_DURATION = Histogram('bot_handler_duration_seconds', 'Bot handler latency', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Bot handler exceptions', ['handler', 'error'])
+THROTTLED_UPDATES = Counter('bot_throttled_updates_total', 'Updates dropped by flood protection')
+
+# Outbound Telegram Bot API calls
+TELEGRAM_API_DURATION = Histogram('telegram_api_duration_seconds', 'Telegram Bot API call latency', ['method'])
+TELEGRAM_API_ERRORS = Counter('telegram_api_errors_total', 'Failed Telegram Bot API calls', ['method', 'error'])
+
+# Database
+DB_QUERY_DURATION = Histogram('db_query_duration_seconds', 'SQL statement latency', ['statement'], buckets=DB_BUCKETS)
+
+# Admin panel
+HTTP_REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Admin panel request latency', ['endpoint', 'method'])
+HTTP_RESPONSES = Counter('http_responses_total', 'Admin panel responses', ['endpoint', 'status'])
+
+# Broadcasts
+BROADCAST_MESSAGES = Counter('broadcast_messages_total', 'Broadcast messages by outcome', ['result'])
+BROADCAST_PENDING = Gauge('broadcast_pending_messages', 'Messages left in the running broadcasts')
+
+# Background jobs
+JOB_DURATION = Histogram('job_duration_seconds', 'Background job run time per attempt', ['kind'])
+JOB_RUNS = Counter('job_runs_total', 'Background job attempts by outcome', ['kind', 'status'])
+
+def _file_cache_stat(*keys):
+    def read():
+        from file_cache import file_cache
+        stats = file_cache.stats()
+        return {(key,): stats[key] for key in keys} if len(keys) > 1 else stats[keys[0]]
+    return read
+
+CallbackGauge('file_cache_entries', 'Records held by the file cache of this process', _file_cache_stat('size'))
+CallbackGauge('file_cache_lookups_total', 'File cache lookups of this process by result',
+              _file_cache_stat('hits', 'misses'), ['result'], kind='counter')
+CallbackGauge('file_cache_removals_total', 'File cache entries dropped by this process by reason',
+              _file_cache_stat('evictions', 'expirations', 'invalidations'), ['reason'], kind='counter')
+
+def _replica_health():
+    from replicas import replica_set
+    return {(replica['replica'],): int(replica['healthy']) for replica in replica_set.status()}
+
+CallbackGauge('db_replica_healthy', 'Read replicas in rotation (1) or taken out (0)', _replica_health, ['replica'])
+
+def _statement_kind(statement: str) -> str:
+    keyword = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ''
+    return keyword if keyword in ('select', 'insert', 'update', 'delete') else 'other'
+
+def instrument_engine(engine):
+    """Time every SQL statement run on engine"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_metrics_start', None)
+        if start is not None:
+            DB_QUERY_DURATION.labels(_statement_kind(statement)).observe(time.perf_counter() - start)
+
+def instrument_flask(app):
+    """Time admin panel requests by endpoint"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unknown'
+            HTTP_REQUEST_DURATION.labels(endpoint, request.method).observe(time.perf_counter() - start)
+            HTTP_RESPONSES.labels(endpoint, response.status_code).inc()
+        return response
+
+def instrument_handler(name: str):
+    """Decorator recording latency, exceptions, queries and a trace span of an async bot handler"""
+    def decorator(func):
+        histogram = HANDLER_DURATION.labels(name)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                # Queries are attributed to the outermost handler of the update
+                with unit_of_work(name), trace(name):
+                    return await func(*args, **kwargs)
+            except Exception as e:
+                HANDLER_ERRORS.labels(name, type(e).__name__).inc()
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# Status codes the Bot API answers with, named after the errors python-telegram-bot raises for them
+_STATUS_ERRORS = {400: 'BadRequest', 401: 'InvalidToken', 403: 'Forbidden', 404: 'InvalidToken',
+                  409: 'Conflict', 429: 'RetryAfter', 502: 'NetworkError'}
+_request_class = None
+
+def build_request(**kwargs):
+    """HTTPXRequest that records latency and errors per Bot API method"""
+    global _request_class
+    if _request_class is None:
+        from telegram.request import HTTPXRequest
+
+        class InstrumentedRequest(HTTPXRequest):
+            async def do_request(self, url, method, *args, **kwargs):
+                api_method = url.rsplit('/', 1)[-1]
+                start = time.perf_counter()
+                try:
+                    with child_span(f'telegram.{api_method}', 'CLIENT') as span:
+                        code, payload = await super().do_request(url, method, *args, **kwargs)
+                        if span is not None:
+                            span.set_attribute('http.status_code', code)
+                except Exception as e:
+                    TELEGRAM_API_ERRORS.labels(api_method, type(e).__name__).inc()
+                    raise
+                finally:
+                    TELEGRAM_API_DURATION.labels(api_method).observe(time.perf_counter() - start)
+                if code >= 400:
+                    TELEGRAM_API_ERRORS.labels(api_method, _STATUS_ERRORS.get(code, f'HTTP{code}')).inc()
+                return code, payload
+
+        _request_class = InstrumentedRequest
+    return _request_class(**kwargs)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        token = os.getenv("METRICS_TOKEN", "")
+        if token and not hmac.compare_digest(self.headers.get('Authorization', ''), f'Bearer {token}'):
+            self.send_error(401)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port: int, host: str = None):
+    """Serve /metrics from a daemon thread; only on localhost unless METRICS_TOKEN is set"""
+    if host is None:
+        if os.getenv("METRICS_TOKEN", ""):
+            host = '0.0.0.0'
+        else:
+            host = '127.0.0.1'
+            logger.warning("METRICS_TOKEN is not set; serving metrics on 127.0.0.1 only")
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"Serving metrics on {host}:{port}")
+    return server
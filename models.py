@@ -1,18 +1,27 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import String, Integer, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import (
+    String, Integer, Text, Date, DateTime, Boolean, ForeignKey, Index, inspect, text, func, literal_column
+)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from datetime import datetime
+from sqlalchemy.schema import CreateIndex
+from datetime import datetime, date
+import logging
 from typing import Optional, List
 import uuid
+from replicas import RoutingSession
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
 class Category(db.Model):
     __tablename__ = 'categories'
+    __table_args__ = (
+        # Root menu, subcategory listings and subtree walks
+        Index('ix_categories_parent_id', 'parent_id'),
+    )
     
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -36,11 +45,19 @@ class Category(db.Model):
 
 class File(db.Model):
     __tablename__ = 'files'
+    __table_args__ = (
+        # Keyset pagination and category listings in the admin panel
+        Index('ix_files_name_id', 'name', 'id'),
+        Index('ix_files_created_at_id', 'created_at', 'id'),
+        Index('ix_files_category_id', 'category_id'),
+    )
     
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     category_id: Mapped[str] = mapped_column(String(36), ForeignKey('categories.id'), nullable=False)
     telegram_file_id: Mapped[Optional[str]] = mapped_column(String(255))
+    # Stable across bots and sessions, unlike telegram_file_id; used to detect re-uploads
+    file_unique_id: Mapped[Optional[str]] = mapped_column(String(64), index=True, unique=True)
     description: Mapped[Optional[str]] = mapped_column(Text)
     size: Mapped[Optional[int]] = mapped_column(Integer)
     mime_type: Mapped[Optional[str]] = mapped_column(String(100))
@@ -55,14 +72,22 @@ class File(db.Model):
             'name': self.name,
             'category_id': self.category_id,
             'telegram_file_id': self.telegram_file_id,
+            'file_unique_id': self.file_unique_id,
             'description': self.description,
             'size': self.size,
             'mime_type': self.mime_type,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+# Keyset pagination by size in the admin panel, which sorts the nullable size as coalesce(size, 0)
+Index('ix_files_size_id', func.coalesce(File.size, literal_column('0')), File.id)
+
 class Subscriber(db.Model):
     __tablename__ = 'subscribers'
+    __table_args__ = (
+        # Active subscriber counts and broadcast pages without touching the table
+        Index('ix_subscribers_is_active_user_id', 'is_active', 'user_id'),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(Integer, unique=True, nullable=False)
@@ -83,9 +108,14 @@ class Subscriber(db.Model):
 
 class PendingFile(db.Model):
     __tablename__ = 'pending_files'
+    __table_args__ = (
+        # Keyset paging of the pending list, newest first
+        Index('ix_pending_files_uploaded_at_id', 'uploaded_at', 'id'),
+    )
     
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     telegram_file_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    file_unique_id: Mapped[Optional[str]] = mapped_column(String(64), index=True, unique=True)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     size: Mapped[Optional[int]] = mapped_column(Integer)
     mime_type: Mapped[Optional[str]] = mapped_column(String(100))
@@ -95,12 +125,71 @@ class PendingFile(db.Model):
         return {
             'id': self.id,
             'telegram_file_id': self.telegram_file_id,
+            'file_unique_id': self.file_unique_id,
             'name': self.name,
             'size': self.size,
             'mime_type': self.mime_type,
             'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None
         }
 
+class CategoryRule(db.Model):
+    __tablename__ = 'category_rules'
+    
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    category_id: Mapped[str] = mapped_column(String(36), ForeignKey('categories.id'), nullable=False)
+    # Any combination of conditions; a rule matches when all of its set conditions match
+    name_pattern: Mapped[Optional[str]] = mapped_column(String(500))
+    extensions: Mapped[Optional[str]] = mapped_column(String(255))
+    mime_pattern: Mapped[Optional[str]] = mapped_column(String(100))
+    min_size: Mapped[Optional[int]] = mapped_column(Integer)
+    max_size: Mapped[Optional[int]] = mapped_column(Integer)
+    priority: Mapped[int] = mapped_column(Integer, default=100)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'category_id': self.category_id,
+            'name_pattern': self.name_pattern,
+            'extensions': self.extensions,
+            'mime_pattern': self.mime_pattern,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'priority': self.priority,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+    
+    # Bumped by admin writes so other processes know to drop their cached records
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class BotState(db.Model):
+    __tablename__ = 'bot_state'
+    
+    # Bot process state that must survive restarts, such as the last processed update
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    value: Mapped[Optional[str]] = mapped_column(Text)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class FileDownloadStat(db.Model):
+    __tablename__ = 'file_download_stats'
+    __table_args__ = (
+        # Top-N queries over recent days
+        Index('ix_file_download_stats_day', 'day'),
+    )
+    
+    file_id: Mapped[str] = mapped_column(String(36), ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
 class BroadcastMessage(db.Model):
     __tablename__ = 'broadcast_messages'
     
@@ -117,4 +206,100 @@ class BroadcastMessage(db.Model):
             'sent_at': self.sent_at.isoformat() if self.sent_at else None,
             'sent_to_count': self.sent_to_count,
             'failed_count': self.failed_count
-        }
\ No newline at end of file
+        }
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # The worker's claim query: next queued job by priority, then age
+        Index('ix_jobs_status_priority', 'status', 'priority', 'run_at'),
+    )
+
+    # Long-running admin task executed by worker.py; see jobs.py
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)
+    payload: Mapped[Optional[str]] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(20), default='queued', nullable=False)
+    # Lower runs first
+    priority: Mapped[int] = mapped_column(Integer, default=100, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=3, nullable=False)
+    run_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    progress: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    total: Mapped[Optional[int]] = mapped_column(Integer)
+    # Handler state that lets a retried job resume where the failed attempt stopped
+    checkpoint: Mapped[Optional[str]] = mapped_column(Text)
+    result: Mapped[Optional[str]] = mapped_column(Text)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    locked_by: Mapped[Optional[str]] = mapped_column(String(100))
+    # Refreshed while the job runs; a stale value means its worker died
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'priority': self.priority,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'progress': self.progress,
+            'total': self.total,
+            'result': self.result,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+def upsert_insert(model):
+    """Return an INSERT supporting ON CONFLICT clauses, or None on dialects without it"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(model)
+
+def upgrade_schema():
+    """Add columns and indexes that db.create_all() skips on tables that already exist"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            # Only nullable columns can be added to a populated table without a default
+            if column.name in existing_columns or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    # IF NOT EXISTS rather than checkfirst: reflection skips expression indexes such as ix_files_size_id
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+    create_search_index()
+
+def create_search_index():
+    """Trigram index serving the bot's substring search on PostgreSQL; skipped where pg_trgm is unavailable"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_files_name_trgm ON files USING gin (name gin_trgm_ops)'))
+        return True
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Trigram search index not created: {e}")
+        return False
@@ -0,0 +1,171 @@
+"""
+On-demand CPU and memory profiling of a running process
+Profiles are time-boxed and one runs at a time. Reports are plain text meant to
+be downloaded from the admin panel or sent by the bot as a document.
+"""
+import io
+import os
+import math
+import sys
+import time
+import pstats
+import asyncio
+import cProfile
+import threading
+import tracemalloc
+import traceback
+from collections import Counter
+from datetime import datetime
+
+MAX_PROFILE_SECONDS = 60
+DEFAULT_PROFILE_SECONDS = 10
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+REPORT_LIMIT = 40
+
+_profile_lock = threading.Lock()
+_last_snapshot = None
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+def clamp_seconds(value) -> float:
+    """Parse a requested duration, raising ValueError for junk"""
+    if value in (None, ''):
+        return DEFAULT_PROFILE_SECONDS
+    seconds = float(value)
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError('Duration must be a positive number')
+    return min(seconds, MAX_PROFILE_SECONDS)
+
+def _acquire():
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy('Another profile is already running')
+
+def _header(title: str, seconds: float) -> str:
+    return f"{title}\npid {os.getpid()}, {seconds:g}s from {datetime.utcnow().isoformat()} UTC\n\n"
+
+def _sample_stacks(seconds: float, interval: float):
+    """Collapsed stacks of every other thread, sampled for seconds"""
+    own_thread = threading.get_ident()
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    thread_names = {}
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            entries = traceback.extract_stack(frame)
+            stack = ';'.join(f'{os.path.basename(entry.filename)}:{entry.name}:{entry.lineno}' for entry in entries)
+            stacks[f'{thread_names.get(thread_id, thread_id)};{stack}'] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+def _format_samples(stacks: Counter, samples: int, limit: int = REPORT_LIMIT) -> str:
+    out = io.StringIO()
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(';', 1)[-1]] += count
+    out.write(f"{samples} sample rounds\n\n")
+    if not stacks:
+        # A single-threaded worker (plain gunicorn sync) has nothing else to sample
+        out.write("No other threads were running; serve with threads (gunicorn --threads) to profile requests.\n")
+        return out.getvalue()
+    out.write("Hottest frames (share of samples across threads)\n")
+    for frame, count in leaves.most_common(limit):
+        out.write(f"{count / max(samples, 1):7.1%}  {frame}\n")
+    out.write("\nCollapsed stacks (flamegraph.pl / speedscope input)\n")
+    for stack, count in stacks.most_common():
+        out.write(f"{stack} {count}\n")
+    return out.getvalue()
+
+def sample_profile(seconds: float = DEFAULT_PROFILE_SECONDS, interval: float = SAMPLE_INTERVAL) -> str:
+    """Sample the stacks of all threads for seconds; blocks the calling thread"""
+    _acquire()
+    try:
+        stacks, samples = _sample_stacks(seconds, interval)
+    finally:
+        _profile_lock.release()
+    return _header('Sampling CPU profile', seconds) + _format_samples(stacks, samples)
+
+async def profile_event_loop(seconds: float = DEFAULT_PROFILE_SECONDS) -> str:
+    """cProfile the running event loop while sampling every other thread"""
+    _acquire()
+    try:
+        profiler = cProfile.Profile()
+        sampler = asyncio.create_task(asyncio.to_thread(_sample_stacks, seconds, SAMPLE_INTERVAL))
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        stacks, samples = await sampler
+    finally:
+        _profile_lock.release()
+
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LIMIT)
+    out.write('\n')
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(REPORT_LIMIT)
+    return (_header('Event loop cProfile', seconds) + out.getvalue()
+            + '\n\n' + _format_samples(stacks, samples))
+
+def _memory_report(snapshot, previous, seconds: float, started_here: bool, limit: int) -> str:
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+    out = io.StringIO()
+    current, peak = tracemalloc.get_traced_memory()
+    out.write(_header('tracemalloc snapshot', seconds))
+    if started_here:
+        out.write("Tracing was started for this report: only allocations made during the window are shown.\n")
+    out.write(f"Traced memory: {current / 1024:.1f} KiB current, {peak / 1024:.1f} KiB peak\n\n")
+    out.write("Top allocations by line\n")
+    for stat in snapshot.statistics('lineno')[:limit]:
+        out.write(f"{stat}\n")
+    if previous is not None:
+        out.write("\nGrowth since the previous snapshot\n")
+        for stat in snapshot.compare_to(previous, 'lineno')[:limit]:
+            out.write(f"{stat}\n")
+    out.write("\nLargest allocation tracebacks\n")
+    for stat in snapshot.statistics('traceback')[:5]:
+        out.write(f"\n{stat.count} blocks, {stat.size / 1024:.1f} KiB\n")
+        out.write('\n'.join(stat.traceback.format()) + '\n')
+    return out.getvalue()
+
+def memory_snapshot(seconds: float = DEFAULT_PROFILE_SECONDS, limit: int = REPORT_LIMIT) -> str:
+    """Report the top allocations; blocks the calling thread
+
+    When tracemalloc is not already tracing (PYTHONTRACEMALLOC), it traces for
+    seconds and stops again so it costs nothing between reports.
+    """
+    global _last_snapshot
+    _acquire()
+    try:
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        try:
+            if started_here:
+                time.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            report = _memory_report(snapshot, None if started_here else _last_snapshot,
+                                    seconds if started_here else 0, started_here, limit)
+        finally:
+            # Never leave tracing (and its overhead) on after a failed report
+            if started_here:
+                tracemalloc.stop()
+        if not started_here:
+            _last_snapshot = snapshot
+    finally:
+        _profile_lock.release()
+    return report
+
+def report_filename(kind: str) -> str:
+    return f"{kind}-{os.getpid()}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.txt"
@@ -0,0 +1,174 @@
+"""
+Slow-query log and N+1 detector
+Queries are attributed to the current unit of work (an admin panel request or a
+bot update) through a context variable. Statements over SLOW_QUERY_MS are logged
+with their parameters, and a statement repeated QUERY_REPEAT_THRESHOLD times in
+one unit is reported as a likely N+1.
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+# Findings kept in memory for the admin panel
+MAX_FINDINGS = 100
+MAX_PARAMETERS_LENGTH = 500
+
+class UnitOfWork:
+    """Queries run while handling one request or update"""
+    __slots__ = ('name', 'queries', 'duration', 'statements')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, duration: float):
+        self.queries += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int = None):
+        """Statements run at least threshold times, most repeated first"""
+        threshold = threshold or QUERY_REPEAT_THRESHOLD
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+_current = contextvars.ContextVar('query_unit', default=None)
+
+class QueryReport:
+    """Per-unit query totals and recent findings of this process"""
+
+    def __init__(self, max_findings: int = MAX_FINDINGS):
+        self._lock = threading.Lock()
+        self.units = {}
+        self.slow_queries = deque(maxlen=max_findings)
+        self.repeated_queries = deque(maxlen=max_findings)
+
+    def add_slow(self, unit_name, statement, parameters, duration):
+        with self._lock:
+            self.slow_queries.append({
+                'unit': unit_name,
+                'statement': statement,
+                'parameters': parameters,
+                'duration_ms': round(duration * 1000, 2),
+                'at': datetime.utcnow().isoformat(),
+            })
+
+    def add_unit(self, unit: UnitOfWork):
+        repeated = unit.repeated()
+        with self._lock:
+            totals = self.units.setdefault(unit.name, {'count': 0, 'queries': 0, 'max_queries': 0,
+                                                      'duration_ms': 0.0, 'repeated': 0})
+            totals['count'] += 1
+            totals['queries'] += unit.queries
+            totals['max_queries'] = max(totals['max_queries'], unit.queries)
+            totals['duration_ms'] += unit.duration * 1000
+            if repeated:
+                totals['repeated'] += 1
+                self.repeated_queries.append({
+                    'unit': unit.name,
+                    'queries': unit.queries,
+                    'statements': [{'statement': statement, 'count': count} for statement, count in repeated],
+                    'at': datetime.utcnow().isoformat(),
+                })
+        return repeated
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            units = {
+                name: dict(totals,
+                           duration_ms=round(totals['duration_ms'], 2),
+                           avg_queries=round(totals['queries'] / totals['count'], 2))
+                for name, totals in self.units.items()
+            }
+            return {
+                'slow_query_ms': SLOW_QUERY_MS,
+                'repeat_threshold': QUERY_REPEAT_THRESHOLD,
+                'units': units,
+                'slow_queries': list(self.slow_queries),
+                'repeated_queries': list(self.repeated_queries),
+            }
+
+query_report = QueryReport()
+
+def current_unit():
+    return _current.get()
+
+@contextmanager
+def unit_of_work(name: str):
+    """Attribute queries run inside the block to name; nested units join the outer one"""
+    if _current.get() is not None:
+        yield _current.get()
+        return
+    unit = UnitOfWork(name)
+    token = _current.set(unit)
+    try:
+        yield unit
+    finally:
+        _current.reset(token)
+        finish_unit(unit)
+
+def finish_unit(unit: UnitOfWork):
+    """Record a finished unit and log its repeated statements"""
+    if not unit.queries:
+        return
+    for statement, count in query_report.add_unit(unit):
+        logger.warning(f"Possible N+1 in {unit.name}: statement ran {count} times "
+                       f"({unit.queries} queries in total): {statement}")
+
+def _format_parameters(parameters) -> str:
+    text = repr(parameters)
+    if len(text) > MAX_PARAMETERS_LENGTH:
+        text = text[:MAX_PARAMETERS_LENGTH] + '...'
+    return text
+
+def inspect_engine(engine):
+    """Attribute and time every statement run on engine"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._inspector_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_inspector_start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        unit = _current.get()
+        if unit is not None:
+            unit.record(statement, duration)
+        if duration * 1000 >= SLOW_QUERY_MS:
+            unit_name = unit.name if unit is not None else 'background'
+            formatted = _format_parameters(parameters)
+            logger.warning(f"Slow query in {unit_name} ({duration * 1000:.1f} ms): {statement} -- {formatted}")
+            query_report.add_slow(unit_name, statement, formatted, duration)
+
+def inspect_requests(app):
+    """Treat each admin panel request as one unit of work"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_unit():
+        unit = UnitOfWork(f"{request.method} {request.endpoint or request.path}")
+        g.query_unit_token = _current.set(unit)
+
+    @app.teardown_request
+    def _finish_unit(exc=None):
+        token = g.pop('query_unit_token', None)
+        if token is None:
+            return
+        unit = _current.get()
+        _current.reset(token)
+        if unit is not None:
+            finish_unit(unit)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check
+Runs EXPLAIN on the key catalog queries and exits non-zero when one of them
+plans a full table scan. On PostgreSQL sequential scans are disabled for the
+check, so a Seq Scan in the plan means no usable index exists regardless of
+table size. Pair with datagen.py to look at plans at production scale.
+
+Checks the schema as deployed (`python manage.py init-db`), without creating anything.
+
+Usage: python query_plans.py [--database-url URL] [--verbose]
+"""
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TERM = 'app'
+_SQLITE_SCAN = re.compile(r'^SCAN (\w+)(.*)$')
+
+def key_queries(category_id: str, trigram_index: bool):
+    """(name, statement, full scan allowed) for each query the bot and admin panel depend on"""
+    from sqlalchemy import select, delete
+    from models import Category, File, Subscriber
+
+    subtree = select(Category.id).where(Category.id == category_id).cte('subtree', recursive=True)
+    subtree = subtree.union_all(select(Category.id).join(subtree, Category.parent_id == subtree.c.id))
+    return [
+        ('root menu', select(Category).where(Category.parent_id.is_(None)), False),
+        ('subcategories', select(Category).where(Category.parent_id == category_id), False),
+        ('category files', select(File).where(File.category_id == category_id), False),
+        ('files page', select(File).order_by(File.name, File.id).limit(50), False),
+        # A leading-wildcard ILIKE can only use an index through pg_trgm
+        ('search', select(File).where(File.name.ilike(f'%{SEARCH_TERM}%')).limit(20), not trigram_index),
+        ('active subscribers', select(Subscriber.user_id).where(Subscriber.is_active == True)  # noqa: E712
+         .order_by(Subscriber.user_id).limit(1000), False),
+        ('subtree', select(subtree.c.id), False),
+        ('subtree delete', delete(File).where(File.category_id.in_(select(subtree.c.id))), False),
+    ]
+
+def _explain(connection, statement, postgres: bool):
+    compiled = statement.compile(dialect=connection.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    prefix = 'EXPLAIN (FORMAT JSON) ' if postgres else 'EXPLAIN QUERY PLAN '
+    return connection.exec_driver_sql(prefix + compiled.string, params).all()
+
+def _postgres_scans(node, tables, found):
+    if node.get('Node Type') == 'Seq Scan' and node.get('Relation Name') in tables:
+        found.append(node['Relation Name'])
+    for child in node.get('Plans', []):
+        _postgres_scans(child, tables, found)
+    return found
+
+def full_scans(plan_rows, postgres: bool, tables):
+    """Tables read in full according to an EXPLAIN result, and a printable plan"""
+    if postgres:
+        plan = plan_rows[0][0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        root = plan[0]['Plan']
+        return _postgres_scans(root, tables, []), json.dumps(root, indent=2)
+    scans = []
+    for row in plan_rows:
+        detail = row[-1]
+        match = _SQLITE_SCAN.match(detail)
+        # "SCAN t USING [COVERING] INDEX" walks an index in order and is fine
+        if match and match.group(1) in tables and 'USING' not in match.group(2):
+            scans.append(match.group(1))
+    return scans, '\n'.join(row[-1] for row in plan_rows)
+
+def check(verbose: bool = False) -> int:
+    """Print a line per key query; returns the number of regressions"""
+    from sqlalchemy import select, func, text
+    from database import app
+    from models import db, Category, File
+
+    with app.app_context():
+        postgres = db.engine.dialect.name == 'postgresql'
+        tables = set(db.metadata.tables)
+        # Prefer the category holding the most files, like the hot categories in production
+        category_id = db.session.execute(
+            select(File.category_id).group_by(File.category_id).order_by(func.count().desc()).limit(1)
+        ).scalar() or db.session.execute(select(Category.id).limit(1)).scalar() or 'missing'
+        trigram_index = postgres and bool(db.session.execute(
+            text("SELECT 1 FROM pg_indexes WHERE indexname = 'ix_files_name_trgm'")
+        ).scalar())
+        db.session.rollback()
+
+        regressions = 0
+        with db.engine.connect() as connection:
+            if postgres:
+                connection.exec_driver_sql('SET enable_seqscan = off')
+            for name, statement, scan_allowed in key_queries(category_id, trigram_index):
+                scans, plan = full_scans(_explain(connection, statement, postgres), postgres, tables)
+                if not scans:
+                    status = 'ok'
+                elif scan_allowed:
+                    status = f"known scan ({', '.join(scans)})"
+                else:
+                    status = f"FULL SCAN ({', '.join(scans)})"
+                    regressions += 1
+                print(f"{name:<20} {status}")
+                if verbose or (scans and not scan_allowed):
+                    print('    ' + plan.replace('\n', '\n    '))
+            connection.rollback()
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when a key catalog query plans a full table scan")
+    parser.add_argument('--database-url', help="database to check (default: DATABASE_URL)")
+    parser.add_argument('--verbose', action='store_true', help="print every plan, not only regressions")
+    args = parser.parse_args()
+    os.environ.setdefault("DB_PROFILE", "batch")
+
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    regressions = check(args.verbose)
+    if regressions:
+        print(f"\n{regressions} query plan regression(s)")
+        sys.exit(1)
+    print("\nAll key queries use an index")
+
+if __name__ == "__main__":
+    main()
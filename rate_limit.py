@@ -0,0 +1,68 @@
+"""
+Per-user flood protection for bot handlers
+A token bucket per user with O(1) updates; idle buckets expire in LRU order.
+"""
+import os
+import time
+from collections import OrderedDict
+
+class TokenBucketLimiter:
+    """Allows `burst` requests at once, refilled at `rate` requests per second per user"""
+
+    def __init__(self, rate: float = 1.0, burst: int = 8, idle_ttl: float = 600.0,
+                 max_users: int = 100000, notice_interval: float = 10.0):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.notice_interval = notice_interval
+        # user_id -> [tokens, last refill time, last throttle notice time]; least recently seen first
+        self._buckets = OrderedDict()
+        self.throttled = 0
+
+    def _expire(self, now: float):
+        # Only the oldest few entries are checked, keeping each call O(1) amortized
+        for _ in range(2):
+            if not self._buckets:
+                return
+            bucket = next(iter(self._buckets.values()))
+            if now - bucket[1] < self.idle_ttl and len(self._buckets) <= self.max_users:
+                return
+            self._buckets.popitem(last=False)
+
+    def allow(self, user_id, now: float = None) -> bool:
+        """Take a token for user_id; False when the user is over the limit"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [float(self.burst), now, None]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(user_id)
+        self._expire(now)
+
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return True
+        self.throttled += 1
+        return False
+
+    def should_notify(self, user_id, now: float = None) -> bool:
+        """True at most once per notice_interval for a throttled user"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(user_id)
+        if bucket is None or (bucket[2] is not None and now - bucket[2] < self.notice_interval):
+            return False
+        bucket[2] = now
+        return True
+
+    def __len__(self):
+        return len(self._buckets)
+
+def limiter_from_env() -> TokenBucketLimiter:
+    """Build the bot's limiter from RATE_LIMIT_PER_SECOND and RATE_LIMIT_BURST"""
+    return TokenBucketLimiter(
+        rate=float(os.getenv("RATE_LIMIT_PER_SECOND", "1")),
+        burst=int(os.getenv("RATE_LIMIT_BURST", "8"))
+    )
@@ -0,0 +1,71 @@
+"""
+Read models for the bot's listing, search and detail paths
+Each query selects only the columns a screen needs and returns immutable
+NamedTuple records instead of ORM entities: no identity map, no change
+tracking and no lazy relationships, and the records can be cached and shared
+between updates. Call inside an app context.
+"""
+from typing import NamedTuple, Optional, List
+from sqlalchemy import select
+from models import db, Category, File
+
+SEARCH_LIMIT = 20
+
+class CategoryItem(NamedTuple):
+    """A category as shown in a menu"""
+    id: str
+    name: str
+    parent_id: Optional[str]
+
+class FileItem(NamedTuple):
+    """A file as listed in a category or search result"""
+    id: str
+    name: str
+    size: Optional[int]
+    category_name: Optional[str] = None
+
+class FileRecord(NamedTuple):
+    """Read-only snapshot of the file fields the detail and download paths need"""
+    id: str
+    name: str
+    telegram_file_id: Optional[str]
+    size: Optional[int]
+    description: Optional[str]
+    category_id: str
+
+_CATEGORY_COLUMNS = (Category.id, Category.name, Category.parent_id)
+
+def root_categories() -> List[CategoryItem]:
+    rows = db.session.execute(select(*_CATEGORY_COLUMNS).where(Category.parent_id.is_(None)))
+    return [CategoryItem(*row) for row in rows]
+
+def get_category(category_id: str) -> Optional[CategoryItem]:
+    row = db.session.execute(select(*_CATEGORY_COLUMNS).where(Category.id == category_id)).first()
+    return CategoryItem(*row) if row else None
+
+def subcategories(category_id: str) -> List[CategoryItem]:
+    rows = db.session.execute(select(*_CATEGORY_COLUMNS).where(Category.parent_id == category_id))
+    return [CategoryItem(*row) for row in rows]
+
+def category_files(category_id: str) -> List[FileItem]:
+    rows = db.session.execute(select(File.id, File.name, File.size).where(File.category_id == category_id))
+    return [FileItem(*row) for row in rows]
+
+def search_files(text: str, limit: int = SEARCH_LIMIT) -> List[FileItem]:
+    """Files whose name contains text literally, case-insensitively, with their category name in the same query"""
+    # catalog imports file_cache, which imports this module
+    from catalog import _like_pattern
+    rows = db.session.execute(
+        select(File.id, File.name, File.size, Category.name)
+        .outerjoin(Category, Category.id == File.category_id)
+        .where(File.name.ilike(_like_pattern(text), escape='\\'))
+        .limit(limit)
+    )
+    return [FileItem(*row) for row in rows]
+
+def get_file_record(file_id: str) -> Optional[FileRecord]:
+    row = db.session.execute(
+        select(File.id, File.name, File.telegram_file_id, File.size, File.description, File.category_id)
+        .where(File.id == file_id)
+    ).first()
+    return FileRecord(*row) if row else None
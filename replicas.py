@@ -0,0 +1,196 @@
+"""
+Read-replica routing
+Sessions send SELECTs to a healthy replica from DATABASE_REPLICA_URLS while a
+read_replica() block is active, and everything else to the primary. Once a
+session has written, it keeps reading from the primary so it sees its own
+writes; use_primary() forces the primary for reads that must be current.
+
+A background thread checks each replica every REPLICA_CHECK_INTERVAL seconds
+and takes it out of rotation while it is unreachable or, on PostgreSQL, more
+than REPLICA_MAX_LAG seconds behind. With no healthy replica, reads go to the
+primary.
+"""
+import os
+import time
+import logging
+import threading
+import itertools
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.sql.expression import Select
+
+logger = logging.getLogger(__name__)
+
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "5"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "10"))
+# Seconds an admin session keeps reading from the primary after a write
+REPLICA_STICKY_SECONDS = 10
+_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+# 'replica' inside read_replica(), 'primary' inside use_primary()
+_route = contextvars.ContextVar('replica_route', default=None)
+
+class Replica:
+    """One replica engine and its health"""
+    __slots__ = ('engine', 'name', 'healthy', 'lag', 'error', 'checked_at')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.name = engine.url.render_as_string(hide_password=True)
+        self.healthy = True
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+
+class ReplicaSet:
+    """Health-checked replicas handed out round-robin"""
+
+    def __init__(self):
+        self.replicas = []
+        self._cycle = None
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def configure(self, engines):
+        with self._lock:
+            self.replicas = [Replica(engine) for engine in engines]
+            self._cycle = itertools.cycle(self.replicas)
+        for replica in self.replicas:
+            logger.info(f"Routing read-only queries to replica {replica.name}")
+
+    def pick(self):
+        """Engine of the next healthy replica, or None to use the primary"""
+        if not self.replicas:
+            return None
+        self._start_checker()
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = next(self._cycle)
+                if replica.healthy:
+                    return replica.engine
+        return None
+
+    def mark_down(self, engine, error):
+        """Take a replica out of rotation until its next successful check"""
+        for replica in self.replicas:
+            if replica.engine is engine and replica.healthy:
+                replica.healthy = False
+                replica.error = str(error)
+                logger.warning(f"Replica {replica.name} marked down: {error}")
+
+    def check(self, replica: Replica):
+        try:
+            with replica.engine.connect() as connection:
+                lag = 0.0
+                if replica.engine.dialect.name == 'postgresql':
+                    lag = float(connection.execute(_LAG_QUERY).scalar() or 0.0)
+                else:
+                    connection.execute(text('SELECT 1'))
+            healthy = lag <= REPLICA_MAX_LAG
+            error = None if healthy else f"{lag:.1f}s behind the primary"
+        except Exception as e:
+            lag, healthy, error = None, False, str(e)
+        if healthy != replica.healthy:
+            log = logger.info if healthy else logger.warning
+            log(f"Replica {replica.name} is {'back in rotation' if healthy else 'down'}"
+                + (f": {error}" if error else ""))
+        replica.healthy, replica.lag, replica.error = healthy, lag, error
+        replica.checked_at = time.time()
+
+    def _start_checker(self):
+        if self._checker is not None:
+            return
+        with self._lock:
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._check_loop, name='replica-health', daemon=True)
+                self._checker.start()
+
+    def _check_loop(self):
+        while True:
+            for replica in list(self.replicas):
+                self.check(replica)
+            time.sleep(REPLICA_CHECK_INTERVAL)
+
+    def status(self):
+        return [{'replica': replica.name, 'healthy': replica.healthy, 'lag': replica.lag,
+                 'error': replica.error, 'checked_at': replica.checked_at} for replica in self.replicas]
+
+replica_set = ReplicaSet()
+
+class RoutingSession(Session):
+    """Session that reads from a replica inside read_replica() until it writes"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _route.get() == 'replica' and not self.info.get('wrote'):
+            if self._flushing or self.new or self.dirty or self.deleted or not (
+                    clause is None or isinstance(clause, Select) and clause._for_update_arg is None):
+                # From here on this session reads what it wrote
+                self.info['wrote'] = True
+            else:
+                engine = replica_set.pick()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+@contextmanager
+def read_replica():
+    """Send the SELECTs of sessions used in this block to a replica"""
+    token = _route.set('replica')
+    try:
+        yield
+    finally:
+        _route.reset(token)
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside this block, e.g. before deciding on a write"""
+    token = _route.set('primary')
+    try:
+        yield
+    finally:
+        _route.reset(token)
+
+def replica_reads(func):
+    """Run an async handler inside read_replica()"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        with read_replica():
+            return await func(*args, **kwargs)
+    return wrapper
+
+def watch_replica_engine(engine):
+    """Mark the replica down as soon as a query on it loses its connection"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'handle_error')
+    def _on_error(context):
+        if context.is_disconnect:
+            replica_set.mark_down(engine, context.original_exception)
+
+def route_requests(app):
+    """Serve GET /api/ requests from replicas, except shortly after the same admin session wrote"""
+    from flask import request, session, g
+
+    @app.before_request
+    def _route_reads():
+        if (request.method in ('GET', 'HEAD') and request.path.startswith('/api/')
+                and session.get('primary_until', 0) < time.time()):
+            g._replica_token = _route.set('replica')
+
+    @app.after_request
+    def _stick_to_primary(response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            session['primary_until'] = time.time() + REPLICA_STICKY_SECONDS
+        return response
+
+    @app.teardown_request
+    def _reset_route(exc):
+        token = g.pop('_replica_token', None)
+        if token is not None:
+            _route.reset(token)
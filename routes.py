@@ -1,9 +1,20 @@
 import os
 import logging
-from flask import render_template, request, redirect, url_for, flash, jsonify, session
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, Response
 from app import app
-from models import db, Category, File, Subscriber, PendingFile, BroadcastMessage
-from sqlalchemy import func
+from models import db, Category, File, Subscriber, PendingFile, BroadcastMessage, CategoryRule, Job
+from catalog import (
+    list_files, list_pending, DEFAULT_PAGE_SIZE, bulk_assign_pending, bulk_move_files,
+    bulk_update_description, bulk_delete_files
+)
+from file_cache import invalidate_files
+from metrics import REGISTRY, CONTENT_TYPE
+from query_inspector import query_report
+from replicas import replica_set
+from profiling import sample_profile, memory_snapshot, clamp_seconds, report_filename, ProfilerBusy
+from autocategorize import validate_rule, preview as preview_rules, get_ruleset
+from jobs import enqueue, cancel_job, list_jobs, STATUSES as JOB_STATUSES
+from sqlalchemy import func, text
 import uuid
 
 # Configure logging
@@ -142,50 +153,80 @@ def edit_category(category_id):
 @app.route('/categories/<category_id>/delete', methods=['POST'])
 @require_admin
 def delete_category(category_id):
-    """Delete a category"""
-    category = Category.query.get(category_id)
-    if category:
-        # Delete associated files first
-        File.query.filter_by(category_id=category_id).delete()
-        # Delete subcategories recursively
-        def delete_subcategories(parent_id):
-            subcats = Category.query.filter_by(parent_id=parent_id).all()
-            for subcat in subcats:
-                delete_subcategories(subcat.id)
-                File.query.filter_by(category_id=subcat.id).delete()
-                db.session.delete(subcat)
-        
-        delete_subcategories(category_id)
-        db.session.delete(category)
-        db.session.commit()
-        flash(f'Category "{category.name}" deleted successfully!', 'success')
-    else:
+    """Queue the deletion of a category with its subcategories, files and rules"""
+    category = db.session.get(Category, category_id)
+    if not category:
         flash('Category not found!', 'error')
+        return redirect(url_for('categories'))
     
-    return redirect(url_for('categories'))
+    job = enqueue('delete_category', {'category_id': category_id})
+    db.session.commit()
+    return _job_started(f'Deleting category "{category.name}" in the background.', job, 'categories')
+
+def _pending_page(cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    """One page of pending files, each with the category the rules would pick pre-selected"""
+    page = list_pending(cursor, limit)
+    ruleset = get_ruleset()
+    for item in page['items']:
+        rule = ruleset.match(item['name'], item['mime_type'], item['size']) if ruleset else None
+        item['suggested_category_id'] = rule.category_id if rule else None
+    return page
 
 @app.route('/files')
 @require_admin
 def files():
     """Files management page"""
-    files_list = File.query.all()
     categories_list = Category.query.all()
-    pending_files = PendingFile.query.all()
-    
-    # Create category lookup
-    category_map = {cat.id: cat.name for cat in categories_list}
     
-    # Add category names to files
-    files_dict = []
-    for file_item in files_list:
-        file_dict = file_item.to_dict()
-        file_dict['category_name'] = category_map.get(file_item.category_id, 'Unknown')
-        files_dict.append(file_dict)
+    # Only the first pages are rendered; the page loads the rest from /api/files and /api/pending
+    page = list_files()
+    pending = _pending_page()
     
     return render_template('files.html', 
-                         files=files_dict, 
+                         files=page['items'], 
+                         next_cursor=page['next_cursor'],
                          categories=[cat.to_dict() for cat in categories_list],
-                         pending_files=[pf.to_dict() for pf in pending_files])
+                         pending_files=pending['items'],
+                         pending_next_cursor=pending['next_cursor'])
+
+@app.route('/api/files')
+@require_admin
+def api_files():
+    """API endpoint for paginated, sortable and filterable file data"""
+    try:
+        page = list_files(
+            sort=request.args.get('sort', 'date'),
+            order=request.args.get('order', 'desc'),
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            category_id=request.args.get('category_id') or None,
+            mime_type=request.args.get('mime_type') or None,
+            text=request.args.get('q', '').strip() or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'files': page['items'],
+        'next_cursor': page['next_cursor']
+    })
+
+@app.route('/api/pending')
+@require_admin
+def api_pending():
+    """API endpoint for paginated pending files, newest first, with suggested categories"""
+    try:
+        page = _pending_page(
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'pending_files': page['items'],
+        'next_cursor': page['next_cursor']
+    })
 
 @app.route('/files/add', methods=['POST'])
 @require_admin
@@ -231,6 +272,7 @@ def add_pending_file(pending_id):
         name=name,
         category_id=category_id,
         telegram_file_id=pending_file.telegram_file_id,
+        file_unique_id=pending_file.file_unique_id,
         description=description,
         size=pending_file.size,
         mime_type=pending_file.mime_type
@@ -263,6 +305,7 @@ def edit_file(file_id):
         file_obj.category_id = category_id
         file_obj.description = description
         file_obj.telegram_file_id = telegram_file_id
+        invalidate_files([file_id])
         db.session.commit()
         flash(f'File "{name}" updated successfully!', 'success')
     else:
@@ -277,6 +320,7 @@ def delete_file(file_id):
     file_item = File.query.get(file_id)
     if file_item:
         db.session.delete(file_item)
+        invalidate_files([file_id])
         db.session.commit()
         flash(f'File "{file_item.name}" deleted successfully!', 'success')
     else:
@@ -284,6 +328,201 @@ def delete_file(file_id):
     
     return redirect(url_for('files'))
 
+def _bulk_ids(field):
+    """Read a list of ids from a JSON body or repeated form fields; ValueError for other JSON types"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        ids = data.get(field) or []
+        if not isinstance(ids, list) or not all(isinstance(i, (str, int)) and not isinstance(i, bool) for i in ids):
+            raise ValueError(f'{field} must be a list of ids')
+        return [str(i) for i in ids]
+    return request.form.getlist(field)
+
+def _bulk_value(field):
+    """Read a string value from a JSON body or the form; ValueError for other JSON types"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        value = data.get(field)
+        if value is None:
+            return ''
+        if not isinstance(value, str):
+            raise ValueError(f'{field} must be a string')
+        return value.strip()
+    return request.form.get(field, '').strip()
+
+def _bulk_result(message, count, category='success'):
+    """Answer a bulk request with JSON for API clients or a flash for form posts"""
+    if request.is_json:
+        status = 200 if category == 'success' else 400
+        return jsonify({'message': message, 'count': count}), status
+    flash(message, category)
+    return redirect(url_for('files'))
+
+def _job_started(message, job, endpoint):
+    """Answer a request that queued a background job: 202 with the job for API clients, else a flash"""
+    if request.is_json:
+        return jsonify({'message': message, 'job': job.to_dict()}), 202
+    flash(f'{message} Job {job.id}', 'success')
+    return redirect(url_for(endpoint))
+
+def _run_bulk(operation, *args):
+    """Run a set-based catalog operation in a single transaction"""
+    try:
+        count = operation(*args)
+        db.session.commit()
+        return count
+    except Exception:
+        db.session.rollback()
+        raise
+
+@app.route('/files/bulk/assign', methods=['POST'])
+@require_admin
+def bulk_assign_pending_files():
+    """Assign many pending files to a category"""
+    try:
+        pending_ids = _bulk_ids('pending_ids')
+        category_id = _bulk_value('category_id')
+        description = _bulk_value('description')
+    except ValueError as e:
+        return _bulk_result(str(e), 0, 'error')
+    
+    if not pending_ids or not category_id:
+        return _bulk_result('Select pending files and a category!', 0, 'error')
+    if not db.session.get(Category, category_id):
+        return _bulk_result('Category not found!', 0, 'error')
+    
+    count = _run_bulk(bulk_assign_pending, pending_ids, category_id, description)
+    return _bulk_result(f'{count} pending file(s) added successfully!', count)
+
+@app.route('/files/bulk/move', methods=['POST'])
+@require_admin
+def bulk_move():
+    """Move many files to another category"""
+    try:
+        file_ids = _bulk_ids('file_ids')
+        category_id = _bulk_value('category_id')
+    except ValueError as e:
+        return _bulk_result(str(e), 0, 'error')
+    
+    if not file_ids or not category_id:
+        return _bulk_result('Select files and a category!', 0, 'error')
+    if not db.session.get(Category, category_id):
+        return _bulk_result('Category not found!', 0, 'error')
+    
+    count = _run_bulk(bulk_move_files, file_ids, category_id)
+    return _bulk_result(f'{count} file(s) moved successfully!', count)
+
+@app.route('/files/bulk/description', methods=['POST'])
+@require_admin
+def bulk_edit_description():
+    """Set the description of many files"""
+    try:
+        file_ids = _bulk_ids('file_ids')
+        description = _bulk_value('description')
+    except ValueError as e:
+        return _bulk_result(str(e), 0, 'error')
+    
+    if not file_ids:
+        return _bulk_result('Select files to update!', 0, 'error')
+    
+    count = _run_bulk(bulk_update_description, file_ids, description)
+    return _bulk_result(f'{count} file(s) updated successfully!', count)
+
+@app.route('/files/bulk/delete', methods=['POST'])
+@require_admin
+def bulk_delete():
+    """Delete many files"""
+    try:
+        file_ids = _bulk_ids('file_ids')
+    except ValueError as e:
+        return _bulk_result(str(e), 0, 'error')
+    
+    if not file_ids:
+        return _bulk_result('Select files to delete!', 0, 'error')
+    
+    count = _run_bulk(bulk_delete_files, file_ids)
+    return _bulk_result(f'{count} file(s) deleted successfully!', count)
+
+def _optional_int(data, field):
+    """Parse an optional integer field, treating blanks as unset"""
+    value = data.get(field)
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be a whole number')
+
+@app.route('/api/rules')
+@require_admin
+def api_rules():
+    """API endpoint listing category rules in evaluation order"""
+    rules = CategoryRule.query.order_by(CategoryRule.priority, CategoryRule.created_at).all()
+    return jsonify({'rules': [rule.to_dict() for rule in rules]})
+
+@app.route('/api/rules', methods=['POST'])
+@require_admin
+def api_add_rule():
+    """Create a category rule"""
+    data = request.get_json(silent=True) or request.form
+    try:
+        priority = _optional_int(data, 'priority')
+        rule = CategoryRule(
+            category_id=(data.get('category_id') or '').strip(),
+            name_pattern=(data.get('name_pattern') or '').strip() or None,
+            extensions=(data.get('extensions') or '').strip() or None,
+            mime_pattern=(data.get('mime_pattern') or '').strip() or None,
+            min_size=_optional_int(data, 'min_size'),
+            max_size=_optional_int(data, 'max_size'),
+            priority=100 if priority is None else priority
+        )
+        validate_rule(rule)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not db.session.get(Category, rule.category_id):
+        return jsonify({'error': 'Category not found'}), 400
+    
+    db.session.add(rule)
+    db.session.commit()
+    return jsonify({'rule': rule.to_dict()}), 201
+
+@app.route('/api/rules/<rule_id>/toggle', methods=['POST'])
+@require_admin
+def api_toggle_rule(rule_id):
+    """Enable or disable a category rule"""
+    rule = db.session.get(CategoryRule, rule_id)
+    if not rule:
+        return jsonify({'error': 'Rule not found'}), 404
+    rule.is_active = not rule.is_active
+    db.session.commit()
+    return jsonify({'rule': rule.to_dict()})
+
+@app.route('/api/rules/<rule_id>/delete', methods=['POST'])
+@require_admin
+def api_delete_rule(rule_id):
+    """Delete a category rule"""
+    rule = db.session.get(CategoryRule, rule_id)
+    if not rule:
+        return jsonify({'error': 'Rule not found'}), 404
+    db.session.delete(rule)
+    db.session.commit()
+    return jsonify({'deleted': rule_id})
+
+@app.route('/api/rules/preview')
+@require_admin
+def api_preview_rules():
+    """Dry run showing which pending files the rules would categorize"""
+    matches = preview_rules(limit=request.args.get('limit', 200, type=int))
+    return jsonify({'count': len(matches), 'matches': matches})
+
+@app.route('/rules/apply', methods=['POST'])
+@require_admin
+def apply_category_rules():
+    """Queue categorizing all matching pending files"""
+    job = enqueue('apply_rules')
+    db.session.commit()
+    return _job_started('Applying category rules in the background.', job, 'files')
+
 @app.route('/broadcast')
 @require_admin
 def broadcast():
@@ -301,70 +540,26 @@ def send_broadcast():
         flash('Message is required!', 'error')
         return redirect(url_for('broadcast'))
     
-    try:
-        import asyncio
-        import os
-        from telegram import Bot
-        
-        bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "")
-        if not bot_token:
-            flash('Bot token not configured!', 'error')
-            return redirect(url_for('broadcast'))
-        
-        # Get active subscribers
-        subscribers = Subscriber.query.filter_by(is_active=True).all()
-        
-        if not subscribers:
-            flash('No active subscribers found!', 'warning')
-            return redirect(url_for('broadcast'))
-        
-        # Create broadcast record
-        broadcast_msg = BroadcastMessage(
-            message=message,
-            sent_to_count=0,
-            failed_count=0
-        )
-        db.session.add(broadcast_msg)
-        db.session.commit()
-        
-        # Send broadcast asynchronously
-        async def send_broadcast():
-            bot = Bot(token=bot_token)
-            sent_count = 0
-            failed_count = 0
-            
-            for subscriber in subscribers:
-                try:
-                    await bot.send_message(
-                        chat_id=subscriber.user_id,
-                        text=message,
-                        parse_mode='HTML'
-                    )
-                    sent_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to send to {subscriber.user_id}: {e}")
-                    failed_count += 1
-            
-            # Update broadcast record
-            broadcast_msg.sent_to_count = sent_count
-            broadcast_msg.failed_count = failed_count
-            db.session.commit()
-            
-            return sent_count, failed_count
-        
-        # Run the broadcast
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        sent_count, failed_count = loop.run_until_complete(send_broadcast())
-        loop.close()
-        
-        flash(f'Broadcast sent to {sent_count} subscribers! {failed_count} failed.', 'success')
-        
-    except Exception as e:
-        logger.error(f"Broadcast error: {e}")
-        flash('Error sending broadcast!', 'error')
+    if not os.getenv("TELEGRAM_BOT_TOKEN", ""):
+        flash('Bot token not configured!', 'error')
+        return redirect(url_for('broadcast'))
+    
+    subscriber_count = Subscriber.query.filter_by(is_active=True).count()
+    if not subscriber_count:
+        flash('No active subscribers found!', 'warning')
+        return redirect(url_for('broadcast'))
     
-    return redirect(url_for('broadcast'))
+    # The worker updates the counts as it sends
+    broadcast_msg = BroadcastMessage(
+        message=message,
+        sent_to_count=0,
+        failed_count=0
+    )
+    db.session.add(broadcast_msg)
+    db.session.flush()
+    job = enqueue('broadcast', {'broadcast_id': broadcast_msg.id})
+    db.session.commit()
+    return _job_started(f'Broadcast to {subscriber_count} subscribers queued.', job, 'broadcast')
 
 @app.route('/api/subscribers')
 @require_admin
@@ -376,6 +571,89 @@ def api_subscribers():
         'subscribers': [sub.to_dict() for sub in subscribers]
     })
 
+@app.route('/api/jobs')
+@require_admin
+def api_jobs():
+    """API endpoint listing background jobs, newest first"""
+    status = request.args.get('status')
+    if status and status not in JOB_STATUSES:
+        return jsonify({'error': f'status must be one of {", ".join(JOB_STATUSES)}'}), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    return jsonify({'jobs': [job.to_dict() for job in list_jobs(status, limit)]})
+
+@app.route('/api/jobs/<job_id>')
+@require_admin
+def api_job(job_id):
+    """API endpoint for the status and progress of one job"""
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job': job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@require_admin
+def api_cancel_job(job_id):
+    """Cancel a queued job, or ask the worker to stop a running one at its next progress report"""
+    job = cancel_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job': job.to_dict()})
+
+@app.route('/api/replicas')
+@require_admin
+def api_replicas():
+    """API endpoint for read replica health and lag"""
+    return jsonify({'replicas': replica_set.status()})
+
+@app.route('/api/queries')
+@require_admin
+def api_queries():
+    """API endpoint for per-request query counts, slow queries and likely N+1 patterns"""
+    return jsonify(query_report.to_dict())
+
+def _profile_report(kind, run):
+    try:
+        seconds = clamp_seconds(request.args.get('seconds'))
+        report = run(seconds)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(report, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename={report_filename(kind)}'
+    })
+
+@app.route('/profile/cpu')
+@require_admin
+def profile_cpu():
+    """Download a sampling CPU profile of this process (?seconds=, max 60)"""
+    return _profile_report('cpu', sample_profile)
+
+@app.route('/profile/memory')
+@require_admin
+def profile_memory():
+    """Download a tracemalloc top-allocations report of this process (?seconds=, max 60)"""
+    return _profile_report('memory', memory_snapshot)
+
+@app.route('/healthz')
+def healthz():
+    """Liveness probe for the supervisor and load balancers; checks the database connection"""
+    try:
+        db.session.execute(text('SELECT 1'))
+    except Exception as e:
+        logger.error(f"Health check failed: {e}")
+        return jsonify({'status': 'error', 'error': 'database unavailable'}), 503
+    return jsonify({'status': 'ok'})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of this process; needs METRICS_TOKEN as a bearer token or an admin session"""
+    token = os.getenv("METRICS_TOKEN", "")
+    authorized = token and request.headers.get('Authorization', '') == f'Bearer {token}'
+    if not (authorized or is_admin()):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 # Template context processors
 @app.context_processor
 def inject_user():
@@ -4,12 +4,10 @@ import sys
 import logging
 import asyncio
 from bot import start_bot
+from log_config import configure_logging
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 
 logger = logging.getLogger(__name__)
 
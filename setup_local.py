@@ -10,7 +10,7 @@ import os
 def install_packages():
     """Install required Python packages"""
     packages = [
-        'python-telegram-bot==20.7',
+        'python-telegram-bot==22.1',
         'flask==3.0.0',
         'flask-sqlalchemy==3.1.1',
         'psycopg2-binary==2.9.9',
@@ -3,12 +3,16 @@
 Standalone Telegram Bot Service
 This runs the bot as a separate process to avoid threading/asyncio conflicts
 """
+import startup
 import os
 import sys
 import logging
+import io
+import signal
 import asyncio
+from collections import OrderedDict
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, ApplicationHandlerStop, filters
 
 # Load environment variables from .env file for local development
 try:
@@ -20,17 +24,37 @@ except ImportError:
 
 # Add current directory to path to import our modules
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Pool sizing and statement timeout of the bot process
+os.environ.setdefault("DB_PROFILE", "bot")
 
-from models import db, Category, File, Subscriber, PendingFile
-from app import app
+from models import db, Subscriber
+from database import app
+from ingest import UploadBatcher
+from file_cache import file_cache, run_version_loop
+from download_stats import download_counter, popular_files, run_stats_loop
+from rate_limit import limiter_from_env
+from query_inspector import query_report
+from profiling import profile_event_loop, memory_snapshot, clamp_seconds, report_filename, ProfilerBusy
+from metrics import instrument_handler, build_request, start_http_server, THROTTLED_UPDATES
+from channel_sync import ChannelMirror
+from bot_state import ProcessedUpdates, run_flush_loop
+from replicas import replica_reads, use_primary
+from read_models import root_categories, get_category, subcategories, category_files, search_files
+from log_config import configure_logging
+
+startup.mark('imports')
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# Seconds a shutdown waits for queued and in-flight updates before cancelling them;
+# keep below the supervisor's SHUTDOWN_TIMEOUT so buffered writes still get flushed
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+
+# Users remembered as subscribed, so repeat /start and deep links skip the subscriber lookup
+KNOWN_SUBSCRIBERS_LIMIT = 100000
+
 def format_file_size(size_bytes):
     """Convert bytes to human-readable file size"""
     if size_bytes is None or size_bytes == 0:
@@ -42,10 +66,42 @@ def format_file_size(size_bytes):
         size_bytes /= 1024.0
     return f"{size_bytes:.1f} PB"
 
+class TrackedApplication(Application):
+    """Application that skips updates already processed and records each one it finishes"""
+
+    def __init__(self, *, processed_updates=None, **kwargs):
+        super().__init__(**kwargs)
+        self.processed_updates = processed_updates
+        # Updates being processed, saved for replay if a shutdown cancels them
+        self.in_flight = {}
+
+    async def process_update(self, update):
+        if self.processed_updates is None or not isinstance(update, Update):
+            return await super().process_update(update)
+        if self.processed_updates.is_processed(update.update_id):
+            logger.debug("Skipping update %s, already processed", update.update_id)
+            return
+        self.in_flight[update.update_id] = update
+        await super().process_update(update)
+        del self.in_flight[update.update_id]
+        self.processed_updates.mark(update.update_id)
+
 class TelegramBotService:
     def __init__(self):
         self.bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "")
         self.admin_id = int(os.getenv("ADMIN_ID", "0"))
+        self.known_subscribers = OrderedDict()
+        self.rate_limiter = limiter_from_env()
+        self.storage_channel_id = os.getenv("STORAGE_CHANNEL_ID", "")
+        self.upload_batcher = UploadBatcher()
+        self.stats_task = None
+        self.cache_version_task = None
+        self.heartbeat_task = None
+        self.processed_task = None
+        self.processed_updates = ProcessedUpdates()
+        self.channel_mirror = None
+        if self.storage_channel_id:
+            self.channel_mirror = ChannelMirror(self.storage_channel_id, self.admin_id, self.upload_batcher)
         
         # Validate required environment variables
         if not self.bot_token:
@@ -61,64 +117,112 @@ class TelegramBotService:
         logger.info(f"Bot token loaded: {self.bot_token[:10]}...")
         logger.info(f"Admin ID: {self.admin_id}")
 
+    async def throttle(self, update: Update, context):
+        """Stop updates from users who exceed their request rate"""
+        user = update.effective_user
+        if user is None or user.id == self.admin_id:
+            return
+        if not (update.callback_query or update.message):
+            return
+        if self.rate_limiter.allow(user.id):
+            return
+        THROTTLED_UPDATES.inc()
+        
+        if self.rate_limiter.should_notify(user.id):
+            logger.warning(f"Throttling user {user.id}")
+            notice = "⏳ You're going a bit fast. Please wait a few seconds and try again."
+            try:
+                if update.callback_query:
+                    await update.callback_query.answer(notice)
+                else:
+                    await update.message.reply_text(notice)
+            except Exception as e:
+                logger.error(f"Error sending throttle notice to {user.id}: {e}")
+        elif update.callback_query:
+            # Stop the button's loading spinner without another message
+            try:
+                await update.callback_query.answer()
+            except Exception:
+                pass
+        raise ApplicationHandlerStop
+
+    @instrument_handler('start_command')
     async def start_command(self, update: Update, context):
         """Handle /start command and file requests"""
         user_id = update.effective_user.id
         username = update.effective_user.username or "No username"
         first_name = update.effective_user.first_name or "No name"
         
-        logger.info(f"User {user_id} ({username}, {first_name}) started the bot")
+        logger.debug("User %s (%s, %s) started the bot", user_id, username, first_name)
         
-        # Add user to subscribers
-        with app.app_context():
-            try:
-                existing_subscriber = Subscriber.query.filter_by(user_id=user_id).first()
-                if not existing_subscriber:
-                    subscriber = Subscriber(
-                        user_id=user_id,
-                        first_name=update.effective_user.first_name or "",
-                        username=update.effective_user.username or ""
-                    )
-                    db.session.add(subscriber)
-                    db.session.commit()
-                    logger.info(f"Added new subscriber: {user_id}")
-            except Exception as e:
-                logger.error(f"Error adding subscriber {user_id}: {e}")
-                db.session.rollback()
+        # Add user to subscribers, unless this process has already seen them
+        if user_id not in self.known_subscribers:
+            # The existence check decides on an insert, so it must not see a lagging replica
+            with app.app_context(), use_primary():
+                try:
+                    existing_subscriber = Subscriber.query.filter_by(user_id=user_id).first()
+                    if not existing_subscriber:
+                        subscriber = Subscriber(
+                            user_id=user_id,
+                            first_name=update.effective_user.first_name or "",
+                            username=update.effective_user.username or ""
+                        )
+                        db.session.add(subscriber)
+                        db.session.commit()
+                        logger.info("Added new subscriber: %s", user_id)
+                    self.remember_subscriber(user_id)
+                except Exception as e:
+                    logger.error(f"Error adding subscriber {user_id}: {e}")
+                    db.session.rollback()
 
-        # Handle file download requests
+        # Handle file download requests from shared deep links
         if context.args and context.args[0].startswith("file_"):
             file_id = context.args[0].replace("file_", "")
-            with app.app_context():
-                file_item = File.query.get(file_id)
-                
-                if file_item and file_item.telegram_file_id:
-                    try:
-                        await context.bot.send_document(
-                            chat_id=update.effective_chat.id,
-                            document=file_item.telegram_file_id,
-                            caption=f"📄 {file_item.name}"
-                        )
-                        return
-                    except Exception as e:
-                        logger.error(f"Error sending file: {e}")
-                        await update.message.reply_text("Sorry, there was an error sending the file.")
-                        return
-                else:
-                    await update.message.reply_text("File not found.")
-                    return
+            await self.send_file(update, context, file_id)
+            return
         
         # Show main menu
         await self.show_main_menu(update, context)
 
+    def remember_subscriber(self, user_id):
+        """Record a user known to be subscribed, dropping the oldest entries past the limit"""
+        self.known_subscribers[user_id] = None
+        self.known_subscribers.move_to_end(user_id)
+        if len(self.known_subscribers) > KNOWN_SUBSCRIBERS_LIMIT:
+            self.known_subscribers.popitem(last=False)
+
+    @instrument_handler('send_file')
+    @replica_reads
+    async def send_file(self, update, context, file_id: str):
+        """Send a file's document straight to the user's chat"""
+        chat_id = update.effective_chat.id
+        file_item = await file_cache.aget(file_id)
+        
+        if not file_item or not file_item.telegram_file_id:
+            await context.bot.send_message(chat_id=chat_id, text="File not found.")
+            return
+        
+        try:
+            await context.bot.send_document(
+                chat_id=chat_id,
+                document=file_item.telegram_file_id,
+                caption=f"📄 {file_item.name}"
+            )
+            download_counter.record(file_item.id)
+        except Exception as e:
+            logger.error(f"Error sending file: {e}")
+            await context.bot.send_message(chat_id=chat_id, text="Sorry, there was an error sending the file.")
+
+    @instrument_handler('show_main_menu')
+    @replica_reads
     async def show_main_menu(self, update, context):
         """Show main category menu"""
         user_id = update.effective_user.id
-        logger.info(f"Showing main menu for user {user_id}")
+        logger.debug("Showing main menu for user %s", user_id)
         
         with app.app_context():
-            categories = Category.query.filter_by(parent_id=None).all()
-            logger.info(f"Found {len(categories)} categories for user {user_id}")
+            categories = root_categories()
+            logger.debug("Found %d categories for user %s", len(categories), user_id)
             keyboard = []
             
             for category in categories:
@@ -127,7 +231,9 @@ class TelegramBotService:
                     callback_data=f"category_{category.id}"
                 )])
         
-        # Add search button
+        # Add popular and search buttons
+        if popular_files.items:
+            keyboard.append([InlineKeyboardButton("🔥 Popular", callback_data="popular")])
         if len(categories) > 0:
             keyboard.append([InlineKeyboardButton("🔍 Search Files", callback_data="search_files")])
         
@@ -148,12 +254,13 @@ class TelegramBotService:
                     text=welcome_text,
                     reply_markup=reply_markup
                 )
-            logger.info(f"Successfully sent main menu to user {user_id}")
+            logger.debug("Sent main menu to user %s", user_id)
         except Exception as e:
             logger.error(f"Error sending main menu to user {user_id}: {e}")
             if not update.callback_query:
                 await update.message.reply_text("Bot is starting up, please try again in a moment.")
 
+    @instrument_handler('handle_callback')
     async def handle_callback(self, update, context):
         """Handle callback queries from inline keyboards"""
         query = update.callback_query
@@ -167,6 +274,11 @@ class TelegramBotService:
         elif data.startswith("file_"):
             file_id = data.replace("file_", "")
             await self.show_file(update, context, file_id)
+        elif data.startswith("download_"):
+            file_id = data.replace("download_", "")
+            await self.send_file(update, context, file_id)
+        elif data == "popular":
+            await self.show_popular(update, context)
         elif data == "search_files":
             await self.show_search_prompt(update, context)
         elif data == "back_main":
@@ -178,10 +290,12 @@ class TelegramBotService:
             else:
                 await self.show_category(update, context, parent_id)
 
+    @instrument_handler('show_category')
+    @replica_reads
     async def show_category(self, update, context, category_id: str):
         """Show files and subcategories in a category"""
         with app.app_context():
-            category = Category.query.get(category_id)
+            category = get_category(category_id)
             if not category:
                 await update.callback_query.edit_message_text("Category not found.")
                 return
@@ -189,16 +303,14 @@ class TelegramBotService:
             keyboard = []
             
             # Get subcategories
-            subcategories = Category.query.filter_by(parent_id=category_id).all()
-            for subcat in subcategories:
+            for subcat in subcategories(category_id):
                 keyboard.append([InlineKeyboardButton(
                     f"📁 {subcat.name}", 
                     callback_data=f"category_{subcat.id}"
                 )])
             
             # Get files in this category
-            files = File.query.filter_by(category_id=category_id).all()
-            for file_item in files:
+            for file_item in category_files(category_id):
                 keyboard.append([InlineKeyboardButton(
                     f"📄 {file_item.name}", 
                     callback_data=f"file_{file_item.id}"
@@ -217,42 +329,68 @@ class TelegramBotService:
             reply_markup=reply_markup
         )
 
+    @instrument_handler('show_file')
+    @replica_reads
     async def show_file(self, update, context, file_id: str):
         """Show file details and download link"""
-        with app.app_context():
-            file_item = File.query.get(file_id)
-            if not file_item:
-                await update.callback_query.edit_message_text("File not found.")
-                return
-            
-            keyboard = []
-            
-            if file_item.telegram_file_id:
-                keyboard.append([InlineKeyboardButton(
-                    "📥 Download", 
-                    url=f"https://t.me/{context.bot.username}?start=file_{file_id}"
-                )])
-            
-            # Back to category
-            category_id = file_item.category_id
+        # Served from the hot-file cache; only misses reach the database
+        file_item = await file_cache.aget(file_id)
+        if not file_item:
+            await update.callback_query.edit_message_text("File not found.")
+            return
+        
+        keyboard = []
+        
+        if file_item.telegram_file_id:
+            # Download is sent in place; the deep link is kept for sharing the file
             keyboard.append([InlineKeyboardButton(
-                "⬅️ Back", 
-                callback_data=f"category_{category_id}"
+                "📥 Download", 
+                callback_data=f"download_{file_id}"
             )])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            text = f"📄 {file_item.name}\n\n"
-            if file_item.description:
-                text += f"Description: {file_item.description}\n\n"
-            if file_item.size:
-                text += f"Size: {format_file_size(file_item.size)}\n"
+            keyboard.append([InlineKeyboardButton(
+                "🔗 Share", 
+                url=f"https://t.me/{context.bot.username}?start=file_{file_id}"
+            )])
+        
+        # Back to category
+        category_id = file_item.category_id
+        keyboard.append([InlineKeyboardButton(
+            "⬅️ Back", 
+            callback_data=f"category_{category_id}"
+        )])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        text = f"📄 {file_item.name}\n\n"
+        if file_item.description:
+            text += f"Description: {file_item.description}\n\n"
+        if file_item.size:
+            text += f"Size: {format_file_size(file_item.size)}\n"
         
         await update.callback_query.edit_message_text(
             text=text,
             reply_markup=reply_markup
         )
 
+    @instrument_handler('show_popular')
+    @replica_reads
+    async def show_popular(self, update, context):
+        """Show the most downloaded files from the precomputed list"""
+        keyboard = []
+        for file_id, name, downloads in popular_files.items:
+            keyboard.append([InlineKeyboardButton(
+                f"📄 {name} ({downloads})", 
+                callback_data=f"file_{file_id}"
+            )])
+        keyboard.append([InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="back_main")])
+        
+        text = "🔥 Popular files this week" if popular_files.items else "🔥 No downloads yet this week."
+        await update.callback_query.edit_message_text(
+            text=text,
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+    @instrument_handler('show_search_prompt')
     async def show_search_prompt(self, update, context):
         """Show search prompt to user"""
         keyboard = [[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="back_main")]]
@@ -272,18 +410,18 @@ class TelegramBotService:
         # Set user state to expect search query
         context.user_data['waiting_for_search'] = True
 
+    @instrument_handler('handle_search_query')
+    @replica_reads
     async def handle_search_query(self, update, context):
         """Handle search query from user"""
         query = update.message.text.strip()
         user_id = update.effective_user.id
         
-        logger.info(f"User {user_id} searching for: {query}")
+        logger.debug("User %s searching for: %s", user_id, query)
         
         with app.app_context():
             # Search files by name (case-insensitive)
-            files = File.query.filter(
-                File.name.ilike(f'%{query}%')
-            ).limit(20).all()
+            files = search_files(query)
             
             if not files:
                 keyboard = [[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="back_main")]]
@@ -307,7 +445,7 @@ class TelegramBotService:
                 )])
                 
                 # Add to text description
-                category_name = file_item.category.name if file_item.category else "Unknown"
+                category_name = file_item.category_name or "Unknown"
                 size_text = f" ({format_file_size(file_item.size)})" if file_item.size else ""
                 result_text += f"📄 {file_item.name}{size_text}\n📂 Category: {category_name}\n\n"
             
@@ -325,6 +463,7 @@ class TelegramBotService:
         # Clear search state
         context.user_data['waiting_for_search'] = False
 
+    @instrument_handler('handle_text_message')
     async def handle_text_message(self, update, context):
         """Handle text messages from users"""
         # Check if user is in search mode
@@ -340,27 +479,215 @@ class TelegramBotService:
                 reply_markup=reply_markup
             )
 
+    @instrument_handler('handle_admin_upload')
     async def handle_admin_upload(self, update, context):
         """Handle file uploads from admin"""
         if update.effective_user.id != self.admin_id:
             return
         
         if update.message.document:
-            # Store file info for admin panel to process
-            with app.app_context():
-                pending_file = PendingFile(
-                    telegram_file_id=update.message.document.file_id,
-                    name=update.message.document.file_name,
-                    size=update.message.document.file_size,
-                    mime_type=update.message.document.mime_type
-                )
-                db.session.add(pending_file)
-                db.session.commit()
-            
-            await update.message.reply_text(
-                f"✅ File '{update.message.document.file_name}' received!\n"
-                "Use the admin panel to assign it to a category."
-            )
+            # Stored in batches for the admin panel to process
+            await self.upload_batcher.add(update.message, context.bot)
+
+    async def flush_uploads(self, application):
+        """Write queued uploads before the application stops"""
+        await self.upload_batcher.flush_all(application.bot)
+
+    async def start_background_tasks(self, application):
+        """Start the download counter, processed update and cache version loops and the metrics server"""
+        startup.mark('telegram')
+        logger.info(f"Bot {startup.summary()}")
+        self.stats_task = asyncio.create_task(run_stats_loop())
+        self.cache_version_task = asyncio.create_task(run_version_loop())
+        self.processed_task = asyncio.create_task(run_flush_loop(self.processed_updates))
+        metrics_port = os.getenv("METRICS_PORT", "")
+        if metrics_port:
+            start_http_server(int(metrics_port))
+        heartbeat_file = os.getenv("BOT_HEARTBEAT_FILE", "")
+        if heartbeat_file:
+            self.heartbeat_task = asyncio.create_task(self.heartbeat_loop(heartbeat_file))
+
+    async def heartbeat_loop(self, path: str, interval: float = 10.0):
+        """Touch path while the event loop is responsive; the supervisor restarts the bot when it goes stale"""
+        while True:
+            try:
+                with open(path, 'a'):
+                    os.utime(path)
+            except OSError as e:
+                logger.error(f"Error writing heartbeat {path}: {e}")
+            await asyncio.sleep(interval)
+
+    async def on_stop(self, application):
+        """Flush buffered writes before the application stops"""
+        await self.flush_uploads(application)
+        if self.stats_task:
+            self.stats_task.cancel()
+        if self.cache_version_task:
+            self.cache_version_task.cancel()
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        if self.processed_task:
+            self.processed_task.cancel()
+        try:
+            await asyncio.to_thread(download_counter.flush)
+        except Exception as e:
+            logger.error(f"Error flushing download counters on stop: {e}")
+        try:
+            await asyncio.to_thread(self.processed_updates.flush)
+        except Exception as e:
+            logger.error(f"Error saving processed update ids on stop: {e}")
+
+    async def restore_updates(self, application):
+        """Load the recently processed update ids and queue the updates the last shutdown left unprocessed"""
+        remembered = await asyncio.to_thread(self.processed_updates.load)
+        pending = await asyncio.to_thread(self.processed_updates.take_pending)
+        for data in pending:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        if remembered or pending:
+            logger.info(f"Skipping redeliveries of {remembered} processed update(s), "
+                        f"replaying {len(pending)} unprocessed update(s)")
+
+    async def drain(self, application, timeout: float = DRAIN_TIMEOUT):
+        """Stop the application, letting queued and in-flight updates finish within timeout;
+        past the deadline they are cancelled and saved for the next start"""
+        stopping = asyncio.create_task(application.stop())
+        done, _ = await asyncio.wait({stopping}, timeout=timeout)
+        if done:
+            return
+        logger.warning(f"In-flight updates did not finish within {timeout:g}s, cancelling them")
+        # Taken off the queue first: the application drops whatever is still queued when cancelled
+        unprocessed = list(application.in_flight.values())
+        while not application.update_queue.empty():
+            item = application.update_queue.get_nowait()
+            if isinstance(item, Update):
+                unprocessed.append(item)
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks, timeout=5)
+        unprocessed.sort(key=lambda update: update.update_id)
+        try:
+            await asyncio.to_thread(self.processed_updates.save_pending, [update.to_dict() for update in unprocessed])
+            logger.info(f"Saved {len(unprocessed)} unprocessed update(s) for the next start")
+        except Exception as e:
+            logger.error(f"Error saving unprocessed updates: {e}")
+
+    async def serve(self, application):
+        """Poll until SIGTERM/SIGINT, then stop fetching, drain in-flight updates and flush buffered writes"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                # No loop signal handlers on Windows
+                signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop.set))
+
+        async with application:
+            await self.restore_updates(application)
+            await application.start()
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await self.start_background_tasks(application)
+            logger.info("Bot started successfully!")
+            await stop.wait()
+
+            logger.info("Stopping: no longer fetching updates, draining in-flight work")
+            await application.updater.stop()
+            await self.drain(application)
+            await self.on_stop(application)
+        logger.info("Bot stopped")
+
+    async def cache_stats_command(self, update, context):
+        """Handle /cachestats from the admin"""
+        if update.effective_user.id != self.admin_id:
+            return
+        stats = file_cache.stats()
+        await update.message.reply_text(
+            "🗂 File cache\n\n"
+            f"Entries: {stats['size']}/{stats['maxsize']}\n"
+            f"Hits: {stats['hits']}  Misses: {stats['misses']}\n"
+            f"Hit rate: {stats['hit_rate']:.1%}\n"
+            f"Evictions: {stats['evictions']}  Expired: {stats['expirations']}  "
+            f"Invalidated: {stats['invalidations']}"
+        )
+
+    async def queries_command(self, update, context):
+        """Handle /queries from the admin: the handlers issuing the most queries"""
+        if update.effective_user.id != self.admin_id:
+            return
+        report = query_report.to_dict()
+        units = sorted(report['units'].items(), key=lambda item: item[1]['avg_queries'], reverse=True)[:10]
+        lines = [f"{name}: {totals['avg_queries']} avg, {totals['max_queries']} max, "
+                 f"{totals['repeated']} N+1" for name, totals in units]
+        await update.message.reply_text(
+            "🐢 Queries per update\n\n"
+            + ("\n".join(lines) or "No queries recorded yet.")
+            + f"\n\nSlow queries: {len(report['slow_queries'])}  "
+            f"Possible N+1: {len(report['repeated_queries'])}"
+        )
+
+    async def profile_command(self, update, context):
+        """Handle /profile [seconds] and /memprofile [seconds] from the admin"""
+        if update.effective_user.id != self.admin_id:
+            return
+        try:
+            seconds = clamp_seconds(context.args[0] if context.args else None)
+        except ValueError:
+            await update.message.reply_text("Usage: /profile [seconds] or /memprofile [seconds]")
+            return
+        kind = 'memory' if update.message.text.startswith('/memprofile') else 'cpu'
+        await update.message.reply_text(f"⏱ Profiling {kind} for {seconds:g}s...")
+        # Runs as a task so updates keep being handled while the profile is taken
+        context.application.create_task(self.send_profile(context.bot, update.effective_chat.id, kind, seconds))
+
+    async def send_profile(self, bot, chat_id, kind: str, seconds: float):
+        """Take a profile and send it to chat_id as a document"""
+        try:
+            if kind == 'memory':
+                report = await asyncio.to_thread(memory_snapshot, seconds)
+            else:
+                report = await profile_event_loop(seconds)
+        except ProfilerBusy as e:
+            await bot.send_message(chat_id=chat_id, text=f"⚠️ {e}")
+            return
+        except Exception as e:
+            logger.error(f"Error taking {kind} profile: {e}")
+            await bot.send_message(chat_id=chat_id, text="Sorry, the profile failed.")
+            return
+        await bot.send_document(
+            chat_id=chat_id,
+            document=io.BytesIO(report.encode('utf-8')),
+            filename=report_filename(kind)
+        )
+
+    def build_application(self, request=None):
+        """Create the application with every handler registered; request overrides the HTTP transport"""
+        application = (
+            Application.builder()
+            .application_class(TrackedApplication, kwargs={'processed_updates': self.processed_updates})
+            .token(self.bot_token)
+            .request(request or build_request())
+            .build()
+        )
+        
+        # Flood protection runs before every other handler
+        application.add_handler(TypeHandler(Update, self.throttle), group=-1)
+        
+        # Add handlers
+        if self.channel_mirror:
+            # Registered first so storage channel posts never reach the user handlers
+            application.add_handler(MessageHandler(self.channel_mirror.chat_filter(), self.channel_mirror.handle_channel_post))
+            application.add_handler(CommandHandler("resync", self.channel_mirror.resync_command))
+            logger.info(f"Mirroring storage channel: {self.storage_channel_id}")
+        application.add_handler(CommandHandler("start", self.start_command))
+        application.add_handler(CommandHandler("cachestats", self.cache_stats_command))
+        application.add_handler(CommandHandler("queries", self.queries_command))
+        application.add_handler(CommandHandler(["profile", "memprofile"], self.profile_command))
+        application.add_handler(CallbackQueryHandler(self.handle_callback))
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
+        application.add_handler(MessageHandler(filters.Document.ALL, self.handle_admin_upload))
+        return application
 
     def run(self):
         """Start the bot"""
@@ -375,17 +702,9 @@ class TelegramBotService:
         logger.info(f"Starting bot with admin ID: {self.admin_id}")
         
         # Create application
-        application = Application.builder().token(self.bot_token).build()
-        
-        # Add handlers
-        application.add_handler(CommandHandler("start", self.start_command))
-        application.add_handler(CallbackQueryHandler(self.handle_callback))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
-        application.add_handler(MessageHandler(filters.Document.ALL, self.handle_admin_upload))
-        
-        # Start polling with proper configuration
-        logger.info("Bot started successfully!")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        application = self.build_application()
+        startup.mark('application')
+        asyncio.run(self.serve(application))
 
 def main():
     """Main function"""
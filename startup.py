@@ -0,0 +1,26 @@
+"""
+Startup phase timings
+Entry points import this module first and mark each phase as it completes;
+the summary is logged once the process is ready to serve.
+"""
+import time
+
+_started = time.perf_counter()
+_last = _started
+_phases = []
+
+def mark(phase: str):
+    """Record the time spent since the previous mark as phase"""
+    global _last
+    now = time.perf_counter()
+    _phases.append((phase, now - _last))
+    _last = now
+
+def elapsed() -> float:
+    """Seconds since this module was imported"""
+    return time.perf_counter() - _started
+
+def summary() -> str:
+    """e.g. 'ready in 612 ms (imports 301 ms, application 12 ms, telegram 299 ms)'"""
+    phases = ', '.join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in _phases)
+    return f"ready in {elapsed() * 1000:.0f} ms ({phases})"
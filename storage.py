@@ -6,8 +6,8 @@ from typing import List, Dict, Optional, Any
 from models import Category, File, Subscriber, BroadcastMessage
 
 class Storage:
-    def __init__(self):
-        self.data_dir = "data"
+    def __init__(self, data_dir: str = "data"):
+        self.data_dir = data_dir
         self.categories_file = os.path.join(self.data_dir, "categories.json")
         self.files_file = os.path.join(self.data_dir, "files.json")
         self.subscribers_file = os.path.join(self.data_dir, "subscribers.json")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Production process supervisor
+Runs the admin panel under gunicorn with several worker processes, the bot and
+the background job worker as separate processes. A process that exits or fails
+its health check is restarted with exponential backoff; SIGTERM/SIGINT stop
+them all gracefully.
+
+The web app is probed over GET /healthz. The bot touches BOT_HEARTBEAT_FILE from
+its event loop, so a stale heartbeat means the loop is stuck or the bot is gone.
+The job worker is only restarted when it exits; jobs it leaves running are
+requeued by jobs.requeue_stale().
+
+Usage: python supervisor.py [--no-web] [--no-bot] [--no-worker]
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from log_config import configure_logging
+from profiling import MAX_PROFILE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "10"))
+# Consecutive failed checks before a process is restarted
+HEALTH_CHECK_FAILURES = 3
+# Time a process gets to come up before its health is checked
+STARTUP_GRACE = 30.0
+BOT_HEARTBEAT_TIMEOUT = 60.0
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 60.0
+# A process running this long without a failure resets its backoff
+STABLE_AFTER = 120.0
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+# Seconds gunicorn lets a request run before killing its worker; must exceed
+# the longest /profile request (profiling.MAX_PROFILE_SECONDS)
+WEB_TIMEOUT = float(os.getenv("WEB_TIMEOUT", str(MAX_PROFILE_SECONDS + 30)))
+# Threads per gunicorn worker; the CPU profiler samples the other request threads
+WEB_THREADS = os.getenv("WEB_THREADS", "4")
+
+class Service:
+    """One supervised child process"""
+
+    def __init__(self, name: str, command, health_check=None, env=None):
+        self.name = name
+        self.command = command
+        self.health_check = health_check
+        self.env = env
+        self.process = None
+        self.started_at = 0.0
+        self.next_start = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.last_check = 0.0
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, cwd=BASE_DIR, env=self.env)
+        self.started_at = self.last_check = time.monotonic()
+        self.failures = 0
+        logger.info(f"Started {self.name} (pid {self.process.pid})")
+
+    def stop(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """SIGTERM the process, then SIGKILL it if it is still running after timeout"""
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"{self.name} did not stop within {timeout:g}s, killing it")
+            self.process.kill()
+            self.process.wait()
+
+    def schedule_restart(self, reason: str):
+        now = time.monotonic()
+        if now - self.started_at >= STABLE_AFTER:
+            self.restarts = 0
+        delay = min(MAX_RESTART_BACKOFF, RESTART_BACKOFF * 2 ** self.restarts)
+        self.restarts += 1
+        self.process = None
+        self.next_start = now + delay
+        logger.warning(f"{self.name} {reason}; restarting in {delay:g}s")
+
+    def tick(self):
+        """Start, health-check or restart the process as needed"""
+        now = time.monotonic()
+        if self.process is None:
+            if now >= self.next_start:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is not None:
+            self.schedule_restart(f"exited with code {code}")
+            return
+        if (self.health_check is None or now - self.started_at < STARTUP_GRACE
+                or now - self.last_check < HEALTH_CHECK_INTERVAL):
+            return
+        self.last_check = now
+        if self.health_check():
+            self.failures = 0
+            return
+        self.failures += 1
+        logger.warning(f"{self.name} health check failed ({self.failures}/{HEALTH_CHECK_FAILURES})")
+        if self.failures >= HEALTH_CHECK_FAILURES:
+            self.stop()
+            self.schedule_restart("is unhealthy")
+
+def http_check(url: str, timeout: float = 5.0):
+    """Health check passing when url answers 200"""
+    def check():
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return response.status == 200
+        except Exception as e:
+            logger.debug(f"GET {url} failed: {e}")
+            return False
+    return check
+
+def heartbeat_check(path: str, max_age: float = BOT_HEARTBEAT_TIMEOUT):
+    """Health check passing when path was touched within max_age seconds"""
+    def check():
+        try:
+            return time.time() - os.path.getmtime(path) <= max_age
+        except OSError:
+            return False
+    return check
+
+def build_services(web: bool = True, bot: bool = True, worker: bool = True):
+    services = []
+    if web:
+        port = os.getenv("PORT", "5000")
+        workers = os.getenv("WEB_CONCURRENCY", str(min(4, (os.cpu_count() or 1) * 2)))
+        services.append(Service('web', [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'0.0.0.0:{port}',
+            '--workers', workers,
+            '--worker-class', 'gthread',
+            '--threads', WEB_THREADS,
+            '--timeout', f'{WEB_TIMEOUT:g}',
+            '--graceful-timeout', f'{SHUTDOWN_TIMEOUT:g}',
+            'main:app',
+        ], health_check=http_check(f'http://127.0.0.1:{port}/healthz')))
+    if bot:
+        heartbeat = os.getenv("BOT_HEARTBEAT_FILE") or os.path.join(tempfile.gettempdir(), 'telegstore-bot.heartbeat')
+        services.append(Service('bot', [sys.executable, 'standalone_bot.py'],
+                                health_check=heartbeat_check(heartbeat),
+                                env={**os.environ, 'BOT_HEARTBEAT_FILE': heartbeat}))
+    if worker:
+        services.append(Service('worker', [sys.executable, 'worker.py']))
+    return services
+
+def supervise(services):
+    """Run services until SIGTERM or SIGINT, then stop them all"""
+    stopping = []
+
+    def request_stop(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, shutting down")
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    while not stopping:
+        for service in services:
+            service.tick()
+        time.sleep(1)
+
+    # Signal everything first so the processes drain in parallel
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for service in services:
+        if service.process is not None and service.process.poll() is None:
+            service.process.terminate()
+    for service in services:
+        service.stop(max(0.0, deadline - time.monotonic()))
+    logger.info("All processes stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the admin panel, the bot and the job worker as supervised processes")
+    parser.add_argument('--no-web', action='store_true', help="do not run the admin panel")
+    parser.add_argument('--no-bot', action='store_true', help="do not run the bot")
+    parser.add_argument('--no-worker', action='store_true', help="do not run the background job worker")
+    args = parser.parse_args()
+
+    configure_logging()
+    supervise(build_services(web=not args.no_web, bot=not args.no_bot, worker=not args.no_worker))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Job handlers for the admin tasks run by worker.py
+Each handler takes a jobs.JobContext and commits its work in batches, reporting
+progress between them so a cancel request or worker shutdown stops it at a
+batch boundary.
+"""
+import os
+import asyncio
+import logging
+from sqlalchemy import select, delete, func, literal
+from models import db, Category, File, Subscriber, BroadcastMessage, CategoryRule
+from file_cache import invalidate_files
+from metrics import BROADCAST_MESSAGES, BROADCAST_PENDING
+from jobs import job_handler
+
+logger = logging.getLogger(__name__)
+
+# Subscribers loaded and messaged per round
+BROADCAST_BATCH_SIZE = 100
+# Pause between messages; Telegram allows bots about 30 messages per second
+BROADCAST_DELAY = 0.04
+# Files deleted per statement when removing a category
+DELETE_BATCH_SIZE = 500
+
+@job_handler('broadcast', priority=50)
+def broadcast(ctx):
+    """Message every active subscriber; a retry resumes after the last subscriber reached"""
+    from telegram import Bot
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "")
+    if not bot_token:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
+    broadcast_msg = db.session.get(BroadcastMessage, ctx.payload['broadcast_id'])
+    if broadcast_msg is None:
+        raise ValueError(f"Broadcast {ctx.payload['broadcast_id']} not found")
+    state = ctx.checkpoint or {'after': None, 'sent': 0, 'failed': 0}
+    total = db.session.execute(
+        select(func.count()).select_from(Subscriber).where(Subscriber.is_active == True)  # noqa: E712
+    ).scalar()
+
+    async def send_all():
+        async with Bot(token=bot_token) as bot:
+            while True:
+                query = (select(Subscriber.user_id).where(Subscriber.is_active == True)  # noqa: E712
+                         .order_by(Subscriber.user_id).limit(BROADCAST_BATCH_SIZE))
+                if state['after'] is not None:
+                    query = query.where(Subscriber.user_id > state['after'])
+                user_ids = db.session.execute(query).scalars().all()
+                if not user_ids:
+                    return
+                remaining = len(user_ids)
+                BROADCAST_PENDING.inc(remaining)
+                try:
+                    for user_id in user_ids:
+                        if await _send(bot, user_id, broadcast_msg.message):
+                            state['sent'] += 1
+                            BROADCAST_MESSAGES.labels('sent').inc()
+                        else:
+                            state['failed'] += 1
+                            BROADCAST_MESSAGES.labels('failed').inc()
+                        state['after'] = user_id
+                        remaining -= 1
+                        BROADCAST_PENDING.dec()
+                        await asyncio.sleep(BROADCAST_DELAY)
+                finally:
+                    BROADCAST_PENDING.dec(remaining)
+                broadcast_msg.sent_to_count = state['sent']
+                broadcast_msg.failed_count = state['failed']
+                ctx.progress(state['sent'] + state['failed'], total, checkpoint=state, force=True)
+
+    asyncio.run(send_all())
+    logger.info(f"Broadcast {broadcast_msg.id} sent to {state['sent']} subscribers, {state['failed']} failed")
+    return {'sent': state['sent'], 'failed': state['failed']}
+
+async def _send(bot, user_id: int, text: str) -> bool:
+    """Send one broadcast message, waiting out a flood limit once"""
+    from telegram.error import RetryAfter
+    for attempt in range(2):
+        try:
+            await bot.send_message(chat_id=user_id, text=text, parse_mode='HTML')
+            return True
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            logger.warning(f"Flood limit hit during broadcast, waiting {delay}s")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            logger.error(f"Failed to send to {user_id}: {e}")
+            return False
+    return False
+
+def category_subtree(category_id: str):
+    """Ids of a category and all its descendants, deepest first"""
+    subtree = (select(Category.id, literal(0).label('depth'))
+               .where(Category.id == category_id).cte('subtree', recursive=True))
+    subtree = subtree.union_all(
+        select(Category.id, subtree.c.depth + 1).join(subtree, Category.parent_id == subtree.c.id)
+    )
+    return db.session.execute(select(subtree.c.id).order_by(subtree.c.depth.desc())).scalars().all()
+
+@job_handler('delete_category')
+def delete_category(ctx):
+    """Delete a category with its subcategories, files and rules. Children go before their
+    parents, so a cancelled or failed run leaves an intact, smaller tree"""
+    category_ids = category_subtree(ctx.payload['category_id'])
+    deleted_files = 0
+    for done, category_id in enumerate(category_ids):
+        while True:
+            batch = select(File.id).where(File.category_id == category_id).limit(DELETE_BATCH_SIZE)
+            file_ids = db.session.execute(batch).scalars().all()
+            if not file_ids:
+                break
+            invalidate_files(file_ids)
+            db.session.execute(
+                delete(File).where(File.id.in_(file_ids)).execution_options(synchronize_session=False)
+            )
+            deleted_files += len(file_ids)
+            ctx.progress(done, len(category_ids))
+        db.session.execute(delete(CategoryRule).where(CategoryRule.category_id == category_id))
+        db.session.execute(delete(Category).where(Category.id == category_id))
+        ctx.progress(done + 1, len(category_ids), force=True)
+    return {'categories': len(category_ids), 'files': deleted_files}
+
+@job_handler('apply_rules')
+def apply_rules(ctx):
+    """Categorize every pending file matched by the active rules"""
+    from autocategorize import apply_rules as apply_category_rules
+    assigned = apply_category_rules(progress=ctx.progress)
+    return {'assigned': assigned}
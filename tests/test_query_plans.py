@@ -0,0 +1,33 @@
+"""
+Query-plan regression check against a small datagen-seeded SQLite catalog
+Both scripts run in their own interpreter, since database.py binds the engine
+to DATABASE_URL at import time.
+"""
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import query_plans  # noqa: E402
+
+def _run(script, *args):
+    env = dict(os.environ, DB_PROFILE='batch')
+    env.pop('DATABASE_REPLICA_URLS', None)
+    return subprocess.run([sys.executable, os.path.join(ROOT, script), *args],
+                          capture_output=True, text=True, env=env, cwd=ROOT)
+
+def test_key_queries_use_an_index(tmp_path):
+    url = f"sqlite:///{tmp_path / 'plans.db'}"
+    seeded = _run('datagen.py', '--database-url', url, '--files', '5000', '--subscribers', '2000')
+    assert seeded.returncode == 0, seeded.stderr
+    result = _run('query_plans.py', '--database-url', url)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'All key queries use an index' in result.stdout
+
+def test_sqlite_full_scan_detection():
+    rows = [(2, 0, 0, 'SCAN files'), (3, 0, 0, 'SCAN categories USING INDEX ix_categories_parent_id')]
+    scans, plan = query_plans.full_scans(rows, postgres=False, tables={'files', 'categories'})
+    assert scans == ['files']
+    assert 'SCAN files' in plan
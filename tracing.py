@@ -0,0 +1,246 @@
+"""
+Span-based tracing for bot updates and admin panel requests
+A trace starts at each update or request and is kept with probability
+TRACE_SAMPLE_RATE. SQL statements and Bot API calls become child spans. Finished
+spans are written by a background thread to TRACE_FILE as JSON lines in the
+Zipkin v2 span format, which collectors accept as-is.
+"""
+import os
+import time
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "telegstore")
+# Spans waiting for the writer thread; spans are dropped rather than blocking handlers
+MAX_QUEUED_SPANS = 10000
+MAX_ATTRIBUTE_LENGTH = 300
+
+class Span:
+    """One timed operation within a trace"""
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start', 'start_wall',
+                 'duration', 'attributes', 'error')
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, kind: str = None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.start_wall = time.time()
+        self.duration = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        text = str(value)
+        self.attributes[key] = text if len(text) <= MAX_ATTRIBUTE_LENGTH else text[:MAX_ATTRIBUTE_LENGTH] + '...'
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self.start
+        if error is not None:
+            self.error = f'{type(error).__name__}: {error}'
+        exporter.export(self)
+
+    def to_dict(self) -> dict:
+        """Zipkin v2 JSON representation"""
+        tags = dict(self.attributes)
+        if self.error:
+            tags['error'] = self.error
+        span = {
+            'traceId': self.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': int(self.start_wall * 1_000_000),
+            'duration': max(1, int(self.duration * 1_000_000)),
+            'localEndpoint': {'serviceName': SERVICE_NAME},
+            'tags': tags,
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind:
+            span['kind'] = self.kind
+        return span
+
+class SpanExporter:
+    """Appends finished spans to a JSON lines file from a daemon thread"""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=MAX_QUEUED_SPANS)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _write(self, spans):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for span in spans:
+                    f.write(json.dumps(span.to_dict(), ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.error(f"Error writing {len(spans)} span(s) to {self.path}: {e}")
+
+    def _drain(self, first=None):
+        spans = [first] if first is not None else []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                return spans
+
+    def _run(self):
+        while True:
+            spans = self._drain(self._queue.get())
+            self._write(spans)
+
+    def flush(self):
+        """Write every queued span now"""
+        spans = self._drain()
+        if spans:
+            self._write(spans)
+
+exporter = SpanExporter()
+
+# The active span; _UNSAMPLED marks a trace that was not picked for sampling
+_UNSAMPLED = object()
+_current = contextvars.ContextVar('trace_span', default=None)
+
+def current_span():
+    span = _current.get()
+    return span if isinstance(span, Span) else None
+
+@contextmanager
+def trace(name: str, kind: str = 'SERVER', **attributes):
+    """Span for a unit of work: a sampled root at the top level, a child inside a trace"""
+    parent = _current.get()
+    if parent is _UNSAMPLED or (parent is None and random.random() >= TRACE_SAMPLE_RATE):
+        token = _current.set(_UNSAMPLED)
+        try:
+            yield None
+        finally:
+            _current.reset(token)
+        return
+
+    if parent is None:
+        span = Span(name, f'{random.getrandbits(128):032x}', kind=kind)
+    else:
+        span = Span(name, parent.trace_id, parent.span_id)
+    for key, value in attributes.items():
+        span.set_attribute(key, value)
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        _current.reset(token)
+        span.finish(e)
+        raise
+    _current.reset(token)
+    span.finish()
+
+def start_child(name: str, kind: str = None, **attributes):
+    """Start a child of the active span, or return None outside a sampled trace
+
+    The caller finishes the span; it does not become the active span.
+    """
+    parent = _current.get()
+    if not isinstance(parent, Span):
+        return None
+    span = Span(name, parent.trace_id, parent.span_id, kind)
+    for key, value in attributes.items():
+        span.set_attribute(key, value)
+    return span
+
+@contextmanager
+def child_span(name: str, kind: str = None, **attributes):
+    """Child span around a block; a no-op outside a sampled trace"""
+    span = start_child(name, kind, **attributes)
+    if span is None:
+        yield None
+        return
+    try:
+        yield span
+    except BaseException as e:
+        span.finish(e)
+        raise
+    span.finish()
+
+def trace_engine(engine):
+    """Record every SQL statement run inside a sampled trace as a child span"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._trace_span = start_child('sql', 'CLIENT', **{'db.statement': statement})
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, '_trace_span', None)
+        if span is not None:
+            context._trace_span = None
+            span.finish()
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(exception_context):
+        context = exception_context.execution_context
+        span = getattr(context, '_trace_span', None) if context is not None else None
+        if span is not None:
+            context._trace_span = None
+            span.finish(exception_context.original_exception)
+
+def trace_requests(app):
+    """Trace each admin panel request"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_trace():
+        manager = trace(f"{request.method} {request.endpoint or request.path}",
+                        **{'http.method': request.method, 'http.path': request.path})
+        span = manager.__enter__()
+        g.trace_manager = manager
+        if span is not None:
+            g.trace_span = span
+
+    @app.after_request
+    def _record_status(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+        return response
+
+    @app.teardown_request
+    def _finish_trace(exc=None):
+        manager = g.pop('trace_manager', None)
+        if manager is None:
+            return
+        if exc is not None:
+            try:
+                manager.__exit__(type(exc), exc, exc.__traceback__)
+            except BaseException:
+                pass
+        else:
+            manager.__exit__(None, None, None)
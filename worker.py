@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Background job worker
+Claims jobs that the admin panel queued in the jobs table and runs them one at
+a time (see jobs.py). Several workers can share a queue. SIGTERM/SIGINT let the
+running job stop at its next progress report and requeue it.
+
+Usage: python worker.py [--once] [--poll-interval SECONDS]
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# Seconds between heartbeats of the running job; keep well below JOB_STALE_AFTER
+HEARTBEAT_INTERVAL = 30.0
+# Seconds between sweeps for jobs left running by workers that died
+STALE_SWEEP_INTERVAL = 60.0
+
+class Worker:
+    """Polls the queue and runs claimed jobs"""
+
+    def __init__(self, app, poll_interval: float = JOB_POLL_INTERVAL):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+        self.current_job = None
+        self.last_sweep = 0.0
+
+    def request_stop(self, signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, stopping after the current job")
+        self.stopping.set()
+
+    def heartbeat_loop(self):
+        """Keep the running job's heartbeat fresh so other workers do not requeue it"""
+        from jobs import heartbeat
+        while True:
+            # Keeps beating after a stop request: the current job may still be finishing
+            time.sleep(HEARTBEAT_INTERVAL)
+            job_id = self.current_job
+            if job_id is None:
+                continue
+            try:
+                with self.app.app_context():
+                    heartbeat(job_id)
+            except Exception as e:
+                logger.error(f"Error writing heartbeat of job {job_id}: {e}")
+
+    def run_once(self) -> bool:
+        """Run the next due job, if any; True when one ran"""
+        from models import db
+        from jobs import claim_next, run_job, requeue_stale
+        with self.app.app_context():
+            try:
+                if time.monotonic() - self.last_sweep >= STALE_SWEEP_INTERVAL:
+                    self.last_sweep = time.monotonic()
+                    requeue_stale()
+                job = claim_next(self.worker_id)
+                if job is None:
+                    return False
+                self.current_job = job.id
+                run_job(job, stopping=self.stopping.is_set)
+                return True
+            finally:
+                self.current_job = None
+                db.session.remove()
+
+    def run(self, once: bool = False):
+        logger.info(f"Worker {self.worker_id} polling for jobs every {self.poll_interval:g}s")
+        threading.Thread(target=self.heartbeat_loop, name='job-heartbeat', daemon=True).start()
+        while not self.stopping.is_set():
+            try:
+                ran = self.run_once()
+            except Exception as e:
+                # Usually the database being unreachable; keep polling
+                logger.error(f"Worker error: {e}")
+                ran = False
+            if once and not ran:
+                break
+            if not ran:
+                self.stopping.wait(self.poll_interval)
+        logger.info(f"Worker {self.worker_id} stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued admin jobs")
+    parser.add_argument('--once', action='store_true', help="exit when the queue has no due jobs")
+    parser.add_argument('--poll-interval', type=float, default=JOB_POLL_INTERVAL,
+                        help="seconds to wait between polls of an empty queue")
+    args = parser.parse_args()
+    os.environ.setdefault("DB_PROFILE", "batch")
+
+    from log_config import configure_logging
+    configure_logging()
+    from database import app
+
+    metrics_port = os.getenv("WORKER_METRICS_PORT", "")
+    if metrics_port:
+        from metrics import start_http_server
+        start_http_server(int(metrics_port))
+
+    worker = Worker(app, args.poll_interval)
+    signal.signal(signal.SIGTERM, worker.request_stop)
+    signal.signal(signal.SIGINT, worker.request_stop)
+    worker.run(once=args.once)
+
+if __name__ == "__main__":
+    main()